@@ -3,9 +3,15 @@ const config = {
 };
 
 // Database cache management
+// The sync publishes each database under a content-addressed name and writes a
+// small manifest naming the current one. Clients poll the manifest and only
+// download a database whose hash differs from the one they already have.
+const DB_MANIFEST_URL = 'data/wif.db.manifest.json';
+const DB_BASE_DIR = 'data/';
+const DB_FALLBACK_URL = 'data/wif.db.sqlite';
 const DB_CACHE_KEY = 'wif_db_timestamp';
-const DB_CACHE_DURATION = 3 * 60 * 1000; // 3 minutes in milliseconds (reduced for more frequent updates)
-const DB_PERIODIC_REFRESH = 5 * 60 * 1000; // 5 minutes in milliseconds (reduced for more frequent updates)
+const DB_CACHE_DURATION = 3 * 60 * 1000; // 3 minutes in milliseconds between manifest checks on page focus
+const DB_PERIODIC_REFRESH = 1 * 60 * 1000; // 1 minute in milliseconds; only the tiny manifest is fetched
 
 // Log cache configuration
 console.log('Database cache configuration:', {
@@ -29,79 +35,215 @@ $.ajaxSetup({
 });
 
 function shouldRefreshDatabase() {
-    const lastLoaded = localStorage.getItem(DB_CACHE_KEY);
-    if (!lastLoaded) {
-        console.log('No previous database load timestamp found, refresh needed');
+    const lastChecked = localStorage.getItem(DB_CACHE_KEY);
+    if (!lastChecked) {
+        console.log('No previous database check timestamp found, refresh needed');
         return true;
     }
 
-    const timeSinceLastLoad = Date.now() - parseInt(lastLoaded);
-    const shouldRefresh = timeSinceLastLoad > DB_CACHE_DURATION;
+    const timeSinceLastCheck = Date.now() - parseInt(lastChecked);
+    const shouldRefresh = timeSinceLastCheck > DB_CACHE_DURATION;
 
     console.log('Database cache check:', {
-        lastLoaded: new Date(parseInt(lastLoaded)).toLocaleTimeString(),
-        timeSinceLastLoad: `${Math.round(timeSinceLastLoad / 1000 / 60 * 10) / 10} minutes ago`,
+        lastChecked: new Date(parseInt(lastChecked)).toLocaleTimeString(),
+        timeSinceLastCheck: `${Math.round(timeSinceLastCheck / 1000 / 60 * 10) / 10} minutes ago`,
         shouldRefresh: shouldRefresh
     });
 
     return shouldRefresh;
 }
 
-function generateCacheBuster() {
-    return Date.now() + '_' + Math.random().toString(36).substr(2, 9);
+// Fetches the manifest describing the currently published database
+function fetchDatabaseManifest() {
+    return new Promise((resolve, reject) => {
+        $.ajax({
+            url: DB_MANIFEST_URL,
+            dataType: 'json',
+            cache: false // The manifest is tiny and must always be current
+        }).done(function(manifest) {
+            localStorage.setItem(DB_CACHE_KEY, Date.now().toString());
+            resolve(manifest);
+        }).fail(function(xhr, status, error) {
+            reject(new Error(`Failed to load database manifest: ${status} - ${error}`));
+        });
+    });
 }
 
-function loadDatabase(forceRefresh = false) {
+// Fetches a binary file as a Uint8Array
+function fetchBytes(url) {
     return new Promise((resolve, reject) => {
-        initSqlJs(config).then(function(SQL){
-            const baseURL = 'data/wif.db.sqlite';
-
-            // Add cache busting parameters if refresh is needed or forced
-            let dbURL = baseURL;
-            if (forceRefresh || shouldRefreshDatabase()) {
-                const cacheBuster = generateCacheBuster();
-                dbURL = `${baseURL}?v=${cacheBuster}`;
-                console.log('Loading fresh database with cache buster:', cacheBuster);
-            } else {
-                console.log('Using potentially cached database');
-            }
+        $.ajax({
+            url: url,
+            mimeType: 'text/plain; charset=x-user-defined',
+            dataType: 'binary'
+        }).done(function(data) {
+            resolve(data);
+        }).fail(function(xhr, status, error) {
+            reject(new Error(`Failed to load ${url}: ${status} - ${error}`));
+        });
+    });
+}
+
+function openDatabase(bytes, hash) {
+    return initSqlJs(config).then(function(SQL){
+        const db = new SQL.Database(bytes);
+
+        // Make the database available globally. The raw bytes are kept as the
+        // base for the next delta.
+        window.db = db;
+        window.dbHash = hash;
+        window.dbBytes = hash ? bytes : null;
+
+        console.log('Database loaded successfully at:', new Date().toLocaleTimeString(), hash || '(unversioned)');
+        return db;
+    });
+}
+
+function downloadDatabase(url, hash) {
+    // Content-addressed files never change, so they may come from the HTTP cache
+    return fetchBytes(url).then(bytes => openDatabase(bytes, hash));
+}
+
+// ETag and Last-Modified of the loaded fallback database, and when it was loaded
+let fallbackValidators = null;
+let fallbackLoadedAt = 0;
+
+// Loads the fixed-name database when there is no manifest. Polling it downloads
+// the file again only if the server reports a change; a server that sends no
+// validators is asked at most every DB_CACHE_DURATION.
+function loadFallbackDatabase() {
+    const loaded = window.db && !window.dbHash;
+    const unchanged = { db: window.db, changed: false };
+    const headers = {};
+    if (loaded && fallbackValidators) {
+        if (fallbackValidators.etag) {
+            headers['If-None-Match'] = fallbackValidators.etag;
+        }
+        if (fallbackValidators.lastModified) {
+            headers['If-Modified-Since'] = fallbackValidators.lastModified;
+        }
+    }
+    if (loaded && !Object.keys(headers).length && Date.now() - fallbackLoadedAt < DB_CACHE_DURATION) {
+        return Promise.resolve(unchanged);
+    }
+
+    let response;
+    return new Promise((resolve, reject) => {
+        $.ajax({
+            url: DB_FALLBACK_URL,
+            mimeType: 'text/plain; charset=x-user-defined',
+            dataType: 'binary',
+            headers: headers
+        }).done(function(data, status, xhr) {
+            response = xhr;
+            resolve(xhr.status === 304 ? undefined : data);
+        }).fail(function(xhr, status, error) {
+            reject(new Error(`Failed to load ${DB_FALLBACK_URL}: ${status} - ${error}`));
+        });
+    }).then(function(bytes) {
+        if (bytes === undefined) {
+            console.log('Fallback database is unchanged');
+            return unchanged;
+        }
+        const etag = response.getResponseHeader('ETag');
+        const lastModified = response.getResponseHeader('Last-Modified');
+        return openDatabase(bytes, null).then(function(db) {
+            fallbackValidators = (etag || lastModified) ? { etag: etag, lastModified: lastModified } : null;
+            fallbackLoadedAt = Date.now();
+            return { db: db, changed: true };
+        });
+    });
+}
+
+// Rebuilds a snapshot from its base and a page delta written by python/db_delta.py:
+// "WIFD", page size, new page count, changed page count (uint32 big-endian),
+// then (page number, page bytes) for every changed page.
+function applyDatabaseDelta(base, delta) {
+    if (delta.byteLength < 16) {
+        throw new Error('Truncated database delta');
+    }
+    const view = new DataView(delta.buffer, delta.byteOffset, delta.byteLength);
+    const magic = String.fromCharCode(delta[0], delta[1], delta[2], delta[3]);
+    if (magic !== 'WIFD') {
+        throw new Error('Not a database delta');
+    }
+    const pageSize = view.getUint32(4);
+    const pageCount = view.getUint32(8);
+    const changedCount = view.getUint32(12);
+    if (delta.byteLength !== 16 + changedCount * (4 + pageSize)) {
+        throw new Error('Truncated database delta');
+    }
+
+    const result = new Uint8Array(pageCount * pageSize);
+    result.set(base.subarray(0, result.length));
+    let offset = 16;
+    for (let i = 0; i < changedCount; i++) {
+        const pageNumber = view.getUint32(offset);
+        if (pageNumber >= pageCount) {
+            throw new Error('Database delta page out of range');
+        }
+        result.set(delta.subarray(offset + 4, offset + 4 + pageSize), pageNumber * pageSize);
+        offset += 4 + pageSize;
+    }
+    return result;
+}
+
+function sha256Hex(bytes) {
+    // crypto.subtle only exists in secure contexts; elsewhere the delta is trusted
+    if (!window.crypto || !window.crypto.subtle) {
+        return Promise.resolve(null);
+    }
+    return window.crypto.subtle.digest('SHA-256', bytes).then(digest =>
+        Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join(''));
+}
+
+// Patches the loaded database up to the manifest's version, if a delta from it was published
+function patchDatabase(manifest) {
+    const delta = window.dbBytes && manifest.deltas && manifest.deltas[window.dbHash];
+    if (!delta) {
+        return Promise.reject(new Error('No delta from the loaded database'));
+    }
 
-            $.ajax({
-                url: dbURL,
-                mimeType: 'text/plain; charset=x-user-defined',
-                responseType: 'arraybuffer',
-                cache: false, // Disable jQuery cache
-                headers: {
-                    'Cache-Control': 'no-cache, no-store, must-revalidate',
-                    'Pragma': 'no-cache',
-                    'Expires': '0'
-                }
-            }).done(function(data) {
-                try {
-                    const db = new SQL.Database(data);
-
-                    // Make the database available globally
-                    window.db = db;
-
-                    // Update cache timestamp
-                    localStorage.setItem(DB_CACHE_KEY, Date.now().toString());
-
-                    console.log('Database loaded successfully at:', new Date().toLocaleTimeString());
-                    resolve(db);
-                } catch (error) {
-                    console.error('Error creating database:', error);
-                    reject(error);
-                }
-            }).fail(function(xhr, status, error) {
-                console.error('Failed to load database:', status, error);
-                reject(new Error(`Failed to load database: ${status} - ${error}`));
+    console.log(`Patching database with ${delta.file} (${delta.size} bytes instead of ${manifest.size})`);
+    return fetchBytes(DB_BASE_DIR + delta.file).then(function(deltaBytes) {
+        const bytes = applyDatabaseDelta(window.dbBytes, deltaBytes);
+        return sha256Hex(bytes).then(function(hash) {
+            if (hash && hash !== manifest.hash) {
+                throw new Error('Patched database does not match the manifest hash');
+            }
+            const previous = window.db;
+            return openDatabase(bytes, manifest.hash).then(function(db) {
+                previous.close();
+                return db;
             });
-        }).catch(reject);
+        });
+    });
+}
+
+// Resolves with { db, changed } once the newest published database is loaded
+function loadDatabase() {
+    return fetchDatabaseManifest().then(function(manifest) {
+        if (window.db && window.dbHash === manifest.hash) {
+            console.log('Database is current:', manifest.hash);
+            return { db: window.db, changed: false };
+        }
+        return patchDatabase(manifest).catch(function(error) {
+            if (window.dbBytes) {
+                console.warn(error.message + ', downloading the full database');
+            }
+            console.log('Loading published database:', manifest.file);
+            return downloadDatabase(DB_BASE_DIR + manifest.file, manifest.hash);
+        }).then(function(db) {
+            return { db: db, changed: true };
+        });
+    }, function(error) {
+        console.warn(error.message + ', loading ' + DB_FALLBACK_URL);
+        return loadFallbackDatabase();
     });
 }
 
 // Global promise for database readiness
-let dbReadyPromise = loadDatabase();
+let dbReadyPromise = loadDatabase().then(result => result.db);
 
 // Periodic database refresh
 let refreshInterval;
@@ -113,15 +255,18 @@ function startPeriodicRefresh() {
     }
 
     refreshInterval = setInterval(() => {
-        console.log('Performing periodic database refresh...');
-        dbReadyPromise = loadDatabase(true); // Force refresh
+        console.log('Checking for a newer published database...');
+        loadDatabase().then(result => {
+            if (!result.changed) {
+                return;
+            }
+            dbReadyPromise = Promise.resolve(result.db);
 
-        // Notify any listeners about the refresh
-        if (window.onDatabaseRefresh && typeof window.onDatabaseRefresh === 'function') {
-            dbReadyPromise.then(() => {
+            // Notify any listeners about the refresh
+            if (window.onDatabaseRefresh && typeof window.onDatabaseRefresh === 'function') {
                 window.onDatabaseRefresh();
-            });
-        }
+            }
+        }).catch(error => console.error('Periodic database refresh failed:', error));
     }, DB_PERIODIC_REFRESH);
 }
 
@@ -133,10 +278,10 @@ function whenDbReady() {
     return dbReadyPromise;
 }
 
-// Function to manually refresh database
+// Function to manually refresh database; only downloads if a newer one was published
 function refreshDatabase() {
     console.log('Manual database refresh requested');
-    dbReadyPromise = loadDatabase(true);
+    dbReadyPromise = loadDatabase().then(result => result.db);
     return dbReadyPromise;
 }
 
@@ -117,6 +117,29 @@ function parseProduct(product) {
                 product.images = [];
             }
         }
+        // product_catalog rows carry their attributes as a JSON object of key_name -> [values]
+        if (typeof product.attributes === 'string') {
+            try {
+                product.attributes = JSON.parse(product.attributes);
+            } catch (e) {
+                console.error('Failed to parse attributes JSON:', e);
+                product.attributes = {};
+            }
+        }
+        // image_srcsets maps each image path to its responsive derivatives: format -> srcset
+        if (typeof product.image_srcsets === 'string') {
+            try {
+                product.image_srcsets = JSON.parse(product.image_srcsets);
+            } catch (e) {
+                console.error('Failed to parse image srcsets JSON:', e);
+                product.image_srcsets = {};
+            }
+        }
+        var srcsets = product.image_srcsets || {};
+        product.main_image_srcset = srcsets[product.main_image_url] || null;
+        product.gallery = (product.images || []).map(function(url) {
+            return { url: url, srcset: srcsets[url] || null };
+        });
     }
     return product;
 }
@@ -127,40 +150,21 @@ function parseProduct(product) {
 
 function productList_before_load() {
     return whenDbReady().then(function() {
-        // Fetch all products ordered by display_order
-        var products = queryDatabase("SELECT * FROM products ORDER BY display_order ASC");
+        // Fetch all products, with their attributes pre-joined, ordered by display_order
+        var products = queryDatabase("SELECT * FROM product_catalog ORDER BY display_order ASC");
         products.forEach(parseProduct);
-
-        // Fetch all product-attribute relations
-        var productAttributes = queryDatabase("SELECT pa.product_id, ak.key_name, a.value FROM product_attributes pa JOIN attributes a ON pa.attribute_id = a.id JOIN attribute_keys ak ON a.key_id = ak.id");
-
-        // Attach attributes to each product
-        products.forEach(function(product) {
-            product.attributes = {};
-            productAttributes.forEach(function(attr) {
-                if (attr.product_id === product.id) {
-                    if (!product.attributes[attr.key_name]) {
-                        product.attributes[attr.key_name] = [];
-                    }
-                    product.attributes[attr.key_name].push(attr.value);
-                }
-            });
-        });
         
         // Store all products for client-side filtering
         window.allProducts = products;
 
         // Fetch all available filters
         var filters = {};
-        var attributeKeys = queryDatabase("SELECT * FROM attribute_keys");
-        attributeKeys.forEach(function(key) {
-            var attributeValues = queryDatabase("SELECT DISTINCT value FROM attributes WHERE key_id = " + key.id + " ORDER BY value");
-            if (attributeValues.length > 0) {
-                 filters[key.key_name] = {
-                    key_id: key.id,
-                    values: attributeValues.map(function(v) { return v.value; })
-                };
+        var attributeValues = queryDatabase("SELECT ak.id AS key_id, ak.key_name, a.value FROM attribute_keys ak JOIN attributes a ON a.key_id = ak.id ORDER BY ak.id, a.value");
+        attributeValues.forEach(function(row) {
+            if (!filters[row.key_name]) {
+                filters[row.key_name] = { key_id: row.key_id, values: [] };
             }
+            filters[row.key_name].values.push(row.value);
         });
 
         return { products: products, filters: filters };
@@ -345,19 +349,20 @@ function productDetails_before_load() {
     var productId = parseInt(params.id, 10);
     if (productId) {
         return whenDbReady().then(function() {
-            var products = queryDatabase("SELECT * FROM products WHERE id = " + productId);
+            var products = queryDatabase("SELECT * FROM product_catalog WHERE id = " + productId);
             if (products.length > 0) {
                 var product = parseProduct(products[0]);
-                var attributes = queryDatabase("SELECT ak.key_name, a.value FROM attributes a JOIN attribute_keys ak ON a.key_id = ak.id JOIN product_attributes pa ON a.id = pa.attribute_id WHERE pa.product_id = " + productId);
                 
                 product.categories = [];
                 product.details = {};
                 
-                attributes.forEach(function(attr) {
-                    if (attr.key_name === 'category') {
-                        product.categories.push(attr.value);
+                Object.keys(product.attributes).forEach(function(keyName) {
+                    var values = product.attributes[keyName];
+                    if (keyName === 'category') {
+                        product.categories = product.categories.concat(values);
                     } else {
-                        product.details[attr.key_name] = attr.value;
+                        // Show every value of attributes that have several
+                        product.details[keyName] = values.join(', ');
                     }
                 });
 
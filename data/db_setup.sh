@@ -4,7 +4,7 @@
 # Set the project root directory relative to the script location
 cd "$(dirname "$0")/.."
 
-DB_FILE="data/wif.db.sqlite"
+WORK_FILE="data/wif.work.sqlite"
 SCHEMA_FILE="data/schema.sql"
 DATA_FILE="data/initial_data.sql"
 
@@ -15,17 +15,19 @@ then
     exit 1
 fi
 
-# Remove the old database file if it exists
-if [ -f "$DB_FILE" ]; then
-    rm "$DB_FILE"
-    echo "Removed existing database file: $DB_FILE"
+# Remove the old working database if it exists
+if [ -f "$WORK_FILE" ]; then
+    rm "$WORK_FILE"
+    echo "Removed existing working database: $WORK_FILE"
 fi
 
 # Create and populate the new database
 echo "Creating new database..."
-sqlite3 "$DB_FILE" < "$SCHEMA_FILE"
+sqlite3 "$WORK_FILE" < "$SCHEMA_FILE"
 echo "Database schema created."
-sqlite3 "$DB_FILE" < "$DATA_FILE"
+sqlite3 "$WORK_FILE" < "$DATA_FILE"
 echo "Initial data loaded."
 
-echo "Database setup complete: $DB_FILE"
+# Publish it atomically as data/wif.db.sqlite plus a content-addressed copy and manifest
+python3 python/publish.py "$WORK_FILE" data
+echo "Database setup complete: data/wif.db.sqlite"
@@ -1,6 +1,7 @@
 
 
 -- Drop existing tables to start with a clean slate.
+DROP TABLE IF EXISTS product_catalog;
 DROP TABLE IF EXISTS product_attributes;
 DROP TABLE IF EXISTS attributes;
 DROP TABLE IF EXISTS attribute_keys;
@@ -19,9 +20,16 @@ CREATE TABLE products (
     -- JSON array of image URLs, e.g., '[".../product-7.jpg", ".../product-8.jpg"]'
     images TEXT,
     -- The main image to display on the product page.
-    main_image_url VARCHAR(255)
+    main_image_url VARCHAR(255),
+    -- The Airtable record this product is synced from.
+    airtable_id TEXT,
+    -- Position of the product in the Airtable view.
+    display_order INTEGER
 );
 
+CREATE UNIQUE INDEX idx_products_airtable_id ON products(airtable_id);
+CREATE INDEX idx_products_display_order ON products(display_order);
+
 -- Table for attribute keys (e.g., 'category', 'brand').
 CREATE TABLE attribute_keys (
     id INTEGER PRIMARY KEY,
@@ -46,3 +54,9 @@ CREATE TABLE product_attributes (
     PRIMARY KEY (product_id, attribute_id)
 );
 
+-- Finds the products carrying an attribute; the primary key covers the other direction.
+CREATE INDEX idx_product_attributes_attribute_id ON product_attributes(attribute_id);
+
+-- The denormalized product_catalog table read by the SPA is built by
+-- python/publish.py (run by db_setup.sh and at the end of every Airtable sync).
+
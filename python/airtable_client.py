@@ -0,0 +1,167 @@
+"""
+Shared HTTP client for the Airtable API.
+
+Airtable allows 5 requests per second per base and answers bursts above that
+with 429, after which clients must back off for 30 seconds. This client keeps
+one persistent session, paces requests with a token bucket set to that limit,
+and retries throttled or transient failures with jittered exponential backoff
+that honours Retry-After. Counters for requests, retries and time spent
+throttled are kept so scripts can report them.
+
+Point AIRTABLE_API_URL at a local server to run against a fake Airtable.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+DEFAULT_API_URL = "https://api.airtable.com"
+REQUESTS_PER_SECOND = 5
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds, doubled on every retry
+BACKOFF_MAX = 60.0
+THROTTLE_PENALTY = 30.0  # Airtable's documented wait after a 429
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes one token and returns the number of seconds spent waiting for it."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AirtableClient:
+    """Rate-limited, retrying access to one Airtable base."""
+
+    def __init__(self, pat: str, base_id: str, api_url: Optional[str] = None,
+                 requests_per_second: float = REQUESTS_PER_SECOND, max_retries: int = MAX_RETRIES):
+        self.base_id = base_id
+        self.api_url = (api_url or os.getenv("AIRTABLE_API_URL") or DEFAULT_API_URL).rstrip('/')
+        self.max_retries = max_retries
+        self.limiter = TokenBucket(requests_per_second)
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {pat}"
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "throttled_seconds": 0.0}
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _count(self, name: str, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Seconds to wait before the next attempt: Retry-After if given, else full jitter."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+            if response.status_code == 429:
+                return THROTTLE_PENALTY
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def get_json(self, path: str, params: Optional[Dict] = None) -> Dict:
+        """GETs an API path (e.g. 'v0/<base>/<table>') and returns the decoded JSON body."""
+        url = f"{self.api_url}/{path.lstrip('/')}"
+        for attempt in range(self.max_retries + 1):
+            self._count("throttled_seconds", self.limiter.acquire())
+            self._count("requests")
+            response = None
+            try:
+                response = self.session.get(url, params=params, timeout=60)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                if response.status_code == 429:
+                    self._count("throttled")
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Airtable request failed: {e}")
+
+            delay = self._backoff(attempt, response)
+            if response is not None and response.status_code == 429:
+                self._count("throttled_seconds", delay)
+            self._count("retries")
+            print(f"Retrying {path} in {delay:.1f}s (attempt {attempt + 2} of {self.max_retries + 1})...")
+            time.sleep(delay)
+
+    def iter_pages(self, table_id: str, view_name: Optional[str] = None,
+                   filter_formula: Optional[str] = None) -> Iterator[List[Dict]]:
+        """
+        Yields the records of a table one page at a time. The next page is
+        fetched in the background while the caller processes the current one, so
+        only two pages are ever held in memory. Failed pages are retried from the
+        same offset.
+        """
+        path = f"v0/{self.base_id}/{table_id}"
+        params = {}
+
+        # Add view parameter if specified
+        if view_name:
+            params["view"] = view_name
+            print(f"Using view: {view_name}")
+        if filter_formula:
+            params["filterByFormula"] = filter_formula
+
+        def fetch_page(offset=None):
+            return self.get_json(path, dict(params, offset=offset) if offset else params)
+
+        print(f"Fetching records from table {table_id}...")
+        record_count = 0
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            next_page = prefetcher.submit(fetch_page)
+            while next_page:
+                data = next_page.result()
+                offset = data.get('offset')
+                next_page = prefetcher.submit(fetch_page, offset) if offset else None
+                records = data.get('records', [])
+                record_count += len(records)
+                yield records
+        print(f"Fetched {record_count} records.")
+
+    def fetch_schema(self) -> Dict:
+        """Returns the table schema of the base from the metadata API."""
+        return self.get_json(f"v0/meta/bases/{self.base_id}/tables")
+
+    def print_stats(self):
+        stats = self.stats
+        print(f"Airtable API: {stats['requests']} requests, {stats['retries']} retries, "
+              f"{stats['throttled']} throttled, {stats['throttled_seconds']:.1f}s spent throttled")
@@ -3,6 +3,8 @@ import requests
 import json
 from dotenv import load_dotenv
 
+from airtable_client import AirtableClient
+
 def fetch_airtable_schema():
     """
     Fetches the schema from Airtable for a specific base and saves it to a file.
@@ -16,16 +18,10 @@ def fetch_airtable_schema():
         print("Error: AIRTABLE_PAT and AIRTABLE_BASE_ID must be set in your environment or a .env file.")
         return
 
-    url = f"https://api.airtable.com/v0/meta/bases/{base_id}/tables"
-    headers = {
-        "Authorization": f"Bearer {pat}"
-    }
-
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
-
-        schema = response.json()
+        with AirtableClient(pat, base_id) as client:
+            # Raises an HTTPError for bad responses (4xx or 5xx) once retries are exhausted
+            schema = client.fetch_schema()
 
         output_file = "../data/airtable_schema.json"
         with open(output_file, 'w', encoding='utf-8') as f:
@@ -1,83 +1,55 @@
 import os
+import argparse
 import requests
 import json
+import shutil
 import sqlite3
 from dotenv import load_dotenv
-from urllib.parse import urlparse
+
+from airtable_client import AirtableClient
+from image_derivatives import ensure_derivative_tables, product_image_paths, update_derivatives
+from image_downloader import DEFAULT_WORKERS
+from image_store import ImageStore, ensure_image_tables
+from publish import PUBLISH_DIR, publish_database
+from sync_state import (
+    INCOMPLETE, ensure_sync_tables, format_timestamp, get_sync_state, incomplete_records,
+    load_fingerprints, modified_since_formula, needs_full_sync, prune_fingerprints,
+    record_fingerprint, save_fingerprints, save_sync_state, utc_now,
+)
 
 # --- Configuration (paths are relative to project root) ---
-DB_PATH = "data/wif.db.sqlite"
+# The sync works on a private database; the published catalog is built from it
+DB_PATH = "data/wif.work.sqlite"
+PUBLISHED_DB_PATH = "data/wif.db.sqlite"
 SCHEMA_PATH = "data/schema.sql"
 IMAGES_DIR = "assets/images/shop"
 
+# Pragmas for the sync connection: WAL lets the bulk writes skip the rollback
+# journal, and the database is switched back to a single file when we're done.
+SYNC_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # KiB, i.e. ~64 MB of page cache
+    "temp_store": "MEMORY",
+}
+
 # From data/airtable_schema.json
 INVENTORY_ITEMS_TABLE_ID = "tblVKOTcBAJTYpBau"
 INVENTORY_ATTRIBUTES_TABLE_ID = "tblNvN1I84izhSlzn"
 
 # --- Helper Functions ---
 
-def fetch_all_airtable_records(base_id, pat, table_id, view_name=None):
-    """Fetches all records from an Airtable table, handling pagination."""
-    records = []
-    url = f"https://api.airtable.com/v0/{base_id}/{table_id}"
-    headers = {"Authorization": f"Bearer {pat}"}
-    params = {}
-
-    # Add view parameter if specified
-    if view_name:
-        params["view"] = view_name
-        print(f"Using view: {view_name}")
-
-    print(f"Fetching records from table {table_id}...")
-    while True:
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-            records.extend(data.get('records', []))
-            
-            offset = data.get('offset')
-            if offset:
-                params['offset'] = offset
-            else:
-                break
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching from Airtable: {e}")
-            return None
-    print(f"Fetched {len(records)} records.")
-    return records
-
-def download_image_if_not_exists(url, target_dir, filename=None):
-    """Downloads an image from a URL to a target directory if it doesn't exist, and returns the web-accessible path."""
-    try:
-        # Use provided filename or fall back to URL-based name
-        if not filename:
-            filename = os.path.basename(urlparse(url).path)
-        local_path = os.path.join(target_dir, filename)
-        
-        # The web path should always use forward slashes.
-        web_path = os.path.join(IMAGES_DIR, filename).replace(os.path.sep, '/')
-
-        if not os.path.exists(local_path):
-            print(f"Downloading: {filename}")
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        
-        return web_path
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading {url}: {e}")
-        return None
-    except Exception as e:
-        print(f"An error occurred processing {url}: {e}")
-        return None
-
 def setup_database():
     """Sets up the SQLite database, creating it if it doesn't exist."""
+    # Start from the published catalog so product ids stay stable
+    if not os.path.exists(DB_PATH) and os.path.exists(PUBLISHED_DB_PATH):
+        shutil.copyfile(PUBLISHED_DB_PATH, DB_PATH)
+        print(f"Created working database from {PUBLISHED_DB_PATH}")
+
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    for pragma, value in SYNC_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
 
     # Check if tables exist, if not create them
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='products'")
@@ -94,16 +66,25 @@ def setup_database():
     else:
         print("Database already exists, performing incremental sync")
 
+    ensure_sync_tables(cursor)
+    ensure_image_tables(cursor)
+    ensure_derivative_tables(cursor)
     conn.commit()
     return conn, cursor
 
-def sync_products(conn, cursor, inventory_items):
-    """Syncs the products table with Airtable 'Inventory Items' records."""
-    print("Syncing 'products' table...")
-    airtable_id_to_sqlite_id = {}
+def close_database(conn):
+    """Folds the WAL back into the database file so it can be served as a single file."""
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
 
-    # Ensure the target directory for images exists
-    os.makedirs(IMAGES_DIR, exist_ok=True)
+def sync_products(conn, cursor, inventory_pages, download_workers=DEFAULT_WORKERS, full_sync=True):
+    """
+    Syncs the products table with Airtable 'Inventory Items' records, consuming
+    them one page at a time. On a full sync the pages cover the whole view:
+    display order is taken from it and missing products are deleted. Otherwise
+    they hold only changed records.
+    """
+    print("Syncing 'products' table...")
 
     # First, add airtable_id column if it doesn't exist
     cursor.execute("PRAGMA table_info(products)")
@@ -117,131 +98,200 @@ def sync_products(conn, cursor, inventory_items):
         cursor.execute("ALTER TABLE products ADD COLUMN display_order INTEGER")
         print("Added display_order column to products table")
 
+    # Upserts below resolve conflicts on airtable_id
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_airtable_id ON products(airtable_id)")
+
     # Get current Airtable IDs from the database
-    cursor.execute("SELECT id, airtable_id FROM products WHERE airtable_id IS NOT NULL")
-    existing_products = {airtable_id: sqlite_id for sqlite_id, airtable_id in cursor.fetchall()}
+    cursor.execute("SELECT id, airtable_id, display_order FROM products WHERE airtable_id IS NOT NULL")
+    existing_products = {}
+    existing_order = {}
+    for sqlite_id, airtable_id, order in cursor.fetchall():
+        existing_products[airtable_id] = sqlite_id
+        existing_order[airtable_id] = order
+    next_display_order = max([o for o in existing_order.values() if o is not None], default=0) + 1
 
     # Track which Airtable IDs we see in this sync
     current_airtable_ids = set()
+    current_attachment_ids = set()
 
-    for index, item in enumerate(inventory_items):
-        airtable_id = item['id']
-        current_airtable_ids.add(airtable_id)
-        fields = item.get('fields', {})
-        display_order = index + 1  # 1-based ordering based on Airtable position
-
-        title = fields.get('Item Name')
-        if not title:
-            continue # Skip records without a title
-
-        description = fields.get('Description', '')
-        price = fields.get('Price', 0.0)
-        quantity = fields.get('Quantity', 1)
-
-        airtable_images = fields.get('Images', [])
-        local_image_paths = []
-        if airtable_images:
-            for img in airtable_images:
-                if 'url' in img:
-                    filename = img.get('filename')
-                    local_path = download_image_if_not_exists(img['url'], IMAGES_DIR, filename)
-                    if local_path:
-                        local_image_paths.append(local_path)
-
-        main_image_path = local_image_paths[0] if local_image_paths else None
-        images_json = json.dumps(local_image_paths)
-
-        # Assuming USD from Airtable's '$' symbol, as seen in schema.json
-        currency = 'USD'
-
-        if airtable_id in existing_products:
-            # Update existing product
-            sqlite_id = existing_products[airtable_id]
-            cursor.execute("""
-                UPDATE products
-                SET title=?, description=?, price=?, quantity=?, currency=?, images=?, main_image_url=?, display_order=?
-                WHERE id=?
-            """, (title, description, price, quantity, currency, images_json, main_image_path, display_order, sqlite_id))
-            airtable_id_to_sqlite_id[airtable_id] = sqlite_id
-        else:
-            # Insert new product
-            cursor.execute("""
+    # Ensure the target directory for images exists
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    image_store = ImageStore(cursor, IMAGES_DIR)
+
+    fingerprints = load_fingerprints(cursor, INVENTORY_ITEMS_TABLE_ID)
+    fetched_count = 0
+    written_count = 0
+    incomplete_count = 0
+
+    with conn:
+        for page in inventory_pages:
+            # Only records whose content or position changed are written
+            changed_items = []
+            for item in page:
+                airtable_id = item['id']
+                fetched_count += 1
+                current_airtable_ids.add(airtable_id)
+                current_attachment_ids.update(img.get('id') for img in item.get('fields', {}).get('Images', []))
+                if full_sync:
+                    display_order = fetched_count  # 1-based ordering based on Airtable position
+                elif airtable_id in existing_order:
+                    display_order = existing_order[airtable_id]
+                else:
+                    display_order = next_display_order
+                    next_display_order += 1
+
+                fingerprint = record_fingerprint(item)
+                if (airtable_id in existing_products and fingerprints.get(airtable_id) == fingerprint
+                        and existing_order[airtable_id] == display_order):
+                    continue
+                fingerprints[airtable_id] = fingerprint
+                changed_items.append((item, display_order))
+
+            # Fetch the page's changed images, then write its rows with a single upsert
+            product_images, incomplete = image_store.resolve([item for item, _ in changed_items], download_workers)
+            # Records with missing images are written without them and retried next run
+            for airtable_id in incomplete:
+                fingerprints[airtable_id] = INCOMPLETE
+            incomplete_count += len(incomplete)
+
+            product_rows = []
+            for item, display_order in changed_items:
+                airtable_id = item['id']
+                fields = item.get('fields', {})
+
+                title = fields.get('Item Name')
+                if not title:
+                    continue # Skip records without a title
+
+                description = fields.get('Description', '')
+                price = fields.get('Price', 0.0)
+                quantity = fields.get('Quantity', 1)
+
+                local_image_paths = product_images.get(airtable_id, [])
+
+                main_image_path = local_image_paths[0] if local_image_paths else None
+                images_json = json.dumps(local_image_paths)
+
+                # Assuming USD from Airtable's '$' symbol, as seen in schema.json
+                currency = 'USD'
+
+                product_rows.append((title, description, price, quantity, currency, images_json,
+                                     main_image_path, airtable_id, display_order))
+
+            cursor.executemany("""
                 INSERT INTO products (title, description, price, quantity, currency, images, main_image_url, airtable_id, display_order)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (title, description, price, quantity, currency, images_json, main_image_path, airtable_id, display_order))
-
-            sqlite_id = cursor.lastrowid
-            airtable_id_to_sqlite_id[airtable_id] = sqlite_id
-
-    # Delete products that no longer exist in Airtable
-    products_to_delete = set(existing_products.keys()) - current_airtable_ids
-    if products_to_delete:
-        placeholders = ','.join(['?' for _ in products_to_delete])
-        cursor.execute(f"DELETE FROM products WHERE airtable_id IN ({placeholders})", list(products_to_delete))
-        print(f"Deleted {len(products_to_delete)} products no longer in Airtable")
-
-    conn.commit()
-    print(f"Synced {len(airtable_id_to_sqlite_id)} products.")
+                ON CONFLICT(airtable_id) DO UPDATE SET
+                    title=excluded.title, description=excluded.description, price=excluded.price,
+                    quantity=excluded.quantity, currency=excluded.currency, images=excluded.images,
+                    main_image_url=excluded.main_image_url, display_order=excluded.display_order
+            """, product_rows)
+            save_fingerprints(cursor, INVENTORY_ITEMS_TABLE_ID,
+                              {item['id']: fingerprints[item['id']] for item, _ in changed_items})
+            written_count += len(product_rows)
+
+        # Delete products that no longer exist in Airtable (only a full fetch can tell)
+        products_to_delete = set(existing_products.keys()) - current_airtable_ids if full_sync else set()
+        if products_to_delete:
+            cursor.executemany("DELETE FROM products WHERE airtable_id = ?",
+                               [(airtable_id,) for airtable_id in products_to_delete])
+            print(f"Deleted {len(products_to_delete)} products no longer in Airtable")
+
+        if full_sync:
+            prune_fingerprints(cursor, INVENTORY_ITEMS_TABLE_ID, current_airtable_ids)
+
+    # Stale image files are removed only once the rows pointing away from them are committed
+    if full_sync:
+        with conn:
+            image_store.prune(current_attachment_ids)
+
+    # Unchanged products are not rewritten but still need to be linked to attributes
+    cursor.execute("SELECT airtable_id, id FROM products WHERE airtable_id IS NOT NULL")
+    airtable_id_to_sqlite_id = dict(cursor.fetchall())
+    print(f"{written_count} of {fetched_count} fetched products changed.")
+    print(f"Synced {len(airtable_id_to_sqlite_id)} products ({written_count} written).")
+    if incomplete_count:
+        print(f"Failed: {incomplete_count} products have images that could not be downloaded; "
+              f"they will be retried on the next run.")
     return airtable_id_to_sqlite_id
 
-def populate_attributes(conn, cursor, inventory_attributes, product_id_map):
-    """Populates attribute-related tables."""
+def populate_attributes(conn, cursor, attribute_pages, product_id_map, full_sync=True):
+    """
+    Populates attribute-related tables, consuming records one page at a time.
+    A full sync re-applies every record so links to newly titled products are
+    repaired; incremental syncs skip records whose fingerprint is unchanged.
+    """
     print("Populating attribute tables...")
     
-    key_cache = {} # key_name -> key_id
-    attribute_cache = {} # (key_id, value) -> attribute_id
+    fingerprints = load_fingerprints(cursor, INVENTORY_ATTRIBUTES_TABLE_ID)
+    current_attribute_ids = set()
     insert_count = 0
-    
-    for attr in inventory_attributes:
-        fields = attr.get('fields', {})
-        key_name = fields.get('Key')
-        value = fields.get('Value')
-        related_item_ids = fields.get('Related Inventory Items', [])
-        
-        if not key_name or not value or not related_item_ids:
-            continue
-            
-        # --- Handle attribute_keys ---
-        if key_name not in key_cache:
-            cursor.execute("SELECT id FROM attribute_keys WHERE key_name = ?", (key_name,))
-            result = cursor.fetchone()
-            if result:
-                key_id = result[0]
-            else:
-                cursor.execute("INSERT INTO attribute_keys (key_name) VALUES (?)", (key_name,))
-                key_id = cursor.lastrowid
-            key_cache[key_name] = key_id
-        else:
-            key_id = key_cache[key_name]
-            
-        # --- Handle attributes ---
-        if (key_id, value) not in attribute_cache:
-            cursor.execute("SELECT id FROM attributes WHERE key_id = ? AND value = ?", (key_id, value))
-            result = cursor.fetchone()
-            if result:
-                attribute_id = result[0]
-            else:
-                cursor.execute("INSERT INTO attributes (key_id, value) VALUES (?, ?)", (key_id, value))
-                attribute_id = cursor.lastrowid
-            attribute_cache[(key_id, value)] = attribute_id
-        else:
-            attribute_id = attribute_cache[(key_id, value)]
-        
-        # --- Handle product_attributes ---
-        for airtable_product_id in related_item_ids:
-            sqlite_product_id = product_id_map.get(airtable_product_id)
-            if sqlite_product_id:
-                try:
-                    cursor.execute("""
-                        INSERT INTO product_attributes (product_id, attribute_id)
-                        VALUES (?, ?)
-                    """, (sqlite_product_id, attribute_id))
-                    insert_count += 1
-                except sqlite3.IntegrityError:
-                    # This pair might already exist, which is fine.
-                    pass
-    
-    conn.commit()
+
+    cursor.execute("SELECT key_name, id FROM attribute_keys")
+    key_ids = dict(cursor.fetchall())
+    cursor.execute("SELECT key_id, value, id FROM attributes")
+    attribute_ids = {(key_id, value): attribute_id for key_id, value, attribute_id in cursor.fetchall()}
+
+    with conn:
+        for page in attribute_pages:
+            changed_fingerprints = {}
+            records = []  # (key_name, value, related_item_ids)
+            for attr in page:
+                current_attribute_ids.add(attr['id'])
+                fingerprint = record_fingerprint(attr)
+                if not full_sync and fingerprints.get(attr['id']) == fingerprint:
+                    continue
+                changed_fingerprints[attr['id']] = fingerprint
+
+                fields = attr.get('fields', {})
+                key_name = fields.get('Key')
+                value = fields.get('Value')
+                related_item_ids = fields.get('Related Inventory Items', [])
+
+                if not key_name or not value or not related_item_ids:
+                    continue
+                records.append((key_name, value, related_item_ids))
+
+            # --- Handle attribute_keys ---
+            # New rows get ids above the current maximum, so only those are read back
+            new_keys = {key_name for key_name, _, _ in records} - key_ids.keys()
+            if new_keys:
+                last_id = max(key_ids.values(), default=0)
+                cursor.executemany("INSERT INTO attribute_keys (key_name) VALUES (?) ON CONFLICT(key_name) DO NOTHING",
+                                   [(key_name,) for key_name in new_keys])
+                cursor.execute("SELECT key_name, id FROM attribute_keys WHERE id > ?", (last_id,))
+                key_ids.update(cursor.fetchall())
+
+            # --- Handle attributes ---
+            new_attributes = {(key_ids[key_name], value) for key_name, value, _ in records} - attribute_ids.keys()
+            if new_attributes:
+                last_id = max(attribute_ids.values(), default=0)
+                cursor.executemany("INSERT INTO attributes (key_id, value) VALUES (?, ?) ON CONFLICT(key_id, value) DO NOTHING",
+                                   list(new_attributes))
+                cursor.execute("SELECT key_id, value, id FROM attributes WHERE id > ?", (last_id,))
+                attribute_ids.update({(key_id, value): attribute_id for key_id, value, attribute_id in cursor.fetchall()})
+
+            # --- Handle product_attributes ---
+            links = set()
+            for key_name, value, related_item_ids in records:
+                attribute_id = attribute_ids[(key_ids[key_name], value)]
+                for airtable_product_id in related_item_ids:
+                    sqlite_product_id = product_id_map.get(airtable_product_id)
+                    if sqlite_product_id:
+                        links.add((sqlite_product_id, attribute_id))
+
+            changes_before = conn.total_changes
+            cursor.executemany("""
+                INSERT INTO product_attributes (product_id, attribute_id) VALUES (?, ?)
+                ON CONFLICT(product_id, attribute_id) DO NOTHING
+            """, list(links))
+            insert_count += conn.total_changes - changes_before
+
+            save_fingerprints(cursor, INVENTORY_ATTRIBUTES_TABLE_ID, changed_fingerprints)
+
+        if full_sync:
+            prune_fingerprints(cursor, INVENTORY_ATTRIBUTES_TABLE_ID, current_attribute_ids)
+
     print(f"Populated attribute tables. Inserted {insert_count} product-attribute links.")
 
 
@@ -249,10 +299,14 @@ def main():
     """Main function to run the data pipeline."""
     # This script assumes it is run from the project root.
     # The __main__ block below ensures the CWD is correct.
-    
+    parser = argparse.ArgumentParser(description="Sync Airtable inventory into the SQLite database.")
+    parser.add_argument("--full", action="store_true", help="Refetch every record instead of only changed ones.")
+    args = parser.parse_args()
+
     load_dotenv()
     pat = os.getenv("AIRTABLE_PAT")
     base_id = os.getenv("AIRTABLE_BASE_ID")
+    download_workers = int(os.getenv("DOWNLOAD_WORKERS", DEFAULT_WORKERS))
     
     if not pat or not base_id:
         print(f"Error: AIRTABLE_PAT and AIRTABLE_BASE_ID must be set in your .env file.")
@@ -263,23 +317,49 @@ def main():
     if not conn:
         return
         
-    # 2. Fetch data from Airtable
-    inventory_items = fetch_all_airtable_records(base_id, pat, INVENTORY_ITEMS_TABLE_ID, "Grid view")
-    inventory_attributes = fetch_all_airtable_records(base_id, pat, INVENTORY_ATTRIBUTES_TABLE_ID)
-    
-    if inventory_items is None or inventory_attributes is None:
+    # 2. Stream data from Airtable, only changed records unless a full reconcile is due
+    table_ids = [INVENTORY_ITEMS_TABLE_ID, INVENTORY_ATTRIBUTES_TABLE_ID]
+    full_sync = args.full or needs_full_sync(cursor, table_ids)
+    print("Performing full sync" if full_sync else "Fetching records changed since the last sync")
+    formulas = {
+        table_id: None if full_sync else modified_since_formula(get_sync_state(cursor, table_id)[0],
+                                                                incomplete_records(cursor, table_id))
+        for table_id in table_ids
+    }
+    sync_started = format_timestamp(utc_now())
+
+    client = AirtableClient(pat, base_id)
+    inventory_pages = client.iter_pages(INVENTORY_ITEMS_TABLE_ID, "Grid view", formulas[INVENTORY_ITEMS_TABLE_ID])
+    attribute_pages = client.iter_pages(
+        INVENTORY_ATTRIBUTES_TABLE_ID, filter_formula=formulas[INVENTORY_ATTRIBUTES_TABLE_ID])
+
+    # 3. Sync tables while the pages stream in. A failed fetch rolls back the
+    # table being written and leaves the watermarks untouched.
+    try:
+        product_id_map = sync_products(conn, cursor, inventory_pages, download_workers, full_sync)
+        populate_attributes(conn, cursor, attribute_pages, product_id_map, full_sync)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching from Airtable: {e}")
         print("Failed to fetch data from Airtable. Aborting.")
-        conn.close()
+        close_database(conn)
         return
+    finally:
+        client.print_stats()
+        client.close()
 
-    # 3. Sync tables
-    product_id_map = sync_products(conn, cursor, inventory_items)
-    populate_attributes(conn, cursor, inventory_attributes, product_id_map)
-    
-    # 4. Clean up
-    conn.close()
+    # Only advance the watermarks once both tables are written
+    for table_id in table_ids:
+        save_sync_state(cursor, table_id, sync_started, full_sync)
+    conn.commit()
+
+    # 4. Render responsive derivatives of new, changed or locally enhanced images
+    update_derivatives(conn, cursor, product_image_paths(cursor), prune=full_sync)
+    close_database(conn)
+
+    # 5. Publish a read-optimized, content-addressed snapshot for the SPA
+    manifest = publish_database(DB_PATH, PUBLISH_DIR)
     print("\nProcess complete.")
-    print(f"Staging database created at: {DB_PATH}")
+    print(f"Published database: {os.path.join(PUBLISH_DIR, manifest['file'])}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+"""
+Bounded-concurrency batch engine for the image enhancer.
+
+Each image costs two blocking model calls, so a serial run spends nearly all
+of its time waiting. The engine runs images on a thread pool and passes every
+model call through an AdaptiveLimiter: at most max_in_flight calls run at
+once, and the cap shrinks when the API reports rate limiting and grows back
+as calls succeed. There are more worker threads than model slots, so images
+can be decoded, resized and encoded locally while other calls are in flight.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Tuple
+
+from metrics import CONCURRENCY_LIMIT, IN_FLIGHT, RATE_LIMITED
+
+DEFAULT_MAX_IN_FLIGHT = 4
+MAX_RATE_LIMIT_RETRIES = 6
+BACKOFF_BASE = 2.0  # seconds, doubled for every consecutive rate limit
+BACKOFF_MAX = 60.0
+RECOVERY_SUCCESSES = 5  # successful calls needed to grow the cap by one
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED responses from the model API."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return True
+    text = str(error)
+    return text.startswith("429") or "RESOURCE_EXHAUSTED" in text
+
+
+class AdaptiveLimiter:
+    """
+    Caps concurrent model calls. A rate limit halves the cap and pauses new
+    calls for an exponentially growing cooldown; every RECOVERY_SUCCESSES
+    successful calls add one slot back, up to max_in_flight. Calls that were
+    already in flight when a rate limit was seen wait out the same cooldown
+    without shrinking the cap again, so one burst counts as one event.
+    """
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, max_retries: int = MAX_RATE_LIMIT_RETRIES):
+        self.max_in_flight = max(1, max_in_flight)
+        self.limit = self.max_in_flight
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_throttled = 0.0
+        self.successes = 0
+        self.consecutive_throttles = 0
+        self.condition = threading.Condition()
+        self.stats = {"calls": 0, "throttled": 0, "throttled_seconds": 0.0}
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def _acquire(self) -> float:
+        """Waits for a slot and returns the time the call started."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    self.stats["calls"] += 1
+                    IN_FLIGHT.set(self.in_flight)
+                    return now
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def _release(self, started: float, throttled: bool) -> Tuple[float, bool]:
+        """
+        Frees a slot. Returns the cooldown to wait before retrying, if throttled,
+        and whether this call started a new throttling event.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            cooldown = 0.0
+            new_event = False
+            if throttled and started < self.last_throttled:
+                # Part of a burst that was already answered
+                cooldown = max(0.0, self.paused_until - time.monotonic())
+            elif throttled:
+                new_event = True
+                self.last_throttled = time.monotonic()
+                self.stats["throttled"] += 1
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+                cooldown = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self.consecutive_throttles)
+                self.consecutive_throttles += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + cooldown)
+                self.stats["throttled_seconds"] += cooldown
+            else:
+                self.consecutive_throttles = 0
+                self.successes += 1
+                if self.successes >= RECOVERY_SUCCESSES and self.limit < self.max_in_flight:
+                    self.limit += 1
+                    self.successes = 0
+            if throttled:
+                RATE_LIMITED.inc()
+            IN_FLIGHT.set(self.in_flight)
+            CONCURRENCY_LIMIT.set(self.limit)
+            self.condition.notify_all()
+            return cooldown, new_event
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Runs fn in a slot, retrying it after a cooldown when it is rate limited."""
+        for attempt in range(self.max_retries + 1):
+            started = self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    self._release(started, throttled=False)
+                    raise
+                cooldown, new_event = self._release(started, throttled=True)
+                if attempt == self.max_retries:
+                    raise
+                if new_event:
+                    print(f"Rate limited, {self.limit} calls in flight from now on; retrying in {cooldown:.0f}s...")
+                time.sleep(cooldown)
+                continue
+            self._release(started, throttled=False)
+            return result
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class Progress:
+    """Prints done/total, throughput and an ETA extrapolated from the images finished so far."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+
+    def update(self, name: str, ok: bool):
+        self.done += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        status = "✅" if ok else "❌"
+        print(f"{status} [{self.done}/{self.total}] {name} - {rate * 60:.1f} images/min, "
+              f"elapsed {_format_duration(elapsed)}, ETA {_format_duration(eta)}")
+
+
+def run_batch(process: Callable, items: Iterable, workers: int) -> Dict[str, int]:
+    """
+    Calls process(item) for every item on a pool of worker threads and
+    returns success/failure counts. process returns True on success.
+    """
+    items = list(items)
+    stats = {"total": len(items), "successful": 0, "failed": 0}
+    progress = Progress(len(items))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(process, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                ok = bool(future.result())
+            except Exception as e:
+                print(f"Error processing {item}: {e}")
+                ok = False
+            stats["successful" if ok else "failed"] += 1
+            progress.update(getattr(item, "name", str(item)), ok)
+    return stats
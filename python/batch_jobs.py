@@ -0,0 +1,277 @@
+"""
+Bulk generation through a batch-job backend.
+
+Instead of one interactive call per image, all pending generation requests
+are written to a JSON-lines job file and submitted as one job. The job is
+polled until it finishes, and its results are read back line by line.
+
+Job and result files use the Gemini Batch API format, one request per line:
+
+    {"key": "a.jpg", "request": {"contents": [{"role": "user", "parts": [
+        {"inline_data": {"mime_type": "image/jpeg", "data": "<base64>"}}, {"text": "<prompt>"}]}]}}
+
+    {"key": "a.jpg", "response": {"candidates": [{"content": {"parts": [
+        {"inlineData": {"mimeType": "image/png", "data": "<base64>"}}]}}]}}
+    {"key": "b.jpg", "error": {"message": "..."}}
+
+Backends:
+
+    gemini  the Gemini Batch API (the job file is uploaded, results downloaded)
+    local   a stand-in that runs the requests in a background thread through
+            a model backend (see model_backends.py, e.g. ENHANCE_BACKEND=fake),
+            for testing the whole path offline
+
+Each job gets a directory in BATCH_JOBS_DIR holding the job file, the
+results and a manifest of what was submitted, so a run that is stopped while
+the job is pending can re-attach to it instead of submitting it again.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+BATCH_JOBS_DIR = PROJECT_ROOT / "python/batch_jobs"
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Manifest states
+SUBMITTED = "submitted"
+COLLECTED = "collected"
+
+logger = logging.getLogger(__name__)
+
+
+def request_line(key: str, image_jpeg: bytes, prompt: str) -> str:
+    return json.dumps({"key": key, "request": {"contents": [{"role": "user", "parts": [
+        {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(image_jpeg).decode("ascii")}},
+        {"text": prompt},
+    ]}]}})
+
+
+def parse_request(line: str) -> Tuple[str, bytes, str]:
+    """(key, image, prompt) of a job file line."""
+    entry = json.loads(line)
+    parts = entry["request"]["contents"][0]["parts"]
+    image = next(p["inline_data"]["data"] for p in parts if "inline_data" in p)
+    prompt = next(p["text"] for p in parts if "text" in p)
+    return entry["key"], base64.b64decode(image), prompt
+
+
+def result_line(key: str, image: Optional[bytes] = None, error: Optional[str] = None) -> str:
+    if error is not None:
+        return json.dumps({"key": key, "error": {"message": error}})
+    return json.dumps({"key": key, "response": {"candidates": [{"content": {"parts": [
+        {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(image).decode("ascii")}},
+    ]}}]}})
+
+
+def iter_results(path: Path) -> Iterator[Tuple[str, Optional[bytes], Optional[str]]]:
+    """Yields (key, image, error) for each line of a results file, without loading it whole."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            key = entry.get("key")
+            if "error" in entry:
+                yield key, None, str(entry["error"].get("message", entry["error"]))
+                continue
+            image, text = None, []
+            for candidate in entry.get("response", {}).get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    inline = part.get("inlineData") or part.get("inline_data")
+                    if inline and image is None:
+                        image = base64.b64decode(inline["data"])
+                    elif part.get("text"):
+                        text.append(part["text"])
+            if image is None:
+                yield key, None, f"No image data. Response: {' '.join(text)}"
+            else:
+                yield key, image, None
+
+
+class BatchBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def submit(self, job_file: Path, model: str) -> str:
+        """Submits the job file and returns the job name."""
+
+    @abstractmethod
+    def status(self, job_name: str) -> str:
+        """RUNNING, SUCCEEDED or FAILED."""
+
+    @abstractmethod
+    def fetch_results(self, job_name: str, job_dir: Path) -> Path:
+        """Stores the results file of a finished job in job_dir and returns its path."""
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Runs a job in a background thread of this process, through a model
+    backend and limiter. Job state is kept in files next to the job file; a
+    job whose process went away is reported as failed.
+    """
+
+    name = "local"
+
+    def __init__(self, model_backend=None, workers: int = 4):
+        from batch_engine import AdaptiveLimiter
+        from model_backends import create_backend
+
+        self.model_backend = model_backend or create_backend()
+        self.limiter = AdaptiveLimiter(workers)
+        self.workers = workers
+        self.threads: Dict[str, threading.Thread] = {}
+
+    @staticmethod
+    def _paths(job_name: str) -> Tuple[Path, Path]:
+        job_file = Path(job_name)
+        return job_file.with_name("local-results.jsonl"), job_file.with_name("local-state")
+
+    def submit(self, job_file: Path, model: str) -> str:
+        job_name = str(job_file)
+        results_path, state_path = self._paths(job_name)
+        state_path.write_text(RUNNING)
+        thread = threading.Thread(target=self._run, args=(job_file, model, results_path, state_path),
+                                  name="local-batch", daemon=True)
+        self.threads[job_name] = thread
+        thread.start()
+        return job_name
+
+    def _run(self, job_file: Path, model: str, results_path: Path, state_path: Path):
+        lock = threading.Lock()
+
+        def run_one(line: str):
+            key, image, prompt = parse_request(line)
+            try:
+                result = result_line(key, self.limiter.call(self.model_backend.generate_image, model, image, prompt))
+            except Exception as e:
+                result = result_line(key, error=str(e) or type(e).__name__)
+            with lock:
+                results.write(result + "\n")
+
+        try:
+            with open(job_file, encoding="utf-8") as requests, open(results_path, "w", encoding="utf-8") as results:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    for line in requests:
+                        if line.strip():
+                            executor.submit(run_one, line)
+            state_path.write_text(SUCCEEDED)
+        except Exception as e:
+            logger.error(f"Local batch job {job_file} failed: {e}")
+            state_path.write_text(FAILED)
+
+    def status(self, job_name: str) -> str:
+        _, state_path = self._paths(job_name)
+        state = state_path.read_text().strip() if state_path.exists() else FAILED
+        thread = self.threads.get(job_name)
+        if state == RUNNING and not (thread and thread.is_alive()):
+            # Started by a process that is gone
+            return FAILED
+        return state
+
+    def fetch_results(self, job_name: str, job_dir: Path) -> Path:
+        return self._paths(job_name)[0]
+
+
+class GeminiBatchBackend(BatchBackend):
+    """The Gemini Batch API: the job file is uploaded, the results file downloaded."""
+
+    name = "gemini"
+    STATES = {
+        "JOB_STATE_SUCCEEDED": SUCCEEDED,
+        "JOB_STATE_FAILED": FAILED,
+        "JOB_STATE_CANCELLED": FAILED,
+        "JOB_STATE_EXPIRED": FAILED,
+    }
+
+    def __init__(self, api_key: Optional[str] = None):
+        from google import genai
+        from google.genai import types
+
+        if api_key:
+            os.environ['GEMINI_API_KEY'] = api_key
+        self.client = genai.Client()
+        self.types = types
+
+    def submit(self, job_file: Path, model: str) -> str:
+        uploaded = self.client.files.upload(
+            file=str(job_file),
+            config=self.types.UploadFileConfig(display_name=job_file.parent.name, mime_type="jsonl"))
+        job = self.client.batches.create(model=model, src=uploaded.name,
+                                         config={"display_name": f"enhance-{job_file.parent.name}"})
+        return job.name
+
+    def status(self, job_name: str) -> str:
+        state = self.client.batches.get(name=job_name).state
+        return self.STATES.get(getattr(state, "name", str(state)), RUNNING)
+
+    def fetch_results(self, job_name: str, job_dir: Path) -> Path:
+        job = self.client.batches.get(name=job_name)
+        path = job_dir / "results.jsonl"
+        path.write_bytes(self.client.files.download(file=job.dest.file_name))
+        return path
+
+
+def create_batch_backend(name: Optional[str] = None, api_key: Optional[str] = None) -> BatchBackend:
+    """Builds the batch backend named by name or ENHANCE_BATCH_BACKEND (default: gemini)."""
+    name = name or os.getenv("ENHANCE_BATCH_BACKEND", "gemini")
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "gemini":
+        return GeminiBatchBackend(api_key)
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+# --- Job directories ---
+
+def new_job_dir() -> Path:
+    job_dir = BATCH_JOBS_DIR / datetime.now().strftime("%Y%m%d-%H%M%S")
+    job_dir.mkdir(parents=True, exist_ok=False)
+    return job_dir
+
+
+def write_manifest(job_dir: Path, manifest: Dict):
+    tmp_path = job_dir / "manifest.json.tmp"
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, job_dir / "manifest.json")
+
+
+def read_manifest(job_dir: Path) -> Dict:
+    return json.loads((job_dir / "manifest.json").read_text())
+
+
+def find_unfinished_job(backend_name: str) -> Optional[Path]:
+    """The newest job directory of the backend whose results were not collected yet."""
+    if not BATCH_JOBS_DIR.exists():
+        return None
+    for job_dir in sorted(BATCH_JOBS_DIR.iterdir(), reverse=True):
+        if not (job_dir / "manifest.json").exists():
+            continue
+        manifest = read_manifest(job_dir)
+        if manifest["backend"] == backend_name and manifest["state"] == SUBMITTED:
+            return job_dir
+    return None
+
+
+def wait_for_job(backend: BatchBackend, job_name: str, poll_interval: float) -> str:
+    """Polls until the job finishes and returns its final state."""
+    started = time.monotonic()
+    while True:
+        state = backend.status(job_name)
+        if state != RUNNING:
+            return state
+        print(f"⏳ Batch job {job_name} running for {int(time.monotonic() - started)}s...")
+        time.sleep(poll_interval)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the enhancement pipeline, run against the local
+fake model backend (see model_backends.py) so it needs no API key and spends
+no quota.
+
+Two modes are measured on the same images:
+
+    single  one regenerate_image.py process per image, as the comparator runs it
+    batch   one in-process batch run, as enhance_with_gemini_2_5.py runs it
+
+For each mode the results list images/min, p50/p95 wall time per stage,
+bytes sent to the model and peak resident memory. They are written as JSON so
+runs can be compared:
+
+    python benchmark_enhancement.py --images 12 --latency 0.5
+    python benchmark_enhancement.py --baseline benchmark_results/enhancement-20260101-120000.json
+
+Outputs, logs and the ledger go to a temporary directory; the enhanced
+images and the cache of the project are not touched.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from stage_timing import percentile
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+RESULTS_DIR = PROJECT_ROOT / "python/benchmark_results"
+SCRIPT_DIR = PROJECT_ROOT / "python"
+
+
+def _peak_rss_mb(who) -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _stage_stats(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        name: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+        for name, values in samples.items()
+    }
+
+
+def run_single(images: List[Path], workdir: Path) -> Dict:
+    """One regenerate_image.py process per image, one after the other."""
+    stages = {"total": []}
+    model = {"calls": 0, "bytes_up": 0, "bytes_down": 0}
+    succeeded = 0
+    start = time.perf_counter()
+    for image in images:
+        stats_path = workdir / f"{image.name}.stats.json"
+        image_start = time.perf_counter()
+        subprocess.run([sys.executable, str(SCRIPT_DIR / "regenerate_image.py"), image.name,
+                        "--no-cache", "--stats-json", str(stats_path)],
+                       cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        stages["total"].append(time.perf_counter() - image_start)
+        if not stats_path.exists():
+            continue
+        stats = json.loads(stats_path.read_text())
+        succeeded += stats["success"]
+        for name, timing in stats["stages"].items():
+            stages.setdefault(name, []).append(timing["total"])
+        for key in model:
+            model[key] += stats["model"][key]
+    elapsed = time.perf_counter() - start
+    return {
+        "images": len(images),
+        "succeeded": succeeded,
+        "seconds": elapsed,
+        "images_per_min": len(images) / elapsed * 60,
+        "stages": _stage_stats(stages),
+        "model": model,
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def run_batch_mode(images: List[Path], workdir: Path, max_in_flight: int) -> Dict:
+    """The batch processor's engine, in this process."""
+    from batch_engine import AdaptiveLimiter, run_batch
+    from enhance_with_gemini_2_5 import make_job
+    from enhancement_ledger import EnhancementLedger
+    from enhancement_logic import Gemini25ClothingEnhancer
+    from hash_index import HashIndex
+    from postprocessing import Postprocessor
+
+    limiter = AdaptiveLimiter(max_in_flight)
+    postprocessor = Postprocessor(workers=os.cpu_count() or 1)
+    enhancer = Gemini25ClothingEnhancer(limiter=limiter, postprocessor=postprocessor)
+    ledger = EnhancementLedger(workdir / "ledger.sqlite")
+    job = make_job(enhancer, ledger, HashIndex(workdir / "hash_index.sqlite"))
+    totals = []
+
+    def timed_job(image_path: Path) -> bool:
+        image_start = time.perf_counter()
+        try:
+            return job(image_path)
+        finally:
+            totals.append(time.perf_counter() - image_start)
+
+    start = time.perf_counter()
+    stats = run_batch(timed_job, images, 2 * max_in_flight)
+    elapsed = time.perf_counter() - start
+    ledger.close()
+    postprocessor.shutdown()
+
+    with enhancer.timer.lock:
+        stages = {name: list(values) for name, values in enhancer.timer.durations.items()}
+    stages["total"] = totals
+    return {
+        "images": len(images),
+        "succeeded": stats["successful"],
+        "seconds": elapsed,
+        "images_per_min": len(images) / elapsed * 60,
+        "stages": _stage_stats(stages),
+        "model": dict(enhancer.backend.stats),
+        "throttled": limiter.stats["throttled"],
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+    }
+
+
+def print_results(results: Dict, baseline: Dict = None):
+    for mode, result in results["modes"].items():
+        line = (f"{mode}: {result['succeeded']}/{result['images']} images in {result['seconds']:.1f}s, "
+                f"{result['images_per_min']:.1f} images/min, {result['model']['bytes_up'] / 1024:.0f} KB uploaded, "
+                f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        previous = (baseline or {}).get("modes", {}).get(mode)
+        if previous:
+            line += f" (baseline {previous['images_per_min']:.1f} images/min)"
+        print(line)
+        for stage, timing in result["stages"].items():
+            line = f"   {stage:18} p50 {timing['p50'] * 1000:7.0f} ms   p95 {timing['p95'] * 1000:7.0f} ms"
+            old = previous and previous["stages"].get(stage)
+            if old:
+                line += f"   (baseline p95 {old['p95'] * 1000:.0f} ms)"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the enhancement pipeline against the fake model.")
+    parser.add_argument("--images", type=int, default=8, help="Number of source images to use.")
+    parser.add_argument("--modes", default="single,batch", help="Comma-separated: single, batch.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per fake model call.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that return no image.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls answered with 429.")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Model call cap for batch mode.")
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmark_results/enhancement-<time>.json).")
+    parser.add_argument("--baseline", type=Path, help="Earlier result file to compare against.")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="enhancement-bench-"))
+    (workdir / "output").mkdir()
+    # Read by enhancement_logic at import, here and in the regenerate_image.py children
+    os.environ.update({
+        "ENHANCE_BACKEND": "fake",
+        "FAKE_MODEL_LATENCY": str(args.latency),
+        "FAKE_MODEL_ERROR_RATE": str(args.error_rate),
+        "FAKE_MODEL_RATE_LIMIT_RATE": str(args.rate_limit_rate),
+        "ENHANCE_OUTPUT_DIR": str(workdir / "output"),
+        "ENHANCE_LOG_FILE": str(workdir / "enhancement_log.txt"),
+        "ENHANCE_SPANS_FILE": str(workdir / "spans.jsonl"),
+    })
+    from enhancement_logic import SOURCE_DIR
+
+    images = sorted(p for p in SOURCE_DIR.iterdir() if p.is_file())[:args.images]
+    if not images:
+        print(f"No images in {SOURCE_DIR}")
+        return 1
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "config": {
+            "images": len(images),
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "max_in_flight": args.max_in_flight,
+        },
+        "modes": {},
+    }
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    # single first: it measures child processes, batch measures this one
+    if "single" in modes:
+        print(f"Benchmarking single-image mode on {len(images)} images...")
+        results["modes"]["single"] = run_single(images, workdir)
+    if "batch" in modes:
+        print(f"Benchmarking batch mode on {len(images)} images...")
+        results["modes"]["batch"] = run_batch_mode(images, workdir, args.max_in_flight)
+
+    output = args.output
+    if not output:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"enhancement-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print()
+    print_results(results, baseline)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the SQLite write path of the Airtable sync, on synthetic records
+so it needs no Airtable access and downloads no images.
+
+Three stages are measured on a fresh database built from data/schema.sql:
+
+    products     full sync of --products records into an empty products table
+    attributes   populate_attributes with --attributes records, each linked to
+                 --links-per-attribute random products
+    updates      full sync again with every product's price changed
+
+Results are written as JSON so runs can be compared:
+
+    python benchmark_sync.py --products 10000 --attributes 1000
+    python benchmark_sync.py --baseline benchmark_results/sync-20260101-120000.json
+
+The database is created in a temporary directory; the project's databases and
+images are not touched.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from benchmark_enhancement import _git_revision
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+RESULTS_DIR = PROJECT_ROOT / "python/benchmark_results"
+# Records per page, as Airtable returns them
+PAGE_SIZE = 100
+
+
+def _pages(records: List[Dict]) -> List[List[Dict]]:
+    return [records[i:i + PAGE_SIZE] for i in range(0, len(records), PAGE_SIZE)]
+
+
+def make_records(products: int, attributes: int, links_per_attribute: int, seed: int):
+    """Synthetic inventory items and attribute records shaped like Airtable's."""
+    rng = random.Random(seed)
+    items = [
+        {"id": f"rec{i:08d}", "fields": {"Item Name": f"Product {i}", "Price": float(i % 500),
+                                        "Quantity": 1, "Description": "x" * 200}}
+        for i in range(products)
+    ]
+    keys = max(1, attributes // 100)
+    attribute_records = [
+        {"id": f"att{i:08d}", "fields": {
+            "Key": f"Key {i % keys}",
+            "Value": f"Value {i // keys}",
+            "Related Inventory Items": [items[rng.randrange(products)]["id"] for _ in range(links_per_attribute)],
+        }}
+        for i in range(attributes)
+    ]
+    return items, attribute_records
+
+
+def run(products: int, attributes: int, links_per_attribute: int, seed: int) -> Dict:
+    import airtable_to_sqlite as sync
+
+    items, attribute_records = make_records(products, attributes, links_per_attribute, seed)
+    workdir = Path(tempfile.mkdtemp(prefix="sync-bench-"))
+    (workdir / "data").mkdir()
+    shutil.copy(PROJECT_ROOT / "data/schema.sql", workdir / "data/schema.sql")
+    cwd = os.getcwd()
+    # The sync's paths are relative to the project root
+    os.chdir(workdir)
+    try:
+        timings = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            conn, cursor = sync.setup_database()
+
+            start = time.perf_counter()
+            product_ids = sync.sync_products(conn, cursor, _pages(items), full_sync=True)
+            timings["products"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sync.populate_attributes(conn, cursor, _pages(attribute_records), product_ids, full_sync=True)
+            timings["attributes"] = time.perf_counter() - start
+
+            for item in items:
+                item["fields"]["Price"] += 1
+            start = time.perf_counter()
+            sync.sync_products(conn, cursor, _pages(items), full_sync=True)
+            timings["updates"] = time.perf_counter() - start
+
+            links = cursor.execute("SELECT COUNT(*) FROM product_attributes").fetchone()[0]
+            sync.close_database(conn)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"seconds": timings, "links": links}
+
+
+def print_results(results: Dict, baseline: Dict = None):
+    config = results["config"]
+    print(f"{config['products']} products, {config['attributes']} attributes, {results['links']} links")
+    for stage, seconds in results["seconds"].items():
+        line = f"   {stage:12} {seconds:7.3f} s"
+        previous = (baseline or {}).get("seconds", {}).get(stage)
+        if previous is not None:
+            line += f"   (baseline {previous:.3f} s)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Airtable sync's database writes.")
+    parser.add_argument("--products", type=int, default=10000, help="Number of inventory items.")
+    parser.add_argument("--attributes", type=int, default=1000, help="Number of attribute records.")
+    parser.add_argument("--links-per-attribute", type=int, default=100,
+                        help="Products each attribute record is linked to.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the random links.")
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmark_results/sync-<time>.json).")
+    parser.add_argument("--baseline", type=Path, help="Earlier result file to compare against.")
+    args = parser.parse_args()
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "config": {
+            "products": args.products,
+            "attributes": args.attributes,
+            "links_per_attribute": args.links_per_attribute,
+            "seed": args.seed,
+        },
+    }
+    print(f"Benchmarking the sync on {args.products} products...")
+    results.update(run(args.products, args.attributes, args.links_per_attribute, args.seed))
+
+    output = args.output
+    if not output:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"sync-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print()
+    print_results(results, baseline)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
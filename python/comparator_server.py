@@ -1,95 +1,325 @@
 import os
 import json
-import hashlib
-import subprocess
-import sys
-import shutil
+import asyncio
+import functools
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Literal
 import uvicorn
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from enhancement_candidates import (
+    CANDIDATES_DIR, MAX_CANDIDATES, discard_candidates, list_candidates, promote_candidate,
+)
+from enhancement_logic import configure_logging, copy_atomic
+from hash_index import HashIndex
+from image_scoring import ReviewScorer
+from metrics import REGISTRY
+from preview_cache import PREVIEW_WIDTHS, PreviewCache
+from regeneration_jobs import RegenerationJobs
+from review_queue import ReviewQueue
+from shared_state import SharedState
 
 # --- Configuration ---
 PROJECT_ROOT = Path(__file__).parent.parent.resolve()
 SHOP_DIR = PROJECT_ROOT / "assets/images/shop"
 ENHANCED_DIR = PROJECT_ROOT / "assets/images/shop_enhanced"
-REGEN_SCRIPT = PROJECT_ROOT / "python/regenerate_image.py"
+SSE_KEEPALIVE_SECONDS = 15
+# How stale the other workers' values in a /metrics scrape may be
+METRICS_PUBLISH_SECONDS = 5
+# Threads for file, image and database work, so no request stalls the event loop for the others
+BLOCKING_WORKERS = int(os.getenv("COMPARATOR_BLOCKING_WORKERS", "16"))
 
 app = FastAPI()
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(func, *args):
+    """Runs func(*args) on the blocking executor and waits for it without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, functools.partial(func, *args))
+
+@app.on_event("startup")
+def start_logging():
+    # Background threads and the shared modules report through logging, with a level
+    configure_logging()
+
+@app.on_event("shutdown")
+def stop_blocking_executor():
+    blocking_executor.shutdown(wait=False, cancel_futures=True)
 
 # --- Models ---
 class ImageRequest(BaseModel):
     filename: str
     prompt: str = ""
+    # A reviewer regenerates because the cached result was not good enough
+    fresh: bool = True
+    candidates: int = Field(1, ge=1, le=MAX_CANDIDATES)
 
 class CopyRequest(BaseModel):
     filename: str
 
+class PromoteRequest(BaseModel):
+    filename: str
+    candidate: int
+
 # --- Image Comparison Logic ---
-def get_differing_images() -> List[str]:
+# Review queue and regeneration jobs, shared by all worker processes of the server
+shared_state = SharedState()
+# Differing images, kept current by watching both directories; digests persist across restarts and reloads
+hash_index = HashIndex()
+review_queue = ReviewQueue(SHOP_DIR, ENHANCED_DIR, hash_index, shared_state)
+review_scorer = ReviewScorer(SHOP_DIR, ENHANCED_DIR, hash_index)
+preview_cache = PreviewCache(hash_index)
+IMAGE_DIRS = {"shop": SHOP_DIR, "shop_enhanced": ENHANCED_DIR}
+
+def warm_scores():
     """
-    Finds images with the same name in both directories but with different content.
-    Returns a sorted list of filenames.
+    Scores the queue once it has been scanned, so the first ?sort=score finds
+    the scores cached. Runs in every worker process: one of them computes the
+    missing scores while the others wait for it, then read the scores from
+    the shared hash index.
     """
-    print("Scanning directories and comparing image hashes...")
-    shop_files = {f for f in os.listdir(SHOP_DIR) if os.path.isfile(SHOP_DIR / f)}
-    enhanced_files = {f for f in os.listdir(ENHANCED_DIR) if os.path.isfile(ENHANCED_DIR / f)}
-    
-    common_files = sorted(list(shop_files.intersection(enhanced_files)))
-    
-    diff_files = []
-    for filename in common_files:
+    review_queue.wait_scanned()
+    started = time.perf_counter()
+    scores = review_scorer.scores(review_queue.snapshot()["images"])
+    print(f"Scores of {len(scores)} queued images ready in {time.perf_counter() - started:.2f}s.")
+
+@app.on_event("startup")
+def start_review_queue():
+    # Scanning and watching happen in the background, in one process at a time
+    review_queue.start()
+    threading.Thread(target=warm_scores, name="review-scorer", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_review_queue():
+    review_queue.stop()
+
+# Regenerations run on a worker pool in the process they were submitted to, with one shared enhancer
+regeneration_jobs = RegenerationJobs(SHOP_DIR, shared_state)
+
+@app.on_event("shutdown")
+def stop_regeneration_jobs():
+    regeneration_jobs.shutdown()
+
+def publish_metrics():
+    """Stores this worker's metrics in the shared state every METRICS_PUBLISH_SECONDS, for /metrics."""
+    while True:
         try:
-            path1 = SHOP_DIR / filename
-            path2 = ENHANCED_DIR / filename
-            hash1 = hashlib.sha256(path1.read_bytes()).hexdigest()
-            hash2 = hashlib.sha256(path2.read_bytes()).hexdigest()
-            if hash1 != hash2:
-                diff_files.append(filename)
-        except Exception as e:
-            print(f"Could not process {filename}: {e}")
-            
-    print(f"Found {len(diff_files)} differing images out of {len(common_files)} common images.")
-    return diff_files
-
-# Store the list of images in memory
-differing_images = get_differing_images()
+            shared_state.exchange_metrics(REGISTRY)
+        except sqlite3.Error as e:
+            print(f"Could not publish metrics: {e}")
+        time.sleep(METRICS_PUBLISH_SECONDS)
+
+@app.on_event("startup")
+def start_metrics_publisher():
+    threading.Thread(target=publish_metrics, name="metrics", daemon=True).start()
+
+@app.on_event("shutdown")
+def publish_final_metrics():
+    # Kept in the totals after this worker exits
+    shared_state.exchange_metrics(REGISTRY)
 
 # --- Static File Serving ---
 app.mount("/shop", StaticFiles(directory=SHOP_DIR), name="shop")
-app.mount("/shop_enhanced", StaticFiles(directory=ENHANCED_DIR), name="shop_enhanced")
+# Created by the enhancer, which may not have run yet
+app.mount("/shop_enhanced", StaticFiles(directory=ENHANCED_DIR, check_dir=False), name="shop_enhanced")
+# Created with the first set of candidates
+app.mount("/candidates", StaticFiles(directory=CANDIDATES_DIR, check_dir=False), name="candidates")
 
 # --- API Endpoints ---
 @app.get("/api/images", response_class=JSONResponse)
-async def get_images_list():
-    return differing_images
+async def get_images_list(sort: Literal["name", "score"] = "name"):
+    """
+    The differing images and the version of the queue they belong to. With
+    sort=score, the most changed pairs come first and each one's perceptual
+    scores are included (see image_scoring.py).
+    """
+    snapshot = await run_blocking(review_queue.snapshot)
+    if sort == "score":
+        # Cached scores are a lookup; uncached pairs are decoded and scored on the pool
+        scores = await run_blocking(review_scorer.scores, snapshot["images"])
+        snapshot["images"].sort(key=lambda f: scores[f]["score"] if f in scores else -1, reverse=True)
+        snapshot["scores"] = scores
+    return snapshot
+
+@app.get("/api/images/events")
+async def image_events(request: Request):
+    """Server-Sent Events: the whole queue at connect time, then each change ({version, added, removed})."""
+    queue = review_queue.subscribe()
+
+    async def stream():
+        try:
+            snapshot = await run_blocking(review_queue.snapshot)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    version, change = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                # Changes already in the snapshot may still be on their way from the event table
+                if version > snapshot["version"]:
+                    yield f"data: {json.dumps({'version': version, **change})}\n\n"
+        finally:
+            review_queue.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/versions", response_class=JSONResponse)
+async def get_versions(files: List[str] = Query(...)):
+    """
+    Content version of each file in shop and shop_enhanced (None if missing).
+    Preview URLs carry it, so they change exactly when the content does.
+    """
+    files = [f for f in files if Path(f).name == f]
+    paths = [os.path.join(directory, f) for f in files for directory in IMAGE_DIRS.values()]
+    digests = await run_blocking(hash_index.digests, paths)
+    return {
+        f: {kind: (digests.get(os.path.join(directory, f)) or "")[:16] or None for kind, directory in IMAGE_DIRS.items()}
+        for f in files
+    }
+
+@app.get("/preview/{kind}/{filename}")
+async def get_preview(kind: Literal["shop", "shop_enhanced"], filename: str, request: Request,
+                      w: int = PREVIEW_WIDTHS[0], v: str = ""):
+    """
+    A resized JPEG of an image, with a strong ETag from its content digest.
+    With v set to the current version (see /api/versions), the response is
+    immutable; otherwise the browser revalidates and gets a 304 if unchanged.
+    """
+    if w not in PREVIEW_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"Width must be one of {PREVIEW_WIDTHS}")
+    if Path(filename).name != filename:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = IMAGE_DIRS[kind] / filename
+    digest, mtime = await run_blocking(_preview_validators, path)
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    headers = {
+        "ETag": f'"{digest[:32]}-{w}"',
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": "public, max-age=31536000, immutable" if v == digest[:16] else "no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if headers["ETag"] in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if int(mtime) <= parsedate_to_datetime(request.headers["if-modified-since"]).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
 
-@app.post("/api/regenerate", response_class=JSONResponse)
+    data = await run_blocking(preview_cache.get, path, digest, w)
+    return Response(data, media_type="image/jpeg", headers=headers)
+
+def _preview_validators(path: Path):
+    """(digest, mtime) of path, (None, None) if it is missing."""
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None, None
+    return preview_cache.digest(path), mtime
+
+@app.post("/api/regenerate", response_class=JSONResponse, status_code=202)
 async def handle_regenerate(request: ImageRequest):
     filename = request.filename
-    if not (SHOP_DIR / filename).exists():
+    if Path(filename).name != filename or not await run_blocking((SHOP_DIR / filename).exists):
         raise HTTPException(status_code=404, detail="Original image not found")
 
-    print(f"Received request to regenerate: {filename}")
-    command = [sys.executable, str(REGEN_SCRIPT), filename]
-    if request.prompt:
-        command.extend(['--prompt', request.prompt])
-    
+    job = await run_blocking(regeneration_jobs.submit, filename, request.prompt, request.fresh, request.candidates)
+    print(f"Queued regeneration of {filename} ({request.candidates} candidates) as job {job.id}")
+    return {"status": job.status, "job_id": job.id, "message": f'{filename} queued for regeneration.'}
+
+@app.get("/api/regenerate", response_class=JSONResponse)
+async def list_regeneration_jobs(active: bool = False):
+    return await run_blocking(functools.partial(regeneration_jobs.list, active_only=active))
+
+@app.get("/api/regenerate/events")
+async def regeneration_events(request: Request):
+    """Server-Sent Events: the active jobs at connect time, then every job change."""
+    queue = regeneration_jobs.subscribe()
+
+    async def stream():
+        try:
+            jobs, last_seq = await run_blocking(regeneration_jobs.active_snapshot)
+            for job in jobs:
+                yield f"data: {json.dumps(job)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    seq, job = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                # Changes already in the snapshot may still be on their way from the event table
+                if seq > last_seq:
+                    yield f"data: {json.dumps(job)}\n\n"
+        finally:
+            regeneration_jobs.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/regenerate/{job_id}", response_class=JSONResponse)
+async def get_regeneration_job(job_id: str):
+    job = await run_blocking(regeneration_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get("/api/candidates/{filename}", response_class=JSONResponse)
+async def get_candidates(filename: str):
+    """
+    Candidate file names (under /candidates/), in candidate order, with their
+    content versions. Candidate URLs carry the version, like preview URLs, so
+    a new set is fetched while an unchanged one stays cached.
+    """
+    if Path(filename).name != filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    names = await run_blocking(list_candidates, filename)
+    digests = await run_blocking(hash_index.digests, [os.path.join(CANDIDATES_DIR, name) for name in names])
+    return [
+        {"name": name, "version": digests[os.path.join(CANDIDATES_DIR, name)][:16]}
+        for name in names if os.path.join(CANDIDATES_DIR, name) in digests
+    ]
+
+@app.post("/api/candidates/promote", response_class=JSONResponse)
+async def handle_promote(request: PromoteRequest):
+    if Path(request.filename).name != request.filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
     try:
-        process = subprocess.run(
-            command, capture_output=True, text=True, check=True, encoding='utf-8'
-        )
-        print("Regeneration script stdout:", process.stdout)
-        print("Regeneration script stderr:", process.stderr)
-        return {"status": "success", "message": f'{filename} regenerated.'}
-    except subprocess.CalledProcessError as e:
-        error_message = f"Stdout: {e.stdout}\nStderr: {e.stderr}"
-        print(f"Regeneration script failed!\n{error_message}")
-        raise HTTPException(status_code=500, detail=f"Regeneration failed:\n{error_message}")
+        await run_blocking(promote_candidate, request.filename, request.candidate)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Candidate not found")
+    await run_blocking(review_queue.refresh, [request.filename])
+    print(f"Promoted candidate {request.candidate} of {request.filename}.")
+    return {"status": "success", "message": f'Candidate {request.candidate} of {request.filename} promoted.'}
+
+@app.delete("/api/candidates/{filename}", response_class=JSONResponse)
+async def handle_discard(filename: str):
+    if Path(filename).name != filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    await run_blocking(discard_candidates, filename)
+    return {"status": "success", "message": f'Candidates of {filename} discarded.'}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Counters and histograms of the regeneration pool, in the Prometheus text
+    format, summed over all worker processes (those of the others are at most
+    METRICS_PUBLISH_SECONDS old).
+    """
+    registry = await run_blocking(shared_state.exchange_metrics, REGISTRY)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/api/copy", response_class=JSONResponse)
 async def handle_copy(request: CopyRequest):
@@ -97,11 +327,14 @@ async def handle_copy(request: CopyRequest):
     source_path = ENHANCED_DIR / filename
     dest_path = SHOP_DIR / filename
 
-    if not source_path.exists():
+    if Path(filename).name != filename or not await run_blocking(source_path.exists):
         raise HTTPException(status_code=404, detail="Enhanced image not found to copy")
 
     try:
-        shutil.copy2(source_path, dest_path)
+        # Through a temporary file, so reviewers and the watcher never see a half-copied original
+        await run_blocking(copy_atomic, source_path, dest_path)
+        # The watcher would notice too; this way the queue is current before the response
+        await run_blocking(review_queue.refresh, [filename])
         print(f"Successfully copied {filename}.")
         return {"status": "success", "message": f'{filename} copied to original.'}
     except Exception as e:
@@ -128,6 +361,11 @@ async def get_root():
         #nav { display: flex; gap: 15px; align-items: center; }
         button { font-size: 1.2em; padding: 10px 20px; cursor: pointer; border-radius: 5px; border: none; color: white; }
         .loader { position: absolute; top: 50%; left: 50%; border: 8px solid #f3f3f3; border-top: 8px solid #3498db; border-radius: 50%; width: 60px; height: 60px; animation: spin 1s linear infinite; margin-left: -30px; margin-top: -30px; display: none; }
+        #candidates { display: flex; justify-content: center; gap: 15px; margin-bottom: 20px; }
+        .candidate { display: flex; flex-direction: column; align-items: center; gap: 5px; }
+        .candidate img { height: 200px; width: 150px; cursor: pointer; border: 3px solid transparent; border-radius: 4px; }
+        .candidate img.selected { border-color: #007bff; }
+        #candidate-count, #sort-order { font-size: 1.1em; padding: 8px; border-radius: 5px; }
         @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
     </style>
 </head>
@@ -139,31 +377,203 @@ async def get_root():
         <div class="image-box"><h2>Original</h2><img id="img-original"></div>
         <div class="image-box"><h2>Enhanced</h2><img id="img-enhanced"><div class="loader"></div></div>
     </div>
+    <div id="candidates"></div>
     <div id="controls">
         <textarea id="prompt-area" placeholder="Add additional instructions for regeneration... e.g., 'make the background pure white'"></textarea>
         <div id="nav">
             <button id="copy-btn" style="background-color: #ffc107;">Copy to Original</button>
             <button id="prev-btn" style="background-color: #6c757d;">&larr; Previous</button>
             <button id="next-btn" style="background-color: #007bff;">Next &rarr;</button>
+            <select id="candidate-count" title="Variants to generate at once; more than one are kept for review">
+                <option value="1">1 variant</option>
+                <option value="2">2 variants</option>
+                <option value="3">3 variants</option>
+                <option value="4">4 variants</option>
+            </select>
             <button id="regen-btn" style="background-color: #28a745;">Regenerate</button>
+            <select id="sort-order" title="Order of the review queue">
+                <option value="name">By name</option>
+                <option value="score">Most changed first</option>
+            </select>
         </div>
     </div>
     <script>
-        let images = [], currentIndex = 0;
+        let images = [], currentIndex = 0, imagesVersion = -1;
+        // Perceptual scores by filename, when sorted by score
+        let scores = {};
+        // Latest known regeneration job per filename, kept current by the event stream
+        const jobs = {};
+        // Content version of each file per directory; preview URLs change only when it does
+        const versions = {};
+        const PREFETCH = 3;
         const originalImg = document.getElementById('img-original');
         const enhancedImg = document.getElementById('img-enhanced');
         const filenameEl = document.getElementById('filename-container');
         const statusEl = document.getElementById('status');
         const loader = document.querySelector('.loader');
         const promptArea = document.getElementById('prompt-area');
+        const candidatesEl = document.getElementById('candidates');
+        const candidateCount = document.getElementById('candidate-count');
+        const sortOrder = document.getElementById('sort-order');
+
+        function isActive(job) {
+            return job && (job.status === 'queued' || job.status === 'running');
+        }
+
+        function updateStatus() {
+            if (images.length === 0) return;
+            const pending = Object.values(jobs).filter(isActive).length;
+            const job = jobs[images[currentIndex]];
+            let text = `${currentIndex + 1} of ${images.length}`;
+            const score = scores[images[currentIndex]];
+            if (score) text += ` — change score ${score.score.toFixed(2)} (SSIM ${score.ssim.toFixed(2)}, ` +
+                `colour ${score.histogram.toFixed(2)}, edges ${score.edges.toFixed(2)}, aspect ${score.aspect.toFixed(2)})`;
+            if (job) text += ` — regeneration ${job.status}` + (job.error ? `: ${job.error}` : '');
+            if (pending) text += ` (${pending} regenerating)`;
+            statusEl.textContent = text;
+            loader.style.display = isActive(job) ? 'block' : 'none';
+        }
+
+        function previewUrl(kind, filename) {
+            return `/preview/${kind}/${encodeURIComponent(filename)}?w=900&v=${versions[filename][kind]}`;
+        }
+
+        async function loadVersions(filenames) {
+            const missing = filenames.filter(f => !(f in versions));
+            if (missing.length === 0) return;
+            const params = new URLSearchParams();
+            missing.forEach(f => params.append('files', f));
+            Object.assign(versions, await fetch('/api/versions?' + params).then(res => res.json()));
+        }
+
+        function forgetVersion(filename) {
+            delete versions[filename];
+        }
 
-        function showImage(index) {
+        async function showImage(index) {
             if (images.length === 0) return;
             const filename = images[index];
-            originalImg.src = '/shop/' + filename + '?t=' + new Date().getTime();
-            enhancedImg.src = '/shop_enhanced/' + filename + '?t=' + new Date().getTime();
             filenameEl.textContent = filename;
-            statusEl.textContent = `${index + 1} of ${images.length}`;
+            updateStatus();
+            showCandidates(filename);
+            // This pair and the next few, fetched together so Next shows cached previews
+            const upcoming = [...new Set(Array.from({ length: PREFETCH + 1 }, (_, i) => images[(index + i) % images.length]))];
+            await loadVersions(upcoming);
+            if (filename !== images[currentIndex]) return;
+            originalImg.src = previewUrl('shop', filename);
+            enhancedImg.src = previewUrl('shop_enhanced', filename);
+            for (const next of upcoming.slice(1)) {
+                new Image().src = previewUrl('shop', next);
+                new Image().src = previewUrl('shop_enhanced', next);
+            }
+        }
+
+        async function showCandidates(filename) {
+            const candidates = await fetch('/api/candidates/' + encodeURIComponent(filename)).then(res => res.json());
+            if (filename !== images[currentIndex]) return;
+            candidatesEl.innerHTML = '';
+            for (const { name, version } of candidates) {
+                // <filename>.<number>.<ext>
+                const number = Number(name.split('.').slice(-2)[0]);
+                const box = document.createElement('div');
+                box.className = 'candidate';
+                const img = document.createElement('img');
+                img.src = `/candidates/${encodeURIComponent(name)}?v=${version}`;
+                img.title = 'Show in the Enhanced pane';
+                img.addEventListener('click', () => {
+                    enhancedImg.src = img.src;
+                    candidatesEl.querySelectorAll('img').forEach(other => other.classList.toggle('selected', other === img));
+                });
+                const promote = document.createElement('button');
+                promote.textContent = `Promote #${number}`;
+                promote.style.backgroundColor = '#17a2b8';
+                promote.addEventListener('click', async () => {
+                    if (await handleApiRequest('/api/candidates/promote', { filename: filename, candidate: number }, 'Promote')) {
+                        forgetVersion(filename);
+                        showImage(currentIndex);
+                    }
+                });
+                box.append(img, promote);
+                candidatesEl.append(box);
+            }
+            if (candidates.length) {
+                const discard = document.createElement('button');
+                discard.textContent = 'Discard all';
+                discard.style.backgroundColor = '#dc3545';
+                discard.addEventListener('click', async () => {
+                    await fetch('/api/candidates/' + encodeURIComponent(filename), { method: 'DELETE' });
+                    showImage(currentIndex);
+                });
+                candidatesEl.append(discard);
+            }
+        }
+
+        function setImages(list) {
+            const current = images[currentIndex];
+            images = list;
+            if (images.length === 0) {
+                statusEl.textContent = 'No differing images found!';
+                filenameEl.textContent = '';
+                originalImg.removeAttribute('src');
+                enhancedImg.removeAttribute('src');
+                candidatesEl.innerHTML = '';
+                return;
+            }
+            const index = images.indexOf(current);
+            if (index >= 0) {
+                // Still in the queue: keep showing it
+                currentIndex = index;
+                updateStatus();
+            } else {
+                currentIndex = Math.min(currentIndex, images.length - 1);
+                showImage(currentIndex);
+            }
+        }
+
+        async function loadImages(force) {
+            const data = await fetch('/api/images?sort=' + sortOrder.value).then(res => res.json());
+            if (force || data.version > imagesVersion) {
+                imagesVersion = data.version;
+                scores = data.scores || {};
+                setImages(data.images);
+            }
+        }
+
+        function onImagesUpdate(event) {
+            if (event.images) {
+                // Changes may have been missed while disconnected
+                Object.keys(versions).forEach(forgetVersion);
+            }
+            (event.changed || []).forEach(forgetVersion);
+            if ((event.changed || []).includes(images[currentIndex])) showImage(currentIndex);
+            if (sortOrder.value === 'score') {
+                // New pairs need scores, and the order may change
+                if (event.version > imagesVersion || event.images) loadImages(true);
+            } else if (event.images) {
+                // The whole queue, sent when the stream (re)connects
+                imagesVersion = event.version;
+                setImages(event.images);
+            } else if (event.version === imagesVersion + 1) {
+                imagesVersion = event.version;
+                const kept = images.filter(f => !event.removed.includes(f));
+                setImages(kept.concat(event.added.filter(f => !kept.includes(f))).sort());
+            } else if (event.version > imagesVersion) {
+                loadImages();
+            }
+        }
+
+        function onJobUpdate(job) {
+            const previous = jobs[job.filename];
+            if (previous && Number(previous.id) > Number(job.id)) return;
+            jobs[job.filename] = job;
+            if (job.status === 'succeeded' && job.filename === images[currentIndex]) {
+                if (job.candidates > 1) showCandidates(job.filename);
+                else {
+                    forgetVersion(job.filename);
+                    showImage(currentIndex);
+                }
+            }
+            updateStatus();
         }
 
         async function handleApiRequest(endpoint, body, action) {
@@ -179,18 +589,20 @@ async def get_root():
                 }
                 const data = await response.json();
                 console.log(`${action} successful:`, data.message);
-                showImage(currentIndex);
+                return data;
             } catch (error) {
                 console.error(`Error during ${action}:`, error);
                 alert(`Error during ${action}: ${error.message}`);
-            } finally {
-                loader.style.display = 'none';
             }
         }
 
-        document.getElementById('copy-btn').addEventListener('click', () => {
+        document.getElementById('copy-btn').addEventListener('click', async () => {
             if (images.length === 0) return;
-            handleApiRequest('/api/copy', { filename: images[currentIndex] }, 'Copy');
+            const filename = images[currentIndex];
+            if (await handleApiRequest('/api/copy', { filename: filename }, 'Copy')) {
+                forgetVersion(filename);
+                showImage(currentIndex);
+            }
         });
 
         document.getElementById('next-btn').addEventListener('click', () => {
@@ -205,26 +617,42 @@ async def get_root():
             showImage(currentIndex);
         });
 
-        document.getElementById('regen-btn').addEventListener('click', () => {
+        sortOrder.addEventListener('change', () => {
+            currentIndex = 0;
+            images = [];
+            loadImages(true);
+        });
+
+        document.getElementById('regen-btn').addEventListener('click', async () => {
             if (images.length === 0) return;
-            loader.style.display = 'block';
-            handleApiRequest('/api/regenerate', { 
-                filename: images[currentIndex], 
-                prompt: promptArea.value 
+            const filename = images[currentIndex];
+            const data = await handleApiRequest('/api/regenerate', {
+                filename: filename,
+                prompt: promptArea.value,
+                fresh: true,
+                candidates: Number(candidateCount.value)
             }, 'Regeneration');
+            // The event stream may already have reported this job further along
+            if (data && (!jobs[filename] || jobs[filename].id !== data.job_id)) {
+                onJobUpdate({ id: data.job_id, filename: filename, status: data.status });
+            }
         });
 
-        fetch('/api/images').then(res => res.json()).then(data => {
-            images = data;
-            if (images.length > 0) showImage(0);
-            else document.body.innerHTML = '<h1>No differing images found!</h1>';
-        });
+        // Job and queue changes are pushed; EventSource reconnects by itself if the server restarts,
+        // and the queue stream starts with the whole queue
+        new EventSource('/api/regenerate/events').onmessage = (event) => onJobUpdate(JSON.parse(event.data));
+        new EventSource('/api/images/events').onmessage = (event) => onImagesUpdate(JSON.parse(event.data));
     </script>
 </body>
 </html>
     """
 
 if __name__ == "__main__":
-    # Note: Running with reload=True is great for development.
+    # Note: Running with reload=True is great for development; with COMPARATOR_WORKERS > 1 (several
+    # reviewers), uvicorn runs that many processes sharing the review state instead, without reload.
     # Uvicorn needs the app location as a string in this format: "filename:appname"
-    uvicorn.run("comparator_server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    workers = int(os.getenv("COMPARATOR_WORKERS", "1"))
+    if workers > 1:
+        uvicorn.run("comparator_server:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run("comparator_server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Page-level deltas between published database snapshots.
+
+A published snapshot is a VACUUMed SQLite file, so a small edit in Airtable
+usually changes only a handful of its pages. A delta lists the pages of the
+new snapshot that differ from a base snapshot, which lets a client holding the
+base rebuild the new file byte for byte (assets/js/db.js applies it).
+
+Delta format, all integers unsigned 32-bit big-endian:
+
+    b"WIFD"  page_size  new_page_count  changed_count
+    changed_count x (page_number, page_size bytes of page data)
+
+Page numbers are 0-based. Applying a delta truncates or zero-extends the base
+to new_page_count pages and then overwrites the listed pages.
+"""
+
+import struct
+
+DELTA_MAGIC = b"WIFD"
+HEADER = struct.Struct(">4sIII")
+PAGE_NUMBER = struct.Struct(">I")
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def make_delta(base: bytes, new: bytes, page_size: int) -> bytes:
+    """Returns a delta that turns base into new. Both must be whole pages of page_size."""
+    if len(new) % page_size or len(base) % page_size:
+        raise DeltaError(f"Snapshot size is not a multiple of the {page_size} byte page size")
+
+    new_page_count = len(new) // page_size
+    changed = []
+    for page_number in range(new_page_count):
+        start = page_number * page_size
+        page = new[start:start + page_size]
+        if page != base[start:start + page_size]:
+            changed.append(PAGE_NUMBER.pack(page_number) + page)
+
+    return HEADER.pack(DELTA_MAGIC, page_size, new_page_count, len(changed)) + b"".join(changed)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Rebuilds the new snapshot from base and a delta made by make_delta."""
+    if len(delta) < HEADER.size:
+        raise DeltaError("Truncated database delta")
+    magic, page_size, new_page_count, changed_count = HEADER.unpack_from(delta)
+    if magic != DELTA_MAGIC:
+        raise DeltaError("Not a database delta")
+    if len(delta) != HEADER.size + changed_count * (PAGE_NUMBER.size + page_size):
+        raise DeltaError("Truncated database delta")
+
+    size = new_page_count * page_size
+    result = bytearray(base[:size])
+    result.extend(bytes(size - len(result)))
+    offset = HEADER.size
+    for _ in range(changed_count):
+        (page_number,) = PAGE_NUMBER.unpack_from(delta, offset)
+        if page_number >= new_page_count:
+            raise DeltaError(f"Delta page {page_number} is past the end of the snapshot")
+        offset += PAGE_NUMBER.size
+        start = page_number * page_size
+        result[start:start + page_size] = delta[offset:offset + page_size]
+        offset += page_size
+    return bytes(result)
@@ -3,80 +3,321 @@
 Clothing Image Enhancement using Gemini 2.5 Flash Image Generation (Batch Processor)
 
 This script finds all images in the source directory and uses the core
-enhancement logic to process them in a batch.
+enhancement logic to process them in a batch. Images are processed
+concurrently; the number of model calls in flight is capped and adapts to
+rate limiting (see batch_engine.py).
+
+Progress is kept in a SQLite job ledger (see enhancement_ledger.py):
+
+    enhance_with_gemini_2_5.py           # new or changed images, and work an interrupted run left behind
+    enhance_with_gemini_2_5.py resume    # only failed or interrupted images
+    enhance_with_gemini_2_5.py status    # counts per state and the last error of each failure
+
+With --batch-job the generations are not made one call at a time: after the
+(cached) analyses, every pending request is written to a job file and sent to
+a batch backend as one job (see batch_jobs.py). The run polls the job and
+streams its results through the usual post-processing and write path. If it
+is stopped while the job is pending, the next --batch-job run re-attaches to
+the job instead of submitting a new one.
 """
 
 import os
 import sys
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List
 
 # Import the core logic
 from enhancement_logic import Gemini25ClothingEnhancer, SOURCE_DIR, OUTPUT_DIR, LOG_FILE
+from batch_engine import DEFAULT_MAX_IN_FLIGHT, AdaptiveLimiter, run_batch
+from enhancement_cache import EnhancementCache
+from postprocessing import Postprocessor
+from batch_jobs import (
+    COLLECTED, SUBMITTED, SUCCEEDED as JOB_SUCCEEDED, BatchBackend, create_batch_backend, find_unfinished_job,
+    iter_results, new_job_dir, read_manifest, request_line, wait_for_job, write_manifest,
+)
+from enhancement_ledger import FAILED, PENDING, RUNNING, SUCCEEDED, EnhancementLedger
+from hash_index import HashIndex
 
-def get_image_files_to_process():
-    """Get all processable image files that haven't been enhanced yet."""
+DEFAULT_MAX_ATTEMPTS = 3
+
+def get_image_files_to_process(ledger: EnhancementLedger, hash_index: HashIndex) -> List[Path]:
+    """
+    Reconciles the ledger with the source directory and returns the images to
+    enhance: new ones, ones whose source changed or whose output is missing,
+    and ones an interrupted run left pending or running. Only sources whose
+    size or mtime changed since they were last hashed are read.
+    """
     if not SOURCE_DIR.exists():
         print(f"Source directory not found: {SOURCE_DIR}")
         return []
 
-    all_files = [p for p in SOURCE_DIR.iterdir() if p.is_file()]
-    
-    # Filter out files that already exist in the output directory
-    images_to_process = [
-        p for p in all_files 
-        if not (OUTPUT_DIR / p.name).exists()
-    ]
-    
-    skipped_count = len(all_files) - len(images_to_process)
-    print(f"Found {len(all_files)} total images.")
-    if skipped_count > 0:
-        print(f"Skipping {skipped_count} images that already have an enhanced version.")
-    
+    all_files = sorted(p for p in SOURCE_DIR.iterdir() if p.is_file())
+    digests = hash_index.digests(all_files)
+    all_files = [p for p in all_files if str(p) in digests]
+    jobs = ledger.jobs()
+    images_to_process = []
+    failed = 0
+
+    for path in all_files:
+        source_hash = digests[str(path)]
+        job = jobs.get(path.name)
+        output_exists = (OUTPUT_DIR / path.name).exists()
+        if job is None:
+            if output_exists:
+                # Enhanced before the ledger existed
+                ledger.adopt(path.name, source_hash)
+                continue
+            ledger.enqueue(path.name, source_hash)
+        elif job["status"] == SUCCEEDED:
+            if output_exists and job["source_hash"] == source_hash:
+                continue
+            ledger.enqueue(path.name, source_hash)
+        elif job["status"] == FAILED:
+            if job["source_hash"] == source_hash:
+                failed += 1
+                continue
+            ledger.enqueue(path.name, source_hash)
+        images_to_process.append(path)
+
+    print(f"Found {len(all_files)} total images, {len(images_to_process)} to process.")
+    if failed:
+        print(f"Skipping {failed} failed images; run with 'resume' to retry them.")
     return images_to_process
 
+def get_image_files_to_resume(ledger: EnhancementLedger, max_attempts: int) -> List[Path]:
+    """Failed images with attempts left and images an interrupted run didn't finish."""
+    images = [SOURCE_DIR / name for name in ledger.resumable(max_attempts)]
+    missing = [p for p in images if not p.exists()]
+    if missing:
+        print(f"Skipping {len(missing)} images no longer in {SOURCE_DIR}.")
+    images = [p for p in images if p.exists()]
+    print(f"Resuming {len(images)} failed or interrupted images.")
+    return images
+
+def print_status(ledger: EnhancementLedger):
+    summary = ledger.summary()
+    print("📊 Ledger:")
+    for status in (PENDING, RUNNING, SUCCEEDED, FAILED):
+        print(f"   • {status}: {summary.get(status, 0)}")
+    for filename, attempts, error in ledger.failures():
+        print(f"   ❌ {filename} ({attempts} attempts): {error}")
+
+def source_hash(hash_index: HashIndex, image_path: Path) -> str:
+    """Digest of a source image, from the index unless the file changed. Raises KeyError if it is gone."""
+    return hash_index.digests([image_path])[str(image_path)]
+
+def make_job(enhancer: Gemini25ClothingEnhancer, ledger: EnhancementLedger, hash_index: HashIndex):
+    """Returns the per-image worker that records each attempt in the ledger."""
+    def process(image_path: Path) -> bool:
+        ledger.start(image_path.name, source_hash(hash_index, image_path))
+        try:
+            enhancer.logger.info(f"Processing: {image_path.name}")
+            enhancer.save_enhanced(image_path, enhancer.enhance(image_path))
+        except Exception as e:
+            enhancer.logger.error(f"Error processing {image_path.name}: {e}")
+            ledger.finish(image_path.name, error=str(e) or type(e).__name__)
+            return False
+        ledger.finish(image_path.name)
+        return True
+    return process
+
+def submit_batch_job(enhancer: Gemini25ClothingEnhancer, ledger: EnhancementLedger, hash_index: HashIndex,
+                     image_files: List[Path], backend: BatchBackend, workers: int) -> Path:
+    """
+    Builds the prompts (analyses go through the cache and limiter), writes the
+    requests that aren't cached yet to a job file, submits it and returns the
+    job directory. Cached generations are finished right away.
+    """
+    def build(image_path: Path):
+        try:
+            return image_path, enhancer.build_prompt(image_path), None
+        except Exception as e:
+            return image_path, None, e
+
+    digests = hash_index.digests(image_files)
+    job_dir = new_job_dir()
+    items = {}
+    cached = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(job_dir / "requests.jsonl", "w", encoding="utf-8") as job_file:
+        for image_path, prompt, error in executor.map(build, image_files):
+            ledger.start(image_path.name, digests[str(image_path)])
+            if error:
+                ledger.finish(image_path.name, error=str(error) or type(error).__name__)
+                continue
+            prepared = enhancer.prepared.get(image_path)
+            if enhancer.cache:
+                image_data = enhancer.cache.get_generation(prepared.source_hash, enhancer.model_name, prompt)
+                if image_data:
+                    enhancer.save_enhanced(image_path, enhancer.render(image_path, image_data))
+                    ledger.finish(image_path.name)
+                    cached += 1
+                    continue
+            job_file.write(request_line(image_path.name, prepared.generation_jpeg, prompt) + "\n")
+            items[image_path.name] = {"source_hash": prepared.source_hash, "prompt": prompt}
+
+    manifest = {"backend": backend.name, "model": enhancer.model_name, "job_name": None,
+                "created": datetime.now().isoformat(timespec="seconds"), "state": SUBMITTED, "items": items}
+    if cached:
+        print(f"♻️  {cached} generations were cached and are done already.")
+    if not items:
+        manifest["state"] = COLLECTED
+        write_manifest(job_dir, manifest)
+        return job_dir
+    size = (job_dir / "requests.jsonl").stat().st_size
+    print(f"📦 Submitting {len(items)} requests ({size / 1024 / 1024:.1f} MB) to the {backend.name} batch backend...")
+    manifest["job_name"] = backend.submit(job_dir / "requests.jsonl", enhancer.model_name)
+    write_manifest(job_dir, manifest)
+    print(f"   Job {manifest['job_name']} ({job_dir})")
+    return job_dir
+
+def collect_batch_job(enhancer: Gemini25ClothingEnhancer, ledger: EnhancementLedger, job_dir: Path,
+                      backend: BatchBackend, poll_interval: float, workers: int) -> Dict[str, int]:
+    """Waits for the job, then post-processes and writes each result as it is read."""
+    manifest = read_manifest(job_dir)
+    items = manifest["items"]
+    stats = {"total": len(items), "successful": 0, "failed": 0}
+    if manifest["state"] == COLLECTED:
+        return stats
+
+    state = wait_for_job(backend, manifest["job_name"], poll_interval)
+    if state != JOB_SUCCEEDED:
+        for filename in items:
+            ledger.finish(filename, error=f"Batch job {manifest['job_name']} {state}")
+        stats["failed"] = len(items)
+    else:
+        def finish(filename: str, image_data, error):
+            image_path = SOURCE_DIR / filename
+            try:
+                if error:
+                    raise RuntimeError(error)
+                if enhancer.cache:
+                    enhancer.cache.put_generation(items[filename]["source_hash"], manifest["model"],
+                                                  items[filename]["prompt"], image_data)
+                enhancer.save_enhanced(image_path, enhancer.render(image_path, image_data))
+            except Exception as e:
+                enhancer.logger.error(f"Error processing {filename}: {e}")
+                ledger.finish(filename, error=str(e) or type(e).__name__)
+                return False
+            ledger.finish(filename)
+            return True
+
+        seen = set()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for filename, image_data, error in iter_results(backend.fetch_results(manifest["job_name"], job_dir)):
+                if filename in items and filename not in seen:
+                    seen.add(filename)
+                    futures.append(executor.submit(finish, filename, image_data, error))
+            for future in futures:
+                stats["successful" if future.result() else "failed"] += 1
+        for filename in set(items) - seen:
+            ledger.finish(filename, error="Missing from the batch results")
+            stats["failed"] += 1
+        print(f"🖼️  Post-processed {len(seen)} results in {time.monotonic() - started:.1f}s")
+
+    manifest["state"] = COLLECTED
+    write_manifest(job_dir, manifest)
+    return stats
+
 def main():
     """Main execution function."""
+    parser = argparse.ArgumentParser(description="Enhance every image that has no enhanced version yet.")
+    parser.add_argument("command", nargs="?", choices=["run", "resume", "status"], default="run",
+                        help="run: new, changed and interrupted images; resume: failed and interrupted images only; "
+                             "status: show the ledger.")
+    parser.add_argument("--max-in-flight", type=int,
+                        default=int(os.getenv("ENHANCE_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)),
+                        help="Upper bound on concurrent model calls; lowered automatically when rate limited.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker threads (default: twice --max-in-flight, so local image work overlaps model calls).")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="resume skips images that already failed this many times.")
+    parser.add_argument("--postprocess-workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes for cropping, resizing and encoding (0: in the worker threads).")
+    parser.add_argument("--batch-job", action="store_true",
+                        help="Submit all generations as one batch job instead of interactive calls.")
+    parser.add_argument("--batch-backend", default=os.getenv("ENHANCE_BATCH_BACKEND", "gemini"),
+                        choices=["gemini", "local"], help="Where --batch-job runs (local: offline stand-in).")
+    parser.add_argument("--poll-interval", type=float, default=30.0,
+                        help="Seconds between status checks of a batch job.")
+    args = parser.parse_args()
+
+    ledger = EnhancementLedger()
+    # Shared with the comparator; sources that didn't change since either of them hashed them aren't read
+    hash_index = HashIndex()
+    if args.command == "status":
+        print_status(ledger)
+        return 0
+
     print("Gemini 2.5 Flash Clothing Enhancement Tool (Batch Mode)")
     print("=" * 50)
 
     api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
+    uses_gemini = os.getenv("ENHANCE_BACKEND", "gemini") == "gemini" or \
+        (args.batch_job and args.batch_backend == "gemini")
+    if not api_key and uses_gemini:
         print("\n❌ Missing GEMINI_API_KEY environment variable!")
         return 1
 
     try:
-        enhancer = Gemini25ClothingEnhancer(api_key)
-        image_files = get_image_files_to_process()
+        limiter = AdaptiveLimiter(args.max_in_flight)
+        cache = EnhancementCache()
+        postprocessor = Postprocessor(workers=args.postprocess_workers)
+        enhancer = Gemini25ClothingEnhancer(api_key, limiter=limiter, cache=cache, postprocessor=postprocessor)
+        workers = args.workers or 2 * limiter.max_in_flight
+        batch_backend = create_batch_backend(args.batch_backend, api_key) if args.batch_job else None
 
-        if not image_files:
-            print("\nNo new images to process.")
-            return 0
+        # A batch job left pending by an earlier run is collected before anything new is started
+        job_dir = find_unfinished_job(batch_backend.name) if batch_backend else None
+        if job_dir:
+            print(f"\n🔗 Re-attaching to batch job {read_manifest(job_dir)['job_name']} ({job_dir})")
+        else:
+            if args.command == "resume":
+                image_files = get_image_files_to_resume(ledger, args.max_attempts)
+            else:
+                image_files = get_image_files_to_process(ledger, hash_index)
 
-        print(f"\n🚀 Starting enhancement process for {len(image_files)} images...")
-        print(f"📁 Source: {SOURCE_DIR}")
-        print(f"📁 Output: {OUTPUT_DIR}")
-        print(f"📝 Logs: {LOG_FILE}")
+            if not image_files:
+                postprocessor.shutdown()
+                print("\nNo new images to process.")
+                return 0
 
-        stats = {"total": len(image_files), "successful": 0, "failed": 0}
+            print(f"\n🚀 Starting enhancement process for {len(image_files)} images...")
+            print(f"📁 Source: {SOURCE_DIR}")
+            print(f"📁 Output: {OUTPUT_DIR}")
+            print(f"📝 Logs: {LOG_FILE}")
+            print(f"⚙️  {workers} workers, up to {limiter.max_in_flight} model calls in flight")
 
-        for i, image_path in enumerate(image_files, 1):
-            print(f"\n{'='*20} Processing {i}/{len(image_files)} {'='*20}")
-            if enhancer.process_image(image_path):
-                stats["successful"] += 1
+        try:
+            if batch_backend:
+                job_dir = job_dir or submit_batch_job(enhancer, ledger, hash_index, image_files, batch_backend, workers)
+                stats = collect_batch_job(enhancer, ledger, job_dir, batch_backend, args.poll_interval, workers)
             else:
-                stats["failed"] += 1
-            
-            if i < len(image_files):
-                print("Waiting 3 seconds before next image...")
-                time.sleep(3)
+                stats = run_batch(make_job(enhancer, ledger, hash_index), image_files, workers)
+        finally:
+            postprocessor.shutdown()
 
         print("\n🎉 Enhancement Complete!")
         print(f"📊 Statistics:")
         print(f"   • Total images processed: {stats['total']}")
         print(f"   • ✅ Successfully enhanced: {stats['successful']}")
         print(f"   • ❌ Failed: {stats['failed']}")
+        print(f"   • Model calls: {limiter.stats['calls']}, rate limited {limiter.stats['throttled']} times "
+              f"({limiter.stats['throttled_seconds']:.0f}s cooling down)")
+        print(f"   • Cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses, "
+              f"{cache.stats['evicted']} evicted")
+        print(f"   • Uploaded {enhancer.backend.stats['bytes_up'] / 1024 / 1024:.1f} MB, "
+              f"downloaded {enhancer.backend.stats['bytes_down'] / 1024 / 1024:.1f} MB")
+        for stage, timing in enhancer.timer.summary().items():
+            print(f"   • {stage}: p50 {timing['p50']:.2f}s, p95 {timing['p95']:.2f}s over {timing['count']} calls")
+        if stats["failed"]:
+            print("   Failures are recorded in the ledger; see 'status' and retry with 'resume'.")
 
     except Exception as e:
         print(f"❌ Error: {e}")
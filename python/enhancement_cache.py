@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Persistent cache for model results of the image enhancer.
+
+Entries are keyed by the SHA-256 of the source image, the model name and the
+exact prompt, so an unchanged photo never pays for the same analysis twice and
+an identical generation request is answered from disk. Generated images are
+stored as the raw bytes the model returned, before cropping and resizing.
+
+The cache lives in one SQLite file. When it grows past its size limit the
+least recently used entries are evicted, and entries of a model version can be
+dropped explicitly:
+
+    python enhancement_cache.py --stats
+    python enhancement_cache.py --invalidate-model gemini-2.5-flash-image-preview
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+CACHE_PATH = PROJECT_ROOT / "python/enhancement_cache.sqlite"
+DEFAULT_MAX_BYTES = int(os.getenv("ENHANCE_CACHE_MAX_MB", "500")) * 1024 * 1024
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    source_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    item_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (source_hash, model, prompt_hash)
+);
+
+CREATE TABLE IF NOT EXISTS generation_cache (
+    source_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    image BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (source_hash, model, prompt_hash)
+);
+"""
+
+CACHE_TABLES = ("analysis_cache", "generation_cache")
+# Writes between exact recounts of the cache size, which pick up what other processes wrote
+RECOUNT_EVERY = 100
+
+
+def _prompt_hash(prompt: str) -> str:
+    # Prompts are long; the key only needs to tell them apart
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class EnhancementCache:
+    """Thread-safe SQLite cache of analyses and generated images."""
+
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(CACHE_SCHEMA)
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+        # Running total of the entry sizes, so a write doesn't have to sum both tables
+        self.total_bytes = self._count_bytes()
+        self.puts_since_recount = 0
+
+    def close(self):
+        self.conn.close()
+
+    def _get(self, table: str, columns: str, source_hash: str, model: str, prompt: str):
+        key = (source_hash, model, _prompt_hash(prompt))
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                f"SELECT {columns} FROM {table} WHERE source_hash = ? AND model = ? AND prompt_hash = ?", key
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    f"UPDATE {table} SET last_used = ? WHERE source_hash = ? AND model = ? AND prompt_hash = ?",
+                    (time.time(), *key))
+            self.stats["hits" if row else "misses"] += 1
+            return row
+
+    def _put(self, table: str, values: Dict, source_hash: str, model: str, prompt: str):
+        key = (source_hash, model, _prompt_hash(prompt))
+        row = dict(values, source_hash=source_hash, model=model, prompt_hash=key[2], last_used=time.time())
+        columns = ", ".join(row)
+        with self.lock, self.conn:
+            replaced = self.conn.execute(
+                f"SELECT size FROM {table} WHERE source_hash = ? AND model = ? AND prompt_hash = ?", key
+            ).fetchone()
+            self.conn.execute(f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({', '.join('?' * len(row))})",
+                              tuple(row.values()))
+            self.total_bytes += row["size"] - (replaced[0] if replaced else 0)
+            self.puts_since_recount += 1
+            if self.total_bytes > self.max_bytes or self.puts_since_recount >= RECOUNT_EVERY:
+                self.total_bytes = self._count_bytes()
+                self.puts_since_recount = 0
+                self._evict()
+
+    def _count_bytes(self) -> int:
+        return sum(self.conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+                   for table in CACHE_TABLES)
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes. Caller holds the lock."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        union = " UNION ALL ".join(
+            f"SELECT '{table}' AS tbl, rowid, size, last_used FROM {table}" for table in CACHE_TABLES)
+        for table, rowid, size, _ in self.conn.execute(f"SELECT * FROM ({union}) ORDER BY last_used").fetchall():
+            self.conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+            self.stats["evicted"] += 1
+            self.total_bytes -= size
+            if self.total_bytes <= self.max_bytes:
+                break
+
+    def get_analysis(self, source_hash: str, model: str, prompt: str) -> Optional[Dict[str, str]]:
+        row = self._get("analysis_cache", "analysis, item_type", source_hash, model, prompt)
+        return {"analysis": row[0], "item_type": row[1]} if row else None
+
+    def put_analysis(self, source_hash: str, model: str, prompt: str, result: Dict[str, str]):
+        size = len(result["analysis"].encode('utf-8'))
+        self._put("analysis_cache", {"analysis": result["analysis"], "item_type": result["item_type"], "size": size},
+                  source_hash, model, prompt)
+
+    def get_generation(self, source_hash: str, model: str, prompt: str) -> Optional[bytes]:
+        row = self._get("generation_cache", "image", source_hash, model, prompt)
+        return row[0] if row else None
+
+    def put_generation(self, source_hash: str, model: str, prompt: str, image: bytes):
+        self._put("generation_cache", {"image": image, "size": len(image)}, source_hash, model, prompt)
+
+    def invalidate(self, model: Optional[str] = None) -> int:
+        """Deletes the entries of one model, or every entry. Returns the number deleted."""
+        deleted = 0
+        with self.lock, self.conn:
+            for table in CACHE_TABLES:
+                if model:
+                    deleted += self.conn.execute(f"DELETE FROM {table} WHERE model = ?", (model,)).rowcount
+                else:
+                    deleted += self.conn.execute(f"DELETE FROM {table}").rowcount
+            self.total_bytes = self._count_bytes()
+        return deleted
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Returns entry count and bytes per table and model."""
+        result = {}
+        with self.lock:
+            for table in CACHE_TABLES:
+                for model, count, size in self.conn.execute(
+                        f"SELECT model, COUNT(*), SUM(size) FROM {table} GROUP BY model"):
+                    result[f"{table} {model}"] = {"entries": count, "bytes": size}
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the enhancement cache.")
+    parser.add_argument("--stats", action="store_true", help="Show entries and size per model.")
+    parser.add_argument("--invalidate-model", metavar="MODEL", help="Delete all entries produced by MODEL.")
+    parser.add_argument("--clear", action="store_true", help="Delete every entry.")
+    args = parser.parse_args()
+
+    cache = EnhancementCache()
+    if args.invalidate_model or args.clear:
+        deleted = cache.invalidate(None if args.clear else args.invalidate_model)
+        cache.conn.execute("VACUUM")
+        print(f"Deleted {deleted} cache entries.")
+    for name, info in cache.summary().items():
+        print(f"{name}: {info['entries']} entries, {info['bytes'] / 1024 / 1024:.1f} MB")
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Numbered regeneration candidates awaiting review.
+
+Candidates of an enhanced image are kept in CANDIDATES_DIR, next to the
+enhanced images, as <filename>.<number><suffix> (e.g. abc.jpg.2.jpg, plus
+abc.jpg.2.webp if extra formats are configured). The full file name keeps the
+candidates of abc.jpg and abc.png apart. Saving a new set replaces the previous one.
+Promoting a candidate moves its files over the enhanced image and discards
+the rest of the set.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Dict, List
+
+from enhancement_logic import OUTPUT_DIR, PROJECT_ROOT, write_atomic
+
+CANDIDATES_DIR = Path(os.getenv("ENHANCE_CANDIDATES_DIR", PROJECT_ROOT / "assets/images/shop_enhanced_candidates"))
+MAX_CANDIDATES = 4
+
+
+def _candidate_files(filename: str) -> Dict[int, List[Path]]:
+    """Candidate number -> its files, main format first."""
+    suffix = os.path.splitext(filename)[1]
+    pattern = re.compile(re.escape(filename) + r"\.(\d+)(\.\w+)$")
+    candidates = {}
+    if CANDIDATES_DIR.exists():
+        for path in CANDIDATES_DIR.iterdir():
+            match = pattern.match(path.name)
+            if match:
+                candidates.setdefault(int(match.group(1)), []).append(path)
+    for files in candidates.values():
+        files.sort(key=lambda p: p.suffix != suffix)
+    return candidates
+
+
+def list_candidates(filename: str) -> List[str]:
+    """File names (in CANDIDATES_DIR) of the main output of each candidate, by number."""
+    return [files[0].name for _, files in sorted(_candidate_files(filename).items())]
+
+
+def discard_candidates(filename: str):
+    for files in _candidate_files(filename).values():
+        for path in files:
+            path.unlink(missing_ok=True)
+
+
+def save_candidates(filename: str, candidates: List[Dict[str, bytes]]) -> List[str]:
+    """Replaces the candidates of filename with new ones (outputs by suffix); returns their names."""
+    CANDIDATES_DIR.mkdir(parents=True, exist_ok=True)
+    discard_candidates(filename)
+    for number, outputs in enumerate(candidates, start=1):
+        for suffix, data in outputs.items():
+            write_atomic(CANDIDATES_DIR / f"{filename}.{number}{suffix}", data)
+    return list_candidates(filename)
+
+
+def promote_candidate(filename: str, number: int) -> Path:
+    """Makes a candidate the enhanced image and discards the others. Raises KeyError if it doesn't exist."""
+    files = _candidate_files(filename)[number]
+    stem = os.path.splitext(filename)[0]
+    for path in files:
+        # Same filesystem, so each file is replaced in one atomic rename
+        os.replace(path, OUTPUT_DIR / (stem + path.suffix))
+    discard_candidates(filename)
+    return OUTPUT_DIR / filename
@@ -0,0 +1,115 @@
+"""
+SQLite job ledger for batch enhancement runs.
+
+Every source image gets one row recording its state (pending, running,
+succeeded or failed), the error of the last failure, the number of attempts,
+the duration of the last attempt and the hash of the source it was made from.
+Each batch invocation has a run id. Rows left pending or running by an earlier
+run were interrupted and count as stale, so a run can be stopped at any point
+and resumed without redoing finished images or losing unfinished ones.
+"""
+
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+LEDGER_PATH = PROJECT_ROOT / "python/enhancement_ledger.sqlite"
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enhancement_jobs (
+    filename TEXT PRIMARY KEY,
+    source_hash TEXT,
+    status TEXT NOT NULL,
+    run_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_enhancement_jobs_status ON enhancement_jobs(status);
+"""
+
+
+class EnhancementLedger:
+    """Thread-safe record of per-image job state."""
+
+    def __init__(self, path: Path = LEDGER_PATH):
+        self.run_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(LEDGER_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def jobs(self) -> Dict[str, Dict]:
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM enhancement_jobs")
+            columns = [c[0] for c in cursor.description]
+            return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    def enqueue(self, filename: str, source_hash: str):
+        """Marks an image as waiting to be (re)processed for the given source."""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO enhancement_jobs (filename, source_hash, status, run_id) VALUES (?, ?, ?, ?)
+                ON CONFLICT(filename) DO UPDATE SET
+                    source_hash=excluded.source_hash, status=excluded.status, run_id=excluded.run_id,
+                    attempts=0, error=NULL
+            """, (filename, source_hash, PENDING, self.run_id))
+
+    def adopt(self, filename: str, source_hash: str):
+        """Records an output that predates the ledger as succeeded."""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT OR IGNORE INTO enhancement_jobs (filename, source_hash, status, run_id) VALUES (?, ?, ?, ?)
+            """, (filename, source_hash, SUCCEEDED, self.run_id))
+
+    def start(self, filename: str, source_hash: str):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO enhancement_jobs (filename, source_hash, status, run_id, attempts, started_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT(filename) DO UPDATE SET
+                    source_hash=excluded.source_hash, status=excluded.status, run_id=excluded.run_id,
+                    attempts=attempts + 1, started_at=excluded.started_at, finished_at=NULL, duration=NULL
+            """, (filename, source_hash, RUNNING, self.run_id, time.time()))
+
+    def finish(self, filename: str, error: Optional[str] = None):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                UPDATE enhancement_jobs SET status = ?, error = ?, finished_at = ?, duration = ? - started_at
+                WHERE filename = ?
+            """, (FAILED if error else SUCCEEDED, error, now, now, filename))
+
+    def resumable(self, max_attempts: int) -> List[str]:
+        """Failed images with attempts left, and images an interrupted run left pending or running."""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("""
+                SELECT filename FROM enhancement_jobs
+                WHERE (status = ? AND attempts < ?) OR (status IN (?, ?) AND run_id != ?)
+                ORDER BY filename
+            """, (FAILED, max_attempts, PENDING, RUNNING, self.run_id))]
+
+    def summary(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM enhancement_jobs GROUP BY status"))
+
+    def failures(self) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT filename, attempts, error FROM enhancement_jobs WHERE status = ? ORDER BY filename",
+                (FAILED,)).fetchall()
@@ -5,96 +5,168 @@ Core Image Enhancement Logic for Wear It Forward Project
 
 import os
 import sys
+import shutil
+import time
 import logging
+import threading
 from pathlib import Path
-from typing import Optional, Dict
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List
 
 try:
-    from google import genai
-    from PIL import Image, ImageOps
+    from PIL import Image
     from dotenv import load_dotenv
 except ImportError as e:
     print(f"Missing required packages. Please install: {e}")
     print("Run: pip install google-genai Pillow python-dotenv")
     sys.exit(1)
 
+from image_preparation import PreparedImageCache
+from model_backends import ModelBackend, create_backend
+from postprocessing import Postprocessor, crop_box
+from metrics import IMAGES, MODEL_CALL_SECONDS, MODEL_CALLS
+from stage_timing import StageTimer, default_span_log
+
 # Load environment variables
 load_dotenv()
 
 # Configuration
 PROJECT_ROOT = Path(__file__).parent.parent.resolve()
 SOURCE_DIR = PROJECT_ROOT / "assets/images/shop"
-OUTPUT_DIR = PROJECT_ROOT / "assets/images/shop_enhanced"
-LOG_FILE = PROJECT_ROOT / "python/gemini_2_5_enhancement_log.txt"
+OUTPUT_DIR = Path(os.getenv("ENHANCE_OUTPUT_DIR", PROJECT_ROOT / "assets/images/shop_enhanced"))
+LOG_FILE = Path(os.getenv("ENHANCE_LOG_FILE", PROJECT_ROOT / "python/gemini_2_5_enhancement_log.txt"))
+
+ANALYSIS_MODEL = "gemini-2.5-flash"
+ANALYSIS_PROMPT = "Analyze this Indian clothing or jewelry item..."
+# Appended to the prompt of each of several candidates, so they differ even
+# where the backend answers the same prompt the same way (the fake backend)
+CANDIDATE_PROMPT = "\n\nThis is take {number} of {count}; vary the lighting and framing from the other takes."
+
+
+def configure_logging():
+    """Logs INFO and above to LOG_FILE and stdout, unless logging was configured already."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+
+def write_atomic(path: Path, data: bytes):
+    """Writes data to path through a temporary file, so readers never see a partial file."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def copy_atomic(source: Path, destination: Path):
+    """Copies source (with its timestamps) over destination through a temporary file."""
+    tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, destination)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
 
 class Gemini25ClothingEnhancer:
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize the enhancer with Gemini 2.5 Flash."""
+    def __init__(self, api_key: Optional[str] = None, backend: Optional[ModelBackend] = None,
+                 limiter=None, cache=None, postprocessor: Optional[Postprocessor] = None):
+        """
+        Initialize the enhancer with Gemini 2.5 Flash.
+
+        backend replaces the model backend chosen by ENHANCE_BACKEND (see
+        model_backends.py), limiter, if given, is an AdaptiveLimiter every model
+        call goes through, cache, if given, is an EnhancementCache for analyses
+        and generations, and postprocessor replaces the inline crop/resize/encode
+        stage configured from the environment (see postprocessing.py).
+        """
         self.setup_logging()
+        self.model_name = "gemini-2.5-flash-image-preview"
+        self.analysis_model_name = ANALYSIS_MODEL
+        self.limiter = limiter
+        self.cache = cache
+        # Decoded, right-sized payloads shared by the calls made for one source
+        self.prepared = PreparedImageCache()
+        # Per-stage durations, metrics and JSON-lines spans (see stage_timing.py)
+        self.timer = StageTimer(default_span_log())
+        self.postprocessor = postprocessor or Postprocessor()
 
-        if not api_key:
-            api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            self.logger.error("No API key provided. Set GEMINI_API_KEY environment variable.")
-            raise ValueError("API key is required")
+        if backend is not None:
+            self.backend = backend
+        else:
+            if not api_key:
+                api_key = os.getenv('GEMINI_API_KEY')
+            if not api_key and os.getenv("ENHANCE_BACKEND", "gemini") == "gemini":
+                self.logger.error("No API key provided. Set GEMINI_API_KEY environment variable.")
+                raise ValueError("API key is required")
 
-        try:
-            os.environ['GEMINI_API_KEY'] = api_key
-            self.client = genai.Client()
-            self.model_name = "gemini-2.5-flash-image-preview"
-            self.logger.info("Initialized Gemini 2.5 Flash client")
-        except Exception as e:
-            self.logger.error(f"Could not initialize Gemini client: {e}")
-            raise
+            try:
+                self.backend = create_backend(api_key=api_key)
+                self.logger.info(f"Initialized {self.backend.name} model backend")
+            except Exception as e:
+                self.logger.error(f"Could not initialize model backend: {e}")
+                raise
 
         OUTPUT_DIR.mkdir(exist_ok=True)
         self.logger.info(f"Source: {SOURCE_DIR}, Output: {OUTPUT_DIR}")
 
     def setup_logging(self):
         """Set up logging."""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(LOG_FILE),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
+        configure_logging()
         self.logger = logging.getLogger(__name__)
 
+    def call_model(self, method, model: str, *args):
+        """Calls a backend method, through the limiter when batching, and records it in the metrics."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            if self.limiter:
+                return self.limiter.call(method, model, *args)
+            return method(model, *args)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            MODEL_CALLS.inc(model=model, outcome=outcome)
+            MODEL_CALL_SECONDS.observe(time.perf_counter() - start, model=model)
+
     def crop_to_aspect_ratio(self, image: Image.Image, aspect_ratio: float) -> Image.Image:
         """Crops an image to a target aspect ratio from the center."""
-        original_width, original_height = image.size
-        original_aspect = original_width / original_height
-
-        if original_aspect > aspect_ratio:
-            new_width = int(aspect_ratio * original_height)
-            offset = (original_width - new_width) // 2
-            return image.crop((offset, 0, offset + new_width, original_height))
-        else:
-            new_height = int(original_width / aspect_ratio)
-            offset = (original_height - new_height) // 2
-            return image.crop((0, offset, original_width, offset + new_height))
+        return image.crop(crop_box(image.size, aspect_ratio))
 
     def analyze_clothing_item(self, image_path: Path) -> Dict[str, str]:
         """Analyze the clothing item to create better enhancement prompts."""
         analysis_result = {"analysis": "Indian traditional clothing", "item_type": "garment"}
+        prepared = self.prepared.get(image_path)
+        source_hash = prepared.source_hash
+        if self.cache:
+            cached = self.cache.get_analysis(source_hash, self.analysis_model_name, ANALYSIS_PROMPT)
+            if cached:
+                self.logger.info(f"Using cached analysis for {image_path.name}")
+                return cached
         try:
-            img = Image.open(image_path)
-            img = ImageOps.exif_transpose(img)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+            with self.timer.stage("analyze", image_path.name):
+                analysis = self.call_model(self.backend.analyze, self.analysis_model_name,
+                                           prepared.analysis_jpeg, ANALYSIS_PROMPT)
 
-            prompt = "Analyze this Indian clothing or jewelry item..."
-            response = self.client.models.generate_content(model="gemini-2.5-flash", contents=[img, prompt])
-            
-            if response.candidates and response.candidates[0].content.parts:
-                analysis = response.candidates[0].content.parts[0].text.strip()
+            if analysis:
                 analysis_result["analysis"] = analysis
                 jewelry_keywords = ['necklace', 'earrings', 'bangles', 'ring', 'jewelry']
                 if any(keyword in analysis.lower() for keyword in jewelry_keywords):
                     analysis_result["item_type"] = "jewelry"
+                # Only real answers are cached, never the fallback above
+                if self.cache:
+                    self.cache.put_analysis(source_hash, self.analysis_model_name, ANALYSIS_PROMPT, analysis_result)
             return analysis_result
         except Exception as e:
             self.logger.warning(f"Could not analyze {image_path.name}: {e}")
@@ -151,57 +223,134 @@ class Gemini25ClothingEnhancer:
             
         return base_prompt
 
-    def enhance_with_gemini(self, image_path: Path, additional_prompt: str = "") -> Optional[bytes]:
-        """Use Gemini to enhance the image."""
+    def generate_image(self, image_path: Path, prompt: str, reuse_cached: bool = True) -> bytes:
+        """
+        Returns the raw image bytes the model generates for prompt, from the
+        cache if allowed. Raises EnhancementError if the model returns no image.
+        """
+        prepared = self.prepared.get(image_path)
+        source_hash = prepared.source_hash
+        if self.cache and reuse_cached:
+            cached = self.cache.get_generation(source_hash, self.model_name, prompt)
+            if cached:
+                self.logger.info(f"Using cached generation for {image_path.name}")
+                return cached
+
+        self.logger.info(f"Generating enhanced image for {image_path.name}...")
+        with self.timer.stage("generate", image_path.name):
+            image_data = self.call_model(self.backend.generate_image, self.model_name,
+                                         prepared.generation_jpeg, prompt)
+        if self.cache:
+            self.cache.put_generation(source_hash, self.model_name, prompt, image_data)
+        return image_data
+
+    def enhance(self, image_path: Path, additional_prompt: str = "", reuse_cached: bool = True) -> Dict[str, bytes]:
+        """
+        Enhances the image and returns the encoded results by file suffix, the
+        main one (the suffix of image_path) first. With reuse_cached=False a new
+        image is generated even if the same request is cached (the analysis is
+        still reused). Raises on failure.
+        """
         try:
-            analysis_result = self.analyze_clothing_item(image_path)
-            prompt = self.create_enhancement_prompt(
+            with self.timer.stage("enhance", image_path.name):
+                outputs = self._enhance(image_path, additional_prompt, reuse_cached)
+        except Exception:
+            IMAGES.inc(outcome="failed")
+            raise
+        IMAGES.inc(outcome="ok")
+        return outputs
+
+    def build_prompt(self, image_path: Path, additional_prompt: str = "") -> str:
+        """Loads and analyzes the source and returns the generation prompt for it."""
+        name = image_path.name
+        with self.timer.stage("load", name):
+            prepared = self.prepared.get(image_path)
+        self.logger.info(f"Prepared {name}: {prepared.source_size[0]}x{prepared.source_size[1]}, "
+                         f"{prepared.source_bytes // 1024} KB on disk, {prepared.upload_bytes // 1024} KB to upload")
+        analysis_result = self.analyze_clothing_item(image_path)
+        with self.timer.stage("prompt", name):
+            return self.create_enhancement_prompt(
                 analysis_result["analysis"], 
                 analysis_result["item_type"], 
                 additional_prompt
             )
-            
-            original_image = Image.open(image_path)
-            original_image = ImageOps.exif_transpose(original_image)
-            if original_image.mode != 'RGB':
-                original_image = original_image.convert('RGB')
-
-            self.logger.info(f"Generating enhanced image for {image_path.name}...")
-            response = self.client.models.generate_content(model=self.model_name, contents=[original_image, prompt])
-
-            if response.candidates and response.candidates[0].content.parts:
-                image_parts = [p for p in response.candidates[0].content.parts if p.inline_data]
-                if image_parts:
-                    image_data = image_parts[0].inline_data.data
-                    enhanced_image = Image.open(BytesIO(image_data))
-                    cropped_image = self.crop_to_aspect_ratio(enhanced_image, 3/4)
-                    resized_image = cropped_image.resize((1200, 1600), Image.Resampling.LANCZOS)
-                    output_buffer = BytesIO()
-                    resized_image.save(output_buffer, format='JPEG', quality=95)
-                    self.logger.info(f"Successfully generated enhanced image for {image_path.name}")
-                    return output_buffer.getvalue()
-                else:
-                    text_response = " ".join([p.text for p in response.candidates[0].content.parts if hasattr(p, 'text')])
-                    self.logger.error(f"Gemini enhancement failed. No image data. Response: {text_response}")
-                    return None
-            return None
+
+    def render(self, image_path: Path, image_data: bytes) -> Dict[str, bytes]:
+        """Post-processes a generated image into the encoded outputs by file suffix."""
+        name = image_path.name
+        with self.timer.stage("postprocess", name):
+            result = self.postprocessor.run(image_data, image_path.suffix)
+        # The steps ran in the postprocessor, possibly in another process
+        for step, seconds in result.timings.items():
+            self.timer.record(f"postprocess.{step}", seconds, name)
+        sizes = ", ".join(f"{suffix} {len(data) // 1024} KB" for suffix, data in result.outputs.items())
+        self.logger.info(f"Successfully generated enhanced image for {name} "
+                         f"({sizes}{'' if result.resized else ', already at target size'})")
+        return result.outputs
+
+    def _enhance(self, image_path: Path, additional_prompt: str, reuse_cached: bool) -> Dict[str, bytes]:
+        prompt = self.build_prompt(image_path, additional_prompt)
+        image_data = self.generate_image(image_path, prompt, reuse_cached)
+        return self.render(image_path, image_data)
+
+    def enhance_candidates(self, image_path: Path, additional_prompt: str = "", count: int = 2) -> List[Dict[str, bytes]]:
+        """
+        Generates count new variants of the image concurrently from one analysis
+        and returns their encoded outputs. Failed variants are left out; raises
+        only if all of them fail.
+        """
+        prompt = self.build_prompt(image_path, additional_prompt)
+
+        def candidate(number: int) -> Dict[str, bytes]:
+            take_prompt = prompt + CANDIDATE_PROMPT.format(number=number, count=count) if count > 1 else prompt
+            with self.timer.stage("enhance", image_path.name):
+                self.logger.info(f"Generating candidate {number} of {count} for {image_path.name}")
+                return self.render(image_path, self.generate_image(image_path, take_prompt, reuse_cached=False))
+
+        candidates, errors = [], []
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="candidate") as executor:
+            for future in [executor.submit(candidate, number) for number in range(1, count + 1)]:
+                try:
+                    candidates.append(future.result())
+                    IMAGES.inc(outcome="ok")
+                except Exception as e:
+                    self.logger.warning(f"A candidate for {image_path.name} failed: {e}")
+                    IMAGES.inc(outcome="failed")
+                    errors.append(e)
+        if not candidates:
+            raise errors[0]
+        return candidates
+
+    def enhance_with_gemini(self, image_path: Path, additional_prompt: str = "",
+                            reuse_cached: bool = True) -> Optional[Dict[str, bytes]]:
+        """Use Gemini to enhance the image. Returns None on failure."""
+        try:
+            return self.enhance(image_path, additional_prompt, reuse_cached)
         except Exception as e:
             self.logger.error(f"Gemini enhancement failed for {image_path.name}: {e}")
             return None
 
-    def process_image(self, image_path: Path, additional_prompt: str = "") -> bool:
+    def save_enhanced(self, image_path: Path, outputs: Dict[str, bytes]) -> Path:
+        """
+        Writes the enhanced image, and any extra formats next to it. Returns
+        the path of the main output.
+        """
+        with self.timer.stage("write", image_path.name):
+            for suffix, data in outputs.items():
+                write_atomic(OUTPUT_DIR / (image_path.stem + suffix), data)
+        output_path = OUTPUT_DIR / (image_path.stem + next(iter(outputs)))
+        self.logger.info(f"✅ Enhanced and saved: {output_path.name}")
+        return output_path
+
+    def process_image(self, image_path: Path, additional_prompt: str = "", reuse_cached: bool = True) -> bool:
         """Process a single image."""
         try:
             self.logger.info(f"Processing: {image_path.name}")
-            enhanced_bytes = self.enhance_with_gemini(image_path, additional_prompt)
-            if not enhanced_bytes:
+            outputs = self.enhance_with_gemini(image_path, additional_prompt, reuse_cached)
+            if not outputs:
                 return False
-            
-            output_path = OUTPUT_DIR / image_path.name
-            with open(output_path, 'wb') as f:
-                f.write(enhanced_bytes)
-            self.logger.info(f"✅ Enhanced and saved: {output_path.name}")
+            self.save_enhanced(image_path, outputs)
             return True
         except Exception as e:
             self.logger.error(f"Error processing {image_path.name}: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,16 @@
+"""
+File helpers shared by the sync, publish and enhancement scripts.
+"""
+
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path) -> str:
+    """SHA-256 hex digest of a file, read in chunks so large images aren't loaded whole."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,134 @@
+"""
+Persistent index of file digests.
+
+Rows are keyed by path and remember the size and mtime (in ns) the digest was
+computed for. A file whose size and mtime still match is not read again; new
+and changed files are hashed in chunks on a thread pool (hashlib releases the
+GIL while hashing, so the threads overlap). On an unchanged tree a lookup is
+one stat per file and one query.
+
+Values derived from a pair of files (e.g. the perceptual scores of
+image_scoring.py) are kept alongside, keyed by both digests and a version of
+the code that computed them, so they go stale with either file.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple, Union
+
+from file_utils import hash_file
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+# Next to the image directories, not in them, so it is never served or listed as an image
+HASH_INDEX_PATH = PROJECT_ROOT / "assets/images/.hash_index.sqlite"
+DEFAULT_WORKERS = 8
+# Up to this many paths are looked up by key instead of reading the whole table
+LOOKUP_BATCH = 500
+
+HASH_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pair_scores (
+    first_digest TEXT NOT NULL,
+    second_digest TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    scores TEXT NOT NULL,
+    PRIMARY KEY (first_digest, second_digest, version)
+);
+"""
+
+
+class HashIndex:
+    """Thread-safe SHA-256 digests of files, recomputed only when a file changed."""
+
+    def __init__(self, path: Path = HASH_INDEX_PATH, workers: int = DEFAULT_WORKERS):
+        self.path = Path(path)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(HASH_INDEX_SCHEMA)
+        self.stats = {"cached": 0, "hashed": 0}
+
+    def close(self):
+        self.conn.close()
+
+    def digests(self, paths: Iterable[Union[str, Path]]) -> Dict[str, str]:
+        """Digest of each path, by path string. Files that can't be read are left out."""
+        # Plain strings: building thousands of Path objects costs more than the stats
+        current = {}
+        for path in map(os.fspath, paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (st.st_size, st.st_mtime_ns)
+        if not current:
+            return {}
+
+        with self.lock:
+            if len(current) <= LOOKUP_BATCH:
+                # A few files (one preview, one refresh): look up just their rows
+                placeholders = ",".join("?" * len(current))
+                rows = self.conn.execute(
+                    f"SELECT path, size, mtime_ns, digest FROM file_hashes WHERE path IN ({placeholders})",
+                    list(current))
+            else:
+                rows = self.conn.execute("SELECT path, size, mtime_ns, digest FROM file_hashes")
+            known = {row[0]: row[1:] for row in rows}
+
+        digests, stale = {}, []
+        for path, (size, mtime_ns) in current.items():
+            row = known.get(path)
+            if row and row[0] == size and row[1] == mtime_ns:
+                digests[path] = row[2]
+            else:
+                stale.append(path)
+
+        def compute(path: str):
+            try:
+                return path, hash_file(path)
+            except OSError:
+                return path, None
+
+        updates = []
+        if stale:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(stale))) as executor:
+                for path, digest in executor.map(compute, stale):
+                    if digest:
+                        digests[path] = digest
+                        updates.append((path, *current[path], digest))
+            with self.lock, self.conn:
+                self.conn.executemany("""
+                    INSERT INTO file_hashes (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET
+                        size=excluded.size, mtime_ns=excluded.mtime_ns, digest=excluded.digest
+                """, updates)
+
+        with self.lock:
+            self.stats["cached"] += len(current) - len(stale)
+            self.stats["hashed"] += len(updates)
+        return digests
+
+    def pair_scores(self, pairs: List[Tuple[str, str]], version: int) -> Dict[Tuple[str, str], Dict]:
+        """Stored scores of (first digest, second digest) pairs, computed by the given version."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT first_digest, second_digest, scores FROM pair_scores WHERE version = ?", (version,))
+            stored = {(first, second): scores for first, second, scores in rows}
+        return {pair: json.loads(stored[pair]) for pair in pairs if pair in stored}
+
+    def put_pair_scores(self, scores: Dict[Tuple[str, str], Dict], version: int):
+        with self.lock, self.conn:
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO pair_scores (first_digest, second_digest, version, scores) VALUES (?, ?, ?, ?)
+            """, [(first, second, version, json.dumps(values)) for (first, second), values in scores.items()])
@@ -0,0 +1,217 @@
+"""
+Responsive derivatives of the product images.
+
+The storefront used to serve the full-resolution originals everywhere. For
+every product image this module renders a thumbnail, listing and detail width
+in JPEG and WebP, so the templates can emit srcset and let the browser pick
+the smallest file that fills the slot.
+
+Rendering runs in a process pool, one source image per task. Sources are
+tracked by path, mtime and size, and only rehashed when those change; only
+images whose content hash changed are rendered again. That also covers
+originals replaced locally by an enhanced version. Derivatives are named after
+the source hash and width, so a new version never reuses a cached URL.
+"""
+
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image, ImageOps
+
+from file_utils import hash_file
+
+# A sibling of the shop directory, which the enhancement tools read as their source
+DERIVED_DIR = "assets/images/shop_derived"
+
+# variant -> target width in CSS pixels at 1x; sources are never upscaled
+DERIVATIVE_WIDTHS = {
+    "thumbnail": 160,
+    "listing": 480,
+    "detail": 1200,
+}
+
+# format -> (file extension, Pillow save options)
+DERIVATIVE_FORMATS = {
+    "jpeg": (".jpg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": (".webp", {"quality": 80, "method": 6}),
+}
+
+IMAGE_DERIVATIVES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_sources (
+    source_path TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS image_derivatives (
+    source_path TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    format TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    web_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (source_path, variant, format)
+);
+"""
+
+
+def ensure_derivative_tables(cursor):
+    """Creates the image derivative tables if they don't exist."""
+    cursor.executescript(IMAGE_DERIVATIVES_SCHEMA)
+
+
+def render_derivatives(source_path, content_hash, output_dir=DERIVED_DIR):
+    """
+    Renders every variant of one source image. Runs in a worker process.
+    Returns a list of (variant, format, width, height, web_path, size).
+    """
+    max_width = max(DERIVATIVE_WIDTHS.values())
+    with Image.open(source_path) as source:
+        # Let the JPEG decoder downscale by a power of two while decoding, as
+        # long as the result stays at least as large as the widest variant.
+        source.draft("RGB", (max_width, max_width))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    rendered = []
+    written = {}
+    # Widest first, so every step resizes the previous, smaller result
+    for variant, width in sorted(DERIVATIVE_WIDTHS.items(), key=lambda item: -item[1]):
+        width = min(width, image.width)
+        if image.width != width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+        for fmt, (ext, options) in DERIVATIVE_FORMATS.items():
+            web_path = f"{output_dir}/{content_hash[:16]}-{width}{ext}"
+            if web_path not in written:
+                tmp_path = web_path + ".tmp"
+                image.save(tmp_path, format=fmt.upper(), **options)
+                os.replace(tmp_path, web_path)
+                written[web_path] = os.path.getsize(web_path)
+            rendered.append((variant, fmt, image.width, image.height, web_path, written[web_path]))
+    return rendered
+
+
+def _format_kb(num_bytes):
+    return f"{num_bytes / 1024:.0f} KB"
+
+
+def _report(source_path, source_size, rendered):
+    """Prints what the listing and detail views now download instead of the original."""
+    sizes = {(variant, fmt): size for variant, fmt, _, _, _, size in rendered}
+    listing = sizes[("listing", "webp")]
+    detail = sizes[("detail", "webp")]
+    saved = source_size - detail
+    print(f"Derivatives for {os.path.basename(source_path)}: original {_format_kb(source_size)}, "
+          f"listing {_format_kb(listing)}, detail {_format_kb(detail)} WebP "
+          f"({_format_kb(saved)} saved, {saved * 100 // max(1, source_size)}%)")
+    return saved
+
+
+def update_derivatives(conn, cursor, source_paths, workers=None, prune=False, output_dir=DERIVED_DIR):
+    """
+    Brings the derivatives of source_paths up to date. With prune, sources not
+    in source_paths are forgotten; only valid after a full sync.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cursor.execute("SELECT source_path, content_hash, mtime_ns, size FROM image_sources")
+    known = {row[0]: row[1:] for row in cursor.fetchall()}
+    cursor.execute("SELECT source_path, web_path FROM image_derivatives")
+    derived = {}
+    for source_path, web_path in cursor.fetchall():
+        derived.setdefault(source_path, []).append(web_path)
+
+    pending = {}  # source_path -> (content_hash, mtime_ns, size)
+    with conn:
+        for source_path in set(source_paths):
+            try:
+                stat = os.stat(source_path)
+            except FileNotFoundError:
+                continue
+            previous = known.get(source_path)
+            files_present = source_path in derived and all(os.path.exists(p) for p in derived[source_path])
+            if previous and previous[1:] == (stat.st_mtime_ns, stat.st_size) and files_present:
+                continue
+
+            content_hash = hash_file(source_path)
+            if previous and previous[0] == content_hash and files_present:
+                # Touched but not changed, e.g. copied over with identical bytes
+                cursor.execute("UPDATE image_sources SET mtime_ns = ?, size = ? WHERE source_path = ?",
+                               (stat.st_mtime_ns, stat.st_size, source_path))
+                continue
+            pending[source_path] = (content_hash, stat.st_mtime_ns, stat.st_size)
+
+    if pending:
+        print(f"Rendering derivatives for {len(pending)} images...")
+        total_source = total_saved = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(render_derivatives, source_path, content_hash, output_dir): source_path
+                for source_path, (content_hash, _, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                source_path = futures[future]
+                content_hash, mtime_ns, size = pending[source_path]
+                try:
+                    rendered = future.result()
+                except Exception as e:
+                    print(f"Error rendering derivatives for {source_path}: {e}")
+                    continue
+                with conn:
+                    cursor.execute("DELETE FROM image_derivatives WHERE source_path = ?", (source_path,))
+                    cursor.executemany("""
+                        INSERT INTO image_derivatives (source_path, variant, format, width, height, web_path, size)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, [(source_path, *row) for row in rendered])
+                    cursor.execute("""
+                        INSERT INTO image_sources (source_path, content_hash, mtime_ns, size) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(source_path) DO UPDATE SET
+                            content_hash=excluded.content_hash, mtime_ns=excluded.mtime_ns, size=excluded.size
+                    """, (source_path, content_hash, mtime_ns, size))
+                total_source += size
+                total_saved += _report(source_path, size, rendered)
+        print(f"Derivatives: {_format_kb(total_saved)} of {_format_kb(total_source)} saved on detail views.")
+
+    with conn:
+        if prune:
+            stale = set(known) - set(source_paths)
+            cursor.executemany("DELETE FROM image_sources WHERE source_path = ?", [(p,) for p in stale])
+            cursor.executemany("DELETE FROM image_derivatives WHERE source_path = ?", [(p,) for p in stale])
+    _remove_unreferenced(cursor, output_dir)
+
+
+def _remove_unreferenced(cursor, output_dir):
+    """Deletes derivative files no row points at any more, e.g. renders of replaced originals."""
+    cursor.execute("SELECT DISTINCT web_path FROM image_derivatives")
+    referenced = {row[0] for row in cursor.fetchall()}
+    removed = 0
+    for filename in os.listdir(output_dir):
+        web_path = f"{output_dir}/{filename}"
+        if web_path not in referenced and os.path.isfile(web_path):
+            os.remove(web_path)
+            removed += 1
+    if removed:
+        print(f"Removed {removed} unreferenced derivative files from {output_dir}")
+
+
+def product_image_paths(cursor):
+    """Returns the web paths of every image referenced by a product."""
+    cursor.execute("SELECT DISTINCT j.value FROM products p, json_each(p.images) j WHERE p.images IS NOT NULL")
+    return [row[0] for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    # Usage: image_derivatives.py [db], e.g. after enhanced images were copied in
+    db_path = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+    # Change CWD to project root to find files correctly
+    # so this script can be run from any directory
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(os.path.join(project_root, '..'))
+    conn = sqlite3.connect(db_path or "data/wif.work.sqlite")
+    cursor = conn.cursor()
+    ensure_derivative_tables(cursor)
+    update_derivatives(conn, cursor, product_image_paths(cursor), prune=True)
+    conn.close()
@@ -0,0 +1,104 @@
+"""
+Concurrent image downloader for the Airtable sync.
+
+Attachments are fetched by a bounded thread pool that shares one pooled
+requests.Session, so a cold sync is limited by bandwidth instead of by one
+serial round-trip per image.
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_WORKERS = 8
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class DownloadJob:
+    url: str
+    local_path: str
+
+
+@dataclass
+class DownloadResult:
+    job: DownloadJob
+    ok: bool
+    num_bytes: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+    content_hash: Optional[str] = None
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """Creates a session whose connection pool can serve every worker at once."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _format_rate(num_bytes: int, seconds: float) -> str:
+    rate = num_bytes / seconds if seconds > 0 else 0.0
+    return f"{num_bytes / 1_000_000:.2f} MB in {seconds:.2f}s ({rate / 1_000_000:.2f} MB/s)"
+
+
+def download_file(session: requests.Session, job: DownloadJob) -> DownloadResult:
+    """
+    Streams one URL to disk, hashing it on the way. The file only appears under
+    its final name once complete.
+    """
+    start = time.perf_counter()
+    part_path = job.local_path + ".part"
+    num_bytes = 0
+    digest = hashlib.sha256()
+    try:
+        with session.get(job.url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    num_bytes += len(chunk)
+        os.replace(part_path, job.local_path)
+        return DownloadResult(job, True, num_bytes, time.perf_counter() - start,
+                              content_hash=digest.hexdigest())
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return DownloadResult(job, False, num_bytes, time.perf_counter() - start, str(e))
+
+
+def download_all(jobs: List[DownloadJob], max_workers: int = DEFAULT_WORKERS) -> List[DownloadResult]:
+    """Downloads all jobs with at most max_workers in flight and reports throughput."""
+    if not jobs:
+        return []
+
+    max_workers = max(1, min(max_workers, len(jobs)))
+    print(f"Downloading {len(jobs)} images with {max_workers} workers...")
+    results = []
+    start = time.perf_counter()
+    with create_session(max_workers) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(download_file, session, job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                name = os.path.basename(result.job.local_path)
+                if result.ok:
+                    print(f"Downloaded: {name} - {_format_rate(result.num_bytes, result.seconds)}")
+                else:
+                    print(f"Error downloading {result.job.url}: {result.error}")
+
+    elapsed = time.perf_counter() - start
+    total_bytes = sum(r.num_bytes for r in results if r.ok)
+    succeeded = sum(1 for r in results if r.ok)
+    print(f"Downloaded {succeeded}/{len(jobs)} images: {_format_rate(total_bytes, elapsed)}")
+    return results
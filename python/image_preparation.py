@@ -0,0 +1,102 @@
+"""
+Decode-once preparation of source photos for the model calls.
+
+Source photos are often 12 MP phone JPEGs, but the enhanced output is only
+1200x1600. Each source is read and decoded once. The JPEG decoder is asked to
+downscale while decoding (draft), and a single pass of Pillow's reducing
+resize follows. The result is two JPEG payloads: a small one for the
+analysis call and one just large enough for generation. Prepared sources are
+kept in a small LRU for the life of the job, so the analysis, generation and
+any regeneration of the same file share one decode.
+"""
+
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+# Long side of the payloads, in pixels
+GENERATION_MAX_SIDE = 1600  # the enhanced output is 1200x1600
+ANALYSIS_MAX_SIDE = 768
+GENERATION_QUALITY = 90
+ANALYSIS_QUALITY = 85
+PREPARED_CACHE_SIZE = 16
+
+
+@dataclass
+class PreparedImage:
+    source_hash: str
+    source_bytes: int
+    source_size: Tuple[int, int]
+    analysis_jpeg: bytes
+    generation_jpeg: bytes
+
+    @property
+    def upload_bytes(self) -> int:
+        return len(self.analysis_jpeg) + len(self.generation_jpeg)
+
+
+def _draft_size(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+    """The smallest decode size that still covers max_side on the long edge."""
+    scale = min(1.0, max_side / max(size))
+    return math.ceil(size[0] * scale), math.ceil(size[1] * scale)
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def prepare_image(image_path: Path) -> PreparedImage:
+    """Reads, hashes and decodes image_path once and encodes both payloads."""
+    data = Path(image_path).read_bytes()
+    with Image.open(BytesIO(data)) as source:
+        source_size = source.size
+        source.draft('RGB', _draft_size(source.size, GENERATION_MAX_SIDE))
+        image = ImageOps.exif_transpose(source)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    image.thumbnail((GENERATION_MAX_SIDE, GENERATION_MAX_SIDE), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    generation_jpeg = _encode_jpeg(image, GENERATION_QUALITY)
+    image.thumbnail((ANALYSIS_MAX_SIDE, ANALYSIS_MAX_SIDE), Image.Resampling.LANCZOS)
+    analysis_jpeg = _encode_jpeg(image, ANALYSIS_QUALITY)
+
+    return PreparedImage(
+        source_hash=hashlib.sha256(data).hexdigest(),
+        source_bytes=len(data),
+        source_size=source_size,
+        analysis_jpeg=analysis_jpeg,
+        generation_jpeg=generation_jpeg,
+    )
+
+
+class PreparedImageCache:
+    """Thread-safe LRU of prepared images, keyed by path, size and mtime."""
+
+    def __init__(self, max_entries: int = PREPARED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, image_path: Path) -> PreparedImage:
+        stat = Path(image_path).stat()
+        key = (str(image_path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        prepared = prepare_image(image_path)
+        with self.lock:
+            self.entries[key] = prepared
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return prepared
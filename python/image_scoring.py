@@ -0,0 +1,212 @@
+"""
+Perceptual difference scores for original/enhanced pairs, so review can start
+with the enhancements that changed the most (the likely broken ones).
+
+Both images are decoded at reduced size (JPEG DCT scaling through draft()) and
+resampled to a small fixed grid, then compared with vectorized NumPy:
+
+    ssim        mean structural similarity of 8x8 blocks of the luma (1: same)
+    histogram   Hellinger distance of the per-channel colour histograms
+                (0: same colours, 1: disjoint)
+    edges       share of strong edges without a counterpart in the other image,
+                within one pixel (0: same shapes, 1: none in common)
+    aspect      absolute log ratio of the aspect ratios of the full images
+
+and folded into one score in 0..1 (see SCORE_WEIGHTS). Enhancement always
+changes the background and light, so scores are for ranking, not thresholds.
+
+Scores are cached in the hash index by the digests of both files, so a pair
+is scored again only when one of its files changes. Many pairs are scored on
+a process pool. Processes sharing the hash index (the comparator's workers)
+take turns computing missing scores, so no pair is scored twice at once.
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from hash_index import HashIndex
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): processes may score the same pairs at the same time
+    fcntl = None
+
+# Bump when a metric changes, so cached scores are recomputed
+SCORER_VERSION = 1
+GRID_SIZE = (96, 128)
+BLOCK = 8
+HISTOGRAM_BINS = 16
+# Fraction of the pixels counted as strong edges in each image
+EDGE_FRACTION = 0.1
+# An aspect change of this much (about 28%) or more counts fully
+ASPECT_CAP = 0.25
+SCORE_WEIGHTS = {"ssim": 0.35, "histogram": 0.25, "edges": 0.3, "aspect": 0.1}
+# Below this many pairs, starting worker processes costs more than it saves
+MIN_POOL_PAIRS = 32
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+logger = logging.getLogger(__name__)
+
+
+def load_grid(path) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """(RGB floats in 0..1 on GRID_SIZE, full size) of an image."""
+    with Image.open(path) as img:
+        size = img.size
+        img.draft("RGB", GRID_SIZE)
+        grid = img.convert("RGB").resize(GRID_SIZE, Image.Resampling.BILINEAR)
+    return np.asarray(grid, dtype=np.float32) / 255.0, size
+
+
+def block_ssim(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean SSIM over non-overlapping BLOCK x BLOCK windows of two luma arrays."""
+    h, w = a.shape
+    shape = (h // BLOCK, BLOCK, w // BLOCK, BLOCK)
+    a = a[:shape[0] * BLOCK, :shape[2] * BLOCK].reshape(shape).swapaxes(1, 2).reshape(-1, BLOCK * BLOCK)
+    b = b[:shape[0] * BLOCK, :shape[2] * BLOCK].reshape(shape).swapaxes(1, 2).reshape(-1, BLOCK * BLOCK)
+    mu_a, mu_b = a.mean(axis=1), b.mean(axis=1)
+    var_a, var_b = a.var(axis=1), b.var(axis=1)
+    cov = ((a - mu_a[:, None]) * (b - mu_b[:, None])).mean(axis=1)
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def histogram_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Hellinger distance of the per-channel histograms, averaged over the channels."""
+    offsets = np.arange(3) * HISTOGRAM_BINS
+
+    def histograms(rgb: np.ndarray) -> np.ndarray:
+        bins = np.minimum((rgb * HISTOGRAM_BINS).astype(np.int64), HISTOGRAM_BINS - 1) + offsets
+        counts = np.bincount(bins.reshape(-1), minlength=3 * HISTOGRAM_BINS).reshape(3, HISTOGRAM_BINS)
+        return counts / counts.sum(axis=1, keepdims=True)
+
+    overlap = np.sqrt(histograms(a) * histograms(b)).sum(axis=1)
+    return float(np.sqrt(np.clip(1 - overlap, 0, 1)).mean())
+
+
+def _edges(luma: np.ndarray) -> np.ndarray:
+    """The strongest EDGE_FRACTION of the gradient magnitudes, as a mask."""
+    gx = np.diff(luma, axis=1)[:-1, :]
+    gy = np.diff(luma, axis=0)[:, :-1]
+    magnitude = np.hypot(gx, gy)
+    threshold = np.quantile(magnitude, 1 - EDGE_FRACTION)
+    return magnitude > max(threshold, 1e-3)
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """3x3 binary dilation."""
+    padded = np.pad(mask, 1)
+    h, w = mask.shape
+    out = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            out |= padded[dy:dy + h, dx:dx + w]
+    return out
+
+
+def edge_drift(a: np.ndarray, b: np.ndarray) -> float:
+    edges_a, edges_b = _edges(a), _edges(b)
+    if not edges_a.any() or not edges_b.any():
+        return 0.0 if edges_a.any() == edges_b.any() else 1.0
+    matched_a = (edges_a & _dilate(edges_b)).sum() / edges_a.sum()
+    matched_b = (edges_b & _dilate(edges_a)).sum() / edges_b.sum()
+    return float(1 - (matched_a + matched_b) / 2)
+
+
+def score_pair(original_path, enhanced_path) -> Dict[str, float]:
+    """The metrics of one pair, and their weighted score."""
+    original, original_size = load_grid(original_path)
+    enhanced, enhanced_size = load_grid(enhanced_path)
+    luma_original, luma_enhanced = original @ LUMA, enhanced @ LUMA
+    metrics = {
+        "ssim": block_ssim(luma_original, luma_enhanced),
+        "histogram": histogram_distance(original, enhanced),
+        "edges": edge_drift(luma_original, luma_enhanced),
+        "aspect": abs(math.log((enhanced_size[0] / enhanced_size[1]) / (original_size[0] / original_size[1]))),
+    }
+    metrics["score"] = (SCORE_WEIGHTS["ssim"] * (1 - max(metrics["ssim"], 0.0)) +
+                        SCORE_WEIGHTS["histogram"] * metrics["histogram"] +
+                        SCORE_WEIGHTS["edges"] * metrics["edges"] +
+                        SCORE_WEIGHTS["aspect"] * min(metrics["aspect"] / ASPECT_CAP, 1.0))
+    return {name: round(value, 4) for name, value in metrics.items()}
+
+
+def _try_score_pair(pair: Tuple[str, str]) -> Tuple[Optional[Dict[str, float]], Optional[str]]:
+    """(scores, None), or (None, the error) if the pair can't be scored."""
+    try:
+        return score_pair(*pair), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def score_pairs(pairs: List[Tuple[str, str]], workers: int) -> List[Optional[Dict[str, float]]]:
+    """Scores of each (original, enhanced) pair; None for pairs that can't be read."""
+    if workers <= 1 or len(pairs) < MIN_POOL_PAIRS:
+        results = [_try_score_pair(pair) for pair in pairs]
+    else:
+        # Spawned, not forked: the server process runs threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(_try_score_pair, pairs, chunksize=max(1, len(pairs) // (workers * 4))))
+    # Logged here: spawned workers don't share the server's logging configuration
+    for pair, (_, error) in zip(pairs, results):
+        if error:
+            logger.warning(f"Could not score {os.path.basename(pair[0])}: {error}")
+    return [scores for scores, _ in results]
+
+
+class ReviewScorer:
+    """Scores of the pairs in two image directories, cached in the hash index."""
+
+    def __init__(self, shop_dir: Path, enhanced_dir: Path, hash_index: HashIndex, workers: Optional[int] = None):
+        self.shop_dir = Path(shop_dir)
+        self.enhanced_dir = Path(enhanced_dir)
+        self.hash_index = hash_index
+        self.workers = workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+
+    def scores(self, filenames: List[str]) -> Dict[str, Dict[str, float]]:
+        """Scores by file name; pairs that can't be read are left out."""
+        paths = {f: (os.path.join(self.shop_dir, f), os.path.join(self.enhanced_dir, f)) for f in filenames}
+        digests = self.hash_index.digests([path for pair in paths.values() for path in pair])
+        keys = {f: (digests[a], digests[b]) for f, (a, b) in paths.items() if a in digests and b in digests}
+
+        cached = self.hash_index.pair_scores(list(keys.values()), SCORER_VERSION)
+        scores = {f: cached[key] for f, key in keys.items() if key in cached}
+        missing = [f for f in keys if f not in scores]
+        if missing:
+            with self._scoring_lock():
+                # Another process may have scored them while this one waited
+                cached = self.hash_index.pair_scores([keys[f] for f in missing], SCORER_VERSION)
+                scores.update({f: cached[keys[f]] for f in missing if keys[f] in cached})
+                missing = [f for f in missing if f not in scores]
+                computed = score_pairs([paths[f] for f in missing], self.workers)
+                fresh = {f: result for f, result in zip(missing, computed) if result is not None}
+                self.hash_index.put_pair_scores({keys[f]: result for f, result in fresh.items()}, SCORER_VERSION)
+            scores.update(fresh)
+        return scores
+
+    @contextmanager
+    def _scoring_lock(self):
+        """Held while computing scores, by one thread of one process at a time."""
+        with self.lock:
+            if not fcntl:
+                yield
+                return
+            with open(self.hash_index.path.with_name(self.hash_index.path.name + ".scoring.lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
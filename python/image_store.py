@@ -0,0 +1,195 @@
+"""
+Content-addressed store for product images synced from Airtable.
+
+A manifest in the sync database maps each Airtable attachment (id, filename,
+size, last URL) to the SHA-256 of its bytes, and every distinct hash to the one
+file under the images directory that holds it. Attachments whose id, filename
+and size are unchanged are resolved from the manifest without any HTTP request;
+changed or new ones are downloaded, hashed and deduplicated against content
+already on disk.
+
+Files on disk are never rehashed, so an image that was replaced locally (for
+example by copying an enhanced version over it) keeps being served.
+"""
+
+import os
+from urllib.parse import urlparse
+
+from file_utils import hash_file
+from image_downloader import DEFAULT_WORKERS, DownloadJob, download_all
+
+IMAGE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_manifest (
+    attachment_id TEXT PRIMARY KEY,
+    filename TEXT,
+    size INTEGER,
+    url TEXT,
+    content_hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS image_blobs (
+    content_hash TEXT PRIMARY KEY,
+    web_path TEXT NOT NULL UNIQUE
+);
+"""
+
+# Downloads land here first and are moved into place once their hash is known
+INCOMING_DIRNAME = ".incoming"
+
+
+def ensure_image_tables(cursor):
+    """Creates the image manifest tables if they don't exist."""
+    cursor.executescript(IMAGE_STORE_SCHEMA)
+
+
+def _attachment_filename(attachment):
+    # Use provided filename or fall back to URL-based name
+    return attachment.get('filename') or os.path.basename(urlparse(attachment['url']).path)
+
+
+def _web_path(images_dir, filename):
+    # The web path should always use forward slashes.
+    return os.path.join(images_dir, filename).replace(os.path.sep, '/')
+
+
+class ImageStore:
+    """Resolves Airtable attachments to web paths of locally stored images."""
+
+    def __init__(self, cursor, images_dir):
+        self.cursor = cursor
+        self.images_dir = images_dir
+        self.incoming_dir = os.path.join(images_dir, INCOMING_DIRNAME)
+
+        cursor.execute("SELECT attachment_id, filename, size, content_hash FROM image_manifest")
+        self.manifest = {row[0]: row[1:] for row in cursor.fetchall()}
+        cursor.execute("SELECT content_hash, web_path FROM image_blobs")
+        self.blobs = dict(cursor.fetchall())
+        self.blob_paths = set(self.blobs.values())
+
+    def _lookup(self, attachment, filename):
+        """Returns the web path of an unchanged attachment, or None if it must be fetched."""
+        known = self.manifest.get(attachment['id'])
+        if known:
+            known_filename, known_size, content_hash = known
+            web_path = self.blobs.get(content_hash)
+            if (known_filename == filename and known_size == attachment.get('size')
+                    and web_path and os.path.exists(web_path)):
+                return web_path
+            return None
+
+        # Files from before the manifest existed are adopted as they are,
+        # matching the old "exists by filename" behaviour, without a download.
+        web_path = _web_path(self.images_dir, filename)
+        if web_path not in self.blob_paths and os.path.exists(web_path):
+            content_hash = hash_file(web_path)
+            if content_hash not in self.blobs:
+                self._register_blob(content_hash, web_path)
+            self._record(attachment, filename, content_hash)
+            return self.blobs[content_hash]
+        return None
+
+    def _register_blob(self, content_hash, web_path):
+        self.cursor.execute("INSERT OR REPLACE INTO image_blobs (content_hash, web_path) VALUES (?, ?)",
+                            (content_hash, web_path))
+        self.blobs[content_hash] = web_path
+        self.blob_paths.add(web_path)
+
+    def _record(self, attachment, filename, content_hash):
+        self.cursor.execute("""
+            INSERT INTO image_manifest (attachment_id, filename, size, url, content_hash) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(attachment_id) DO UPDATE SET
+                filename=excluded.filename, size=excluded.size, url=excluded.url, content_hash=excluded.content_hash
+        """, (attachment['id'], filename, attachment.get('size'), attachment.get('url'), content_hash))
+        self.manifest[attachment['id']] = (filename, attachment.get('size'), content_hash)
+
+    def _place(self, incoming_path, filename, content_hash):
+        """Moves a downloaded file into the store, or drops it if the bytes are already stored."""
+        existing = self.blobs.get(content_hash)
+        if existing and os.path.exists(existing):
+            os.remove(incoming_path)
+            return existing
+
+        web_path = _web_path(self.images_dir, filename)
+        if os.path.exists(web_path) or web_path in self.blob_paths:
+            # The name holds other content (e.g. an attachment replaced under
+            # the same name), so the new bytes get a name of their own.
+            stem, ext = os.path.splitext(filename)
+            web_path = _web_path(self.images_dir, f"{stem}-{content_hash[:12]}{ext}")
+        os.replace(incoming_path, web_path)
+        self._register_blob(content_hash, web_path)
+        return web_path
+
+    def resolve(self, inventory_items, download_workers=DEFAULT_WORKERS):
+        """
+        Makes sure every image of the given records is stored locally.
+        Returns a dict of airtable_id -> list of web paths of the current content,
+        and the set of airtable_ids with an image that could not be stored.
+        """
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        resolved = {}  # attachment_id -> web_path
+        pending = {}  # attachment_id -> (attachment, filename, DownloadJob)
+
+        for item in inventory_items:
+            for attachment in item.get('fields', {}).get('Images', []):
+                if 'url' not in attachment or attachment.get('id') in resolved or attachment.get('id') in pending:
+                    continue
+                filename = _attachment_filename(attachment)
+                web_path = self._lookup(attachment, filename)
+                if web_path:
+                    resolved[attachment['id']] = web_path
+                else:
+                    incoming_path = os.path.join(self.incoming_dir, attachment['id'])
+                    pending[attachment['id']] = (attachment, filename, DownloadJob(attachment['url'], incoming_path))
+
+        if resolved or pending:
+            print(f"{len(resolved)} images unchanged, {len(pending)} to download.")
+        results = download_all([job for _, _, job in pending.values()], download_workers)
+        results_by_path = {r.job.local_path: r for r in results}
+
+        failed = set()
+        for attachment_id, (attachment, filename, job) in pending.items():
+            result = results_by_path.get(job.local_path)
+            if not result or not result.ok:
+                failed.add(attachment_id)
+                continue
+            resolved[attachment_id] = self._place(job.local_path, filename, result.content_hash)
+            self._record(attachment, filename, result.content_hash)
+
+        product_images = {
+            item['id']: [
+                resolved[attachment['id']]
+                for attachment in item.get('fields', {}).get('Images', [])
+                if attachment.get('id') in resolved
+            ]
+            for item in inventory_items
+        }
+        incomplete = {
+            item['id'] for item in inventory_items
+            if any(attachment.get('id') in failed for attachment in item.get('fields', {}).get('Images', []))
+        }
+        return product_images, incomplete
+
+    def prune(self, live_attachment_ids):
+        """
+        Forgets attachments that are gone from Airtable and deletes stored files
+        that no product references any more. Only valid after a full sync.
+        """
+        stale = set(self.manifest) - set(live_attachment_ids)
+        self.cursor.executemany("DELETE FROM image_manifest WHERE attachment_id = ?",
+                                [(attachment_id,) for attachment_id in stale])
+        for attachment_id in stale:
+            del self.manifest[attachment_id]
+
+        referenced_hashes = {content_hash for _, _, content_hash in self.manifest.values()}
+        removed = 0
+        for content_hash, web_path in list(self.blobs.items()):
+            if content_hash in referenced_hashes:
+                continue
+            if os.path.exists(web_path):
+                os.remove(web_path)
+                removed += 1
+            self.cursor.execute("DELETE FROM image_blobs WHERE content_hash = ?", (content_hash,))
+            del self.blobs[content_hash]
+            self.blob_paths.discard(web_path)
+        if stale or removed:
+            print(f"Pruned {len(stale)} attachments and {removed} image files no longer in Airtable")
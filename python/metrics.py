@@ -0,0 +1,211 @@
+"""
+In-process counters, gauges and histograms for the enhancement pipeline,
+rendered in the Prometheus text exposition format (comparator_server serves
+them at /metrics).
+
+Everything that runs in the comparator process (the regeneration pool, the
+enhancer, the model backend and the limiter) records into the module-level
+metrics below, so one scrape shows where the time goes. Label values are
+passed as keyword arguments:
+
+    MODEL_CALLS.inc(model="gemini-2.5-flash", outcome="ok")
+    STAGE_SECONDS.observe(0.42, stage="generate")
+
+A registry's values can be exported with state() and summed with those of
+other processes with merged(); gauges are summed too, which suits the ones
+below (calls in flight and concurrency caps add up across processes). The
+comparator's worker processes exchange theirs through the shared state
+database (see shared_state.py), so a scrape of any worker covers all of them.
+"""
+
+import copy
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Seconds; model calls take up to about a minute, local stages a few ms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_number(value)}"
+                    for key, value in sorted(self.values.items())]
+
+    def state(self) -> List:
+        """The values as JSON-serializable [label values, value] pairs."""
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def merge(self, state: List):
+        """Adds values exported by state(), e.g. by another process."""
+        with self.lock:
+            for key, value in state:
+                key = tuple(key)
+                self.values[key] = self.values.get(key, 0) + value
+
+    def empty_copy(self) -> "Metric":
+        metric = copy.copy(self)
+        metric.lock = threading.Lock()
+        metric.values = {}
+        return metric
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> (bucket counts, sum, count)
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            counts, total, count = self.series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.series[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                pairs = list(zip(self.labelnames, key))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_number(bound))])} "
+                                 f"{bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_number(total)}")
+                lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+    def state(self) -> List:
+        with self.lock:
+            return [[list(key), counts, total, count] for key, (counts, total, count) in self.series.items()]
+
+    def merge(self, state: List):
+        with self.lock:
+            for key, counts, total, count in state:
+                key = tuple(key)
+                if len(counts) != len(self.buckets):
+                    # Exported with other buckets, by a version of this code that has since changed
+                    continue
+                previous_counts, previous_total, previous_count = self.series.get(
+                    key, ([0] * len(self.buckets), 0.0, 0))
+                self.series[key] = ([a + b for a, b in zip(previous_counts, counts)],
+                                    previous_total + total, previous_count + count)
+
+    def empty_copy(self) -> "Histogram":
+        metric = super().empty_copy()
+        metric.series = {}
+        return metric
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+    def state(self) -> Dict[str, List]:
+        """The values of every metric by name, as JSON-serializable lists."""
+        return {metric.name: metric.state() for metric in self.metrics}
+
+    def merged(self, states: Iterable[Dict[str, List]], kinds: Optional[Tuple[str, ...]] = None) -> "Registry":
+        """
+        A registry of the same metrics holding the sum of the given states.
+        With kinds, metrics of other kinds are left empty. Metrics a state has
+        but this registry doesn't are ignored.
+        """
+        registry = Registry()
+        for metric in self.metrics:
+            registry.register(metric.empty_copy())
+        by_name = {metric.name: metric for metric in registry.metrics}
+        for state in states:
+            for name, values in state.items():
+                metric = by_name.get(name)
+                if metric and (kinds is None or metric.kind in kinds):
+                    metric.merge(values)
+        return registry
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "enhance_stage_seconds", "Wall time of each enhancement stage.", ("stage",)))
+STAGE_FAILURES = REGISTRY.register(Counter(
+    "enhance_stage_failures_total", "Stages that raised, by exception type.", ("stage", "error")))
+MODEL_CALLS = REGISTRY.register(Counter(
+    "enhance_model_calls_total", "Model calls by model and outcome (ok or exception type).", ("model", "outcome")))
+MODEL_CALL_SECONDS = REGISTRY.register(Histogram(
+    "enhance_model_call_seconds", "Model call latency, including limiter waits and retries.", ("model",)))
+MODEL_BYTES = REGISTRY.register(Counter(
+    "enhance_model_bytes_total", "Payload bytes sent to (out) and received from (in) the model.", ("direction",)))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "enhance_rate_limited_total", "Model calls answered with a rate limit."))
+CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "enhance_model_concurrency_limit", "Current cap on concurrent model calls."))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "enhance_model_calls_in_flight", "Model calls running now."))
+IMAGES = REGISTRY.register(Counter(
+    "enhance_images_total", "Enhanced images by outcome.", ("outcome",)))
+REGENERATION_JOBS = REGISTRY.register(Counter(
+    "comparator_regeneration_jobs_total", "Finished regeneration jobs by status.", ("status",)))
@@ -0,0 +1,179 @@
+"""
+Model backends for the image enhancer.
+
+Gemini25ClothingEnhancer talks to the model only through a backend with two
+calls: analyze (image + prompt -> text) and generate_image (image + prompt ->
+image bytes). GeminiBackend calls the real API. FakeBackend answers locally,
+with deterministic text and images, configurable latency and injectable
+failures and rate limits, so the pipeline can be exercised and benchmarked
+without spending quota.
+
+The backend is picked with ENHANCE_BACKEND=gemini|fake. The fake is
+configured through FAKE_MODEL_LATENCY (seconds per call), FAKE_MODEL_ERROR_RATE,
+FAKE_MODEL_RATE_LIMIT_RATE and FAKE_MODEL_SEED.
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+from metrics import MODEL_BYTES
+
+FAKE_OUTPUT_SIZE = (896, 1200)  # roughly what the image model returns for a 3:4 request
+FAKE_DESCRIPTIONS = [
+    "A red silk saree with a woven gold zari border and paisley motifs.",
+    "A green cotton kurta with white chikankari embroidery on the yoke.",
+    "A blue lehenga skirt with mirror work and a contrasting pink dupatta.",
+    "A gold-plated kundan necklace with matching jhumka earrings.",
+]
+
+
+class EnhancementError(Exception):
+    """The model answered, but not with a usable image."""
+
+
+class RateLimitError(Exception):
+    """Raised by the fake backend the way the API reports 429 RESOURCE_EXHAUSTED."""
+    code = 429
+
+
+class ModelBackend(ABC):
+    """Base class; counts calls and payload bytes in both directions."""
+
+    name = "base"
+
+    def __init__(self):
+        self.stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "bytes_up": 0, "bytes_down": 0}
+
+    def _count(self, bytes_up: int, bytes_down: int):
+        with self.stats_lock:
+            self.stats["calls"] += 1
+            self.stats["bytes_up"] += bytes_up
+            self.stats["bytes_down"] += bytes_down
+        MODEL_BYTES.inc(bytes_up, direction="out")
+        MODEL_BYTES.inc(bytes_down, direction="in")
+
+    @abstractmethod
+    def analyze(self, model: str, image_jpeg: bytes, prompt: str) -> str:
+        """The model's text answer about the image."""
+
+    @abstractmethod
+    def generate_image(self, model: str, image_jpeg: bytes, prompt: str) -> bytes:
+        """The image the model generates from the image and prompt."""
+
+
+class GeminiBackend(ModelBackend):
+    """The Gemini API through google-genai."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None):
+        super().__init__()
+        from google import genai
+        from google.genai import types
+
+        if api_key:
+            os.environ['GEMINI_API_KEY'] = api_key
+        self.client = genai.Client()
+        self.types = types
+
+    def _call(self, model: str, image_jpeg: bytes, prompt: str):
+        image = self.types.Part.from_bytes(data=image_jpeg, mime_type='image/jpeg')
+        return self.client.models.generate_content(model=model, contents=[image, prompt])
+
+    def analyze(self, model: str, image_jpeg: bytes, prompt: str) -> str:
+        response = self._call(model, image_jpeg, prompt)
+        text = ""
+        if response.candidates and response.candidates[0].content.parts:
+            text = (response.candidates[0].content.parts[0].text or "").strip()
+        self._count(len(image_jpeg) + len(prompt), len(text))
+        return text
+
+    def generate_image(self, model: str, image_jpeg: bytes, prompt: str) -> bytes:
+        response = self._call(model, image_jpeg, prompt)
+        if not (response.candidates and response.candidates[0].content.parts):
+            self._count(len(image_jpeg) + len(prompt), 0)
+            raise EnhancementError("Empty response from the model")
+        parts = response.candidates[0].content.parts
+        image_parts = [p for p in parts if p.inline_data]
+        if not image_parts:
+            self._count(len(image_jpeg) + len(prompt), 0)
+            text_response = " ".join([p.text for p in parts if getattr(p, 'text', None)])
+            raise EnhancementError(f"No image data. Response: {text_response}")
+        image_data = image_parts[0].inline_data.data
+        self._count(len(image_jpeg) + len(prompt), len(image_data))
+        return image_data
+
+
+class FakeBackend(ModelBackend):
+    """
+    Local stand-in for the model. Answers depend only on the inputs, so runs
+    are repeatable; latency, errors and rate limits are simulated.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.5, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 seed: int = 0):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def _simulate(self, image_jpeg: bytes, prompt: str) -> bytes:
+        with self.random_lock:
+            roll = self.random.random()
+        time.sleep(self.latency)
+        if roll < self.rate_limit_rate:
+            self._count(len(image_jpeg) + len(prompt), 0)
+            raise RateLimitError("429 RESOURCE_EXHAUSTED (fake backend)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            self._count(len(image_jpeg) + len(prompt), 0)
+            raise EnhancementError("No image data. Response: (fake backend refusal)")
+        return hashlib.sha256(image_jpeg + prompt.encode('utf-8')).digest()
+
+    def analyze(self, model: str, image_jpeg: bytes, prompt: str) -> str:
+        digest = self._simulate(image_jpeg, prompt)
+        text = FAKE_DESCRIPTIONS[digest[0] % len(FAKE_DESCRIPTIONS)]
+        self._count(len(image_jpeg) + len(prompt), len(text))
+        return text
+
+    def generate_image(self, model: str, image_jpeg: bytes, prompt: str) -> bytes:
+        digest = self._simulate(image_jpeg, prompt)
+        with Image.open(BytesIO(image_jpeg)) as source:
+            source.draft('RGB', (FAKE_OUTPUT_SIZE[0] // 2, FAKE_OUTPUT_SIZE[1] // 2))
+            image = source.convert('RGB')
+        # Stand-in "studio shot": the input pasted on a background tinted by the digest
+        canvas = Image.new('RGB', FAKE_OUTPUT_SIZE, (200 + digest[0] % 56, 200 + digest[1] % 56, 200 + digest[2] % 56))
+        image.thumbnail((FAKE_OUTPUT_SIZE[0] - 96, FAKE_OUTPUT_SIZE[1] - 96))
+        canvas.paste(image, ((FAKE_OUTPUT_SIZE[0] - image.width) // 2, (FAKE_OUTPUT_SIZE[1] - image.height) // 2))
+        buffer = BytesIO()
+        canvas.save(buffer, format='PNG', compress_level=1)
+        image_data = buffer.getvalue()
+        self._count(len(image_jpeg) + len(prompt), len(image_data))
+        return image_data
+
+
+def create_backend(name: Optional[str] = None, api_key: Optional[str] = None) -> ModelBackend:
+    """Builds the backend named by name or ENHANCE_BACKEND (default: gemini)."""
+    name = name or os.getenv("ENHANCE_BACKEND", "gemini")
+    if name == "fake":
+        return FakeBackend(
+            latency=float(os.getenv("FAKE_MODEL_LATENCY", "0.5")),
+            error_rate=float(os.getenv("FAKE_MODEL_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("FAKE_MODEL_RATE_LIMIT_RATE", "0")),
+            seed=int(os.getenv("FAKE_MODEL_SEED", "0")),
+        )
+    if name == "gemini":
+        return GeminiBackend(api_key)
+    raise ValueError(f"Unknown model backend: {name}")
@@ -0,0 +1,131 @@
+"""
+Resized previews of the comparator's images.
+
+The review UI shows images at 450x600 CSS pixels, but the originals are
+several MB each. Previews are rendered on demand (JPEG draft decoding, then one
+resize) and cached by the content digest of the source and the width:
+
+  - in memory, as an LRU of up to PREVIEW_MEMORY_BYTES;
+  - on disk in PREVIEW_DIR, so they survive restarts, pruned to the
+    PREVIEW_DISK_BYTES most recently used.
+
+A changed file has a new digest, so its previews are rendered anew and the
+old ones age out. The digest also makes a strong ETag (see comparator_server).
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from enhancement_logic import write_atomic
+from hash_index import HashIndex
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+# Next to the image directories, not in them, so previews never show up as images
+PREVIEW_DIR = PROJECT_ROOT / "assets/images/.previews"
+# Full pane at 2x, and thumbnails
+PREVIEW_WIDTHS = (900, 300)
+PREVIEW_QUALITY = 82
+PREVIEW_MEMORY_BYTES = 64 * 1024 * 1024
+PREVIEW_DISK_BYTES = 1024 * 1024 * 1024
+# Disk usage is checked after this many new previews
+PRUNE_EVERY = 200
+
+
+def render_preview(path, width: int) -> bytes:
+    """A progressive JPEG of the image at width (never upscaled)."""
+    with Image.open(path) as source:
+        # Let the JPEG decoder downscale by a power of two, staying at least as large as the preview
+        source.draft("RGB", (width, width))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=PREVIEW_QUALITY, progressive=True)
+    return buffer.getvalue()
+
+
+class PreviewCache:
+    """Thread-safe two-level cache of previews, keyed by source digest and width."""
+
+    def __init__(self, hash_index: HashIndex, directory: Path = PREVIEW_DIR,
+                 memory_bytes: int = PREVIEW_MEMORY_BYTES, disk_bytes: int = PREVIEW_DISK_BYTES):
+        self.hash_index = hash_index
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_used = 0
+        self.rendered_since_prune = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "rendered": 0}
+
+    def digest(self, path) -> Optional[str]:
+        """Content digest of path, None if it can't be read."""
+        return self.hash_index.digests([path]).get(os.fspath(path))
+
+    def get(self, path, digest: str, width: int) -> bytes:
+        """The preview of path (whose digest is given) at width."""
+        key = f"{digest[:32]}-{width}"
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return data
+
+        disk_path = self.directory / f"{key}.jpg"
+        try:
+            data = disk_path.read_bytes()
+            # Recently used previews survive pruning
+            os.utime(disk_path)
+            source = "disk_hits"
+        except FileNotFoundError:
+            data = render_preview(path, width)
+            write_atomic(disk_path, data)
+            source = "rendered"
+
+        with self.lock:
+            self.stats[source] += 1
+            if key not in self.memory:
+                self.memory[key] = data
+                self.memory_used += len(data)
+            while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_used -= len(evicted)
+            if source == "rendered":
+                self.rendered_since_prune += 1
+                prune = self.rendered_since_prune >= PRUNE_EVERY
+                if prune:
+                    self.rendered_since_prune = 0
+            else:
+                prune = False
+        if prune:
+            self.prune()
+        return data
+
+    def prune(self):
+        """Deletes the least recently used previews on disk beyond disk_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".jpg"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,318 @@
+"""
+Publish step for the catalog database served to the SPA.
+
+The sync writes to a private working database. Publishing copies its catalog
+tables, without the sync bookkeeping, into a fresh temp file, adds the
+secondary indexes the storefront's queries need and materializes
+product_catalog: one row per product with its attributes pre-joined as a
+JSON object ({"key_name": ["value", ...]}), so the list and detail views each
+read a single table with an indexed lookup instead of joining three tables in
+sql.js. It also carries the srcset strings of every product image's responsive
+derivatives (see image_derivatives.py).
+
+The snapshot depends only on the published content, so a sync that changes
+nothing in the catalog publishes nothing new. It is VACUUMed, hashed and
+atomically renamed to a content-addressed file (wif.db.<hash>.sqlite) next to
+a small manifest JSON, so clients can poll the manifest and only download a
+database whose hash they haven't seen. wif.db.sqlite is replaced atomically
+as well, for anything that still loads the fixed name.
+
+For each snapshot still kept, a page-level delta to the new one is written
+(see db_delta.py) and listed in the manifest by base hash, so a client that
+already has a recent snapshot downloads only the pages that changed. Every
+delta is applied to its base and checked against the new file before it is
+published.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+from db_delta import DeltaError, apply_delta, make_delta
+from file_utils import hash_file
+from image_derivatives import ensure_derivative_tables
+
+WORK_DB_PATH = "data/wif.work.sqlite"
+PUBLISH_DIR = "data"
+DB_FILENAME = "wif.db.sqlite"
+MANIFEST_FILENAME = "wif.db.manifest.json"
+
+# The whole file is downloaded by the browser, so small pages keep the slack
+# at the end of every table and index page down.
+PUBLISH_PAGE_SIZE = 1024
+
+# Superseded snapshots are kept for a while so clients that just read the
+# previous manifest can still download the file it names.
+KEEP_SNAPSHOTS = 3
+
+# A delta bigger than this fraction of the full file isn't worth offering
+MAX_DELTA_RATIO = 0.5
+
+# Sync bookkeeping that lives in the working database but is not served
+INTERNAL_TABLES = (
+    "sync_state", "sync_records", "image_manifest", "image_blobs", "image_sources", "image_derivatives",
+)
+
+# attributes(key_id) needs no index of its own: UNIQUE(key_id, value) already
+# creates one with key_id as its leading column.
+CATALOG_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_products_display_order ON products(display_order);
+CREATE INDEX IF NOT EXISTS idx_product_attributes_attribute_id ON product_attributes(attribute_id);
+"""
+
+CATALOG_SCHEMA = """
+DROP TABLE IF EXISTS product_catalog;
+
+CREATE TABLE product_catalog (
+    id INTEGER PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    description TEXT,
+    price NUMERIC NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    currency VARCHAR(3) NOT NULL DEFAULT 'GBP',
+    images TEXT,
+    main_image_url VARCHAR(255),
+    display_order INTEGER,
+    -- JSON object of key_name -> array of values, e.g. '{"category": ["Saree"]}'
+    attributes TEXT NOT NULL DEFAULT '{}',
+    -- JSON object of image path -> format -> srcset,
+    -- e.g. '{"assets/images/shop/a.jpg": {"webp": "assets/images/shop_derived/<hash>-160.webp 160w, ..."}}'
+    image_srcsets TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX idx_product_catalog_display_order ON product_catalog(display_order);
+"""
+
+# Small sources share one file between variants, hence the DISTINCT
+IMAGE_SRCSETS = """
+CREATE TEMP TABLE image_srcsets AS
+SELECT source_path, format, group_concat(web_path || ' ' || width || 'w', ', ') AS srcset
+FROM (
+    SELECT DISTINCT source_path, format, web_path, width FROM image_derivatives
+    ORDER BY source_path, format, width
+)
+GROUP BY source_path, format
+"""
+
+POPULATE_CATALOG = """
+INSERT INTO product_catalog (id, title, description, price, quantity, currency, images, main_image_url, display_order, attributes, image_srcsets)
+SELECT
+    p.id, p.title, p.description, p.price, p.quantity, p.currency, p.images, p.main_image_url, p.display_order,
+    COALESCE((
+        SELECT json_group_object(key_name, json(vals)) FROM (
+            SELECT key_name, json_group_array(value) AS vals FROM (
+                SELECT ak.key_name, a.value
+                FROM product_attributes pa
+                JOIN attributes a ON a.id = pa.attribute_id
+                JOIN attribute_keys ak ON ak.id = a.key_id
+                WHERE pa.product_id = p.id
+                ORDER BY ak.key_name, a.value
+            )
+            GROUP BY key_name
+        )
+    ), '{}'),
+    COALESCE((
+        SELECT json_group_object(source_path, json(srcsets)) FROM (
+            SELECT s.source_path, json_group_object(s.format, s.srcset) AS srcsets
+            FROM image_srcsets s
+            WHERE s.source_path IN (SELECT value FROM json_each(p.images))
+            GROUP BY s.source_path
+        )
+    ), '{}')
+FROM products p
+"""
+
+
+def publish_catalog(conn):
+    """Creates the read indexes, rebuilds product_catalog and refreshes planner statistics."""
+    cursor = conn.cursor()
+    ensure_derivative_tables(cursor)
+    cursor.executescript(CATALOG_INDEXES + CATALOG_SCHEMA)
+    with conn:
+        cursor.execute(IMAGE_SRCSETS)
+        cursor.execute(POPULATE_CATALOG)
+        cursor.execute("DROP TABLE temp.image_srcsets")
+    cursor.execute("ANALYZE")
+    cursor.execute("PRAGMA optimize")
+    cursor.execute("SELECT COUNT(*) FROM product_catalog")
+    print(f"Published catalog with {cursor.fetchone()[0]} products.")
+
+
+def snapshot_filename(content_hash):
+    return f"wif.db.{content_hash[:16]}.sqlite"
+
+
+def read_manifest(publish_dir):
+    try:
+        with open(os.path.join(publish_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(source_path, snapshot_path):
+    """
+    Builds the served catalog from the working database into a new file at
+    snapshot_path. The published tables are copied in a fixed order into a
+    fresh database, so the file (and its hash) depends only on their content,
+    not on the working database's history: sync bookkeeping written on every
+    run, freed pages and header counters.
+    """
+    snapshot = sqlite3.connect(snapshot_path)
+    cursor = snapshot.cursor()
+    # page_size takes effect when the first table is created
+    cursor.execute(f"PRAGMA page_size={PUBLISH_PAGE_SIZE}")
+    cursor.execute("ATTACH DATABASE ? AS work", (source_path,))
+    skipped = INTERNAL_TABLES + ("product_catalog",)
+    placeholders = ", ".join("?" * len(skipped))
+    cursor.execute(f"""
+        SELECT type, name, sql FROM work.sqlite_master
+        WHERE type IN ('table', 'index') AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            AND tbl_name NOT IN ({placeholders})
+        ORDER BY type = 'index', name
+    """, skipped)
+    with snapshot:
+        for object_type, name, sql in cursor.fetchall():
+            cursor.execute(sql)
+            if object_type == "table":
+                cursor.execute(f"INSERT INTO main.{name} SELECT * FROM work.{name} ORDER BY rowid")
+
+    # The catalog reads the derivative tables, so they are copied and dropped afterwards
+    ensure_derivative_tables(cursor)
+    cursor.execute("SELECT name FROM work.sqlite_master "
+                   "WHERE type = 'table' AND name IN ('image_sources', 'image_derivatives')")
+    with snapshot:
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"INSERT INTO main.{table} SELECT * FROM work.{table} ORDER BY rowid")
+    cursor.execute("DETACH DATABASE work")
+
+    publish_catalog(snapshot)
+    for table in INTERNAL_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute("VACUUM")
+    snapshot.close()
+
+
+def delta_filename(base_hash, content_hash):
+    return f"wif.db.{base_hash[:16]}-{content_hash[:16]}.delta"
+
+
+def prune_snapshots(publish_dir, current_file):
+    """
+    Deletes all but the newest KEEP_SNAPSHOTS content-addressed snapshots.
+    Returns the file names of the older snapshots that were kept.
+    """
+    snapshots = sorted(
+        (f for f in os.listdir(publish_dir)
+         if f.startswith("wif.db.") and f.endswith(".sqlite") and f not in (DB_FILENAME, current_file)),
+        key=lambda f: os.path.getmtime(os.path.join(publish_dir, f)),
+        reverse=True,
+    )
+    for stale in snapshots[KEEP_SNAPSHOTS - 1:]:
+        os.remove(os.path.join(publish_dir, stale))
+    return snapshots[:KEEP_SNAPSHOTS - 1]
+
+
+def build_deltas(publish_dir, base_files, snapshot_path, content_hash):
+    """
+    Writes a verified delta from every base snapshot to the new one and returns
+    the manifest entries, keyed by the full hash of each base.
+    """
+    with open(snapshot_path, 'rb') as f:
+        new = f.read()
+
+    deltas = {}
+    for base_file in base_files:
+        with open(os.path.join(publish_dir, base_file), 'rb') as f:
+            base = f.read()
+        delta = make_delta(base, new, PUBLISH_PAGE_SIZE)
+        if apply_delta(base, delta) != new:
+            raise DeltaError(f"Delta from {base_file} does not reproduce the new snapshot")
+        if len(delta) > len(new) * MAX_DELTA_RATIO:
+            print(f"Skipping delta from {base_file}: {len(delta)} bytes is not worth it.")
+            continue
+
+        base_hash = hashlib.sha256(base).hexdigest()
+        filename = delta_filename(base_hash, content_hash)
+        tmp_path = os.path.join(publish_dir, filename + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(delta)
+        os.replace(tmp_path, os.path.join(publish_dir, filename))
+        deltas[base_hash] = {"file": filename, "size": len(delta)}
+        print(f"Delta from {base_file}: {len(delta)} bytes ({len(delta) * 100 // len(new)}% of the full file).")
+    return deltas
+
+
+def prune_deltas(publish_dir, live_files):
+    """Deletes delta files the current manifest no longer lists."""
+    for f in os.listdir(publish_dir):
+        if f.startswith("wif.db.") and f.endswith(".delta") and f not in live_files:
+            os.remove(os.path.join(publish_dir, f))
+
+
+def publish_database(source_path=WORK_DB_PATH, publish_dir=PUBLISH_DIR):
+    """
+    Builds a snapshot of source_path and publishes it under its content hash.
+    Returns the manifest describing the published database.
+    """
+    tmp_path = os.path.join(publish_dir, f".{DB_FILENAME}.{os.getpid()}.tmp")
+    try:
+        build_snapshot(source_path, tmp_path)
+        content_hash = hash_file(tmp_path)
+        size = os.path.getsize(tmp_path)
+
+        previous = read_manifest(publish_dir)
+        if previous and previous.get("hash") == content_hash \
+                and os.path.exists(os.path.join(publish_dir, previous["file"])):
+            print(f"Published database unchanged ({content_hash[:16]}).")
+            return previous
+
+        # Readers only ever see a complete file under either name
+        filename = snapshot_filename(content_hash)
+        fixed_tmp_path = tmp_path + ".copy"
+        shutil.copyfile(tmp_path, fixed_tmp_path)
+        os.replace(tmp_path, os.path.join(publish_dir, filename))
+        os.replace(fixed_tmp_path, os.path.join(publish_dir, DB_FILENAME))
+
+        base_files = prune_snapshots(publish_dir, filename)
+        deltas = build_deltas(publish_dir, base_files, os.path.join(publish_dir, filename), content_hash)
+
+        manifest = {
+            "hash": content_hash,
+            "size": size,
+            "file": filename,
+            "page_size": PUBLISH_PAGE_SIZE,
+            "built_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "deltas": deltas,
+        }
+        # The manifest goes last, so it never names a file that isn't there yet
+        write_json_atomic(os.path.join(publish_dir, MANIFEST_FILENAME), manifest)
+        prune_deltas(publish_dir, {delta["file"] for delta in deltas.values()})
+        print(f"Published {filename} ({size} bytes).")
+        return manifest
+    finally:
+        for leftover in (tmp_path, tmp_path + ".copy"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+if __name__ == "__main__":
+    # Usage: publish.py [source_db] [publish_dir], paths relative to the caller
+    paths = [os.path.abspath(path) for path in sys.argv[1:3]]
+    # Change CWD to project root to find files correctly
+    # so this script can be run from any directory
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(os.path.join(project_root, '..'))
+    publish_database(*paths)
@@ -8,24 +8,32 @@ enhancement logic to regenerate it.
 
 import os
 import sys
+import json
 import argparse
 from pathlib import Path
 
 # Import the core logic
 from enhancement_logic import Gemini25ClothingEnhancer, SOURCE_DIR, LOG_FILE
+from enhancement_cache import EnhancementCache
 
 def main():
     """Main execution function for single image regeneration."""
     parser = argparse.ArgumentParser(description="Regenerate a single enhanced image.")
     parser.add_argument("filename", type=str, help="The filename of the image to process from the source directory.")
     parser.add_argument("--prompt", type=str, default="", help="Additional prompt instructions.")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Reuse a cached image of this exact request instead of generating a new one "
+                             "(the analysis is always reused).")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the enhancement cache.")
+    parser.add_argument("--stats-json", type=Path, metavar="PATH",
+                        help="Write stage timings and model traffic of this run to PATH.")
     args = parser.parse_args()
 
     print(f"Gemini 2.5 Flash Single Image Regeneration Tool")
     print("=" * 50)
 
     api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
+    if not api_key and os.getenv("ENHANCE_BACKEND", "gemini") == "gemini":
         print("❌ Missing GEMINI_API_KEY environment variable!")
         return 1
 
@@ -35,10 +43,17 @@ def main():
         return 1
 
     try:
-        enhancer = Gemini25ClothingEnhancer(api_key)
+        cache = None if args.no_cache else EnhancementCache()
+        enhancer = Gemini25ClothingEnhancer(api_key, cache=cache)
         print(f"🚀 Regenerating: {args.filename}")
-        success = enhancer.process_image(image_path, additional_prompt=args.prompt)
-        
+        success = enhancer.process_image(image_path, additional_prompt=args.prompt, reuse_cached=args.use_cache)
+        if args.stats_json:
+            args.stats_json.write_text(json.dumps({
+                "success": success,
+                "stages": enhancer.timer.summary(),
+                "model": enhancer.backend.stats,
+            }, indent=2))
+
         if success:
             print(f"🎉 Regeneration Complete!")
             return 0
@@ -0,0 +1,207 @@
+"""
+In-process regeneration jobs for the comparator server.
+
+Regenerating used to start regenerate_image.py for every click, which paid for
+interpreter startup, imports and client construction each time and blocked the
+server until the image was done. RegenerationJobs owns a thread pool and one
+long-lived Gemini25ClothingEnhancer (with its limiter, cache and decoded
+sources) shared by all jobs. submit() returns at once with a job; its state
+can be polled, and subscribers get every state change pushed to an asyncio
+queue, which the server turns into Server-Sent Events.
+
+A job asking for more than one candidate generates them concurrently from a
+single analysis and stores them for review (see enhancement_candidates.py)
+instead of replacing the enhanced image.
+
+Jobs are kept in the shared state database (see shared_state.py), so with
+several server processes any of them can answer for any job, and a request
+is deduplicated against the jobs of all of them. A job runs in the process
+it was submitted to; if that process exits first, the job is marked failed.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from batch_engine import DEFAULT_MAX_IN_FLIGHT
+from enhancement_candidates import save_candidates
+from metrics import REGENERATION_JOBS
+from shared_state import EventTail, SharedState, process_exists
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+DEFAULT_WORKERS = int(os.getenv("REGEN_WORKERS", "4"))
+KEEP_FINISHED_JOBS = 200
+
+
+@dataclass
+class RegenerationJob:
+    id: str
+    filename: str
+    prompt: str
+    fresh: bool
+    candidates: int = 1
+    status: str = QUEUED
+    error: Optional[str] = None
+    # Candidate file names, once a multi-candidate job has finished
+    results: List[str] = field(default_factory=list)
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+
+class RegenerationJobs:
+    """Thread pool of regeneration jobs sharing one enhancer."""
+
+    def __init__(self, source_dir: Path, state: SharedState, workers: int = DEFAULT_WORKERS):
+        self.source_dir = source_dir
+        self.state = state
+        self.events = EventTail(state, "job_events")
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="regenerate")
+        self.enhancer = None
+        self.enhancer_lock = threading.Lock()
+
+    def get_enhancer(self):
+        """Builds the enhancer on first use, so the server starts without an API key."""
+        with self.enhancer_lock:
+            if self.enhancer is None:
+                from batch_engine import AdaptiveLimiter
+                from enhancement_cache import EnhancementCache
+                from enhancement_logic import Gemini25ClothingEnhancer
+
+                limiter = AdaptiveLimiter(int(os.getenv("ENHANCE_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)))
+                self.enhancer = Gemini25ClothingEnhancer(limiter=limiter, cache=EnhancementCache())
+            return self.enhancer
+
+    def submit(self, filename: str, prompt: str = "", fresh: bool = True, candidates: int = 1) -> RegenerationJob:
+        """
+        Queues a regeneration; an identical request still in progress is returned
+        instead. Unless fresh is False, a new image is generated even if this
+        request is cached.
+        """
+        request = (filename, prompt, fresh, candidates)
+        with self.state.transaction() as conn:
+            for job in self._active_jobs(conn):
+                if (job.filename, job.prompt, job.fresh, job.candidates) == request:
+                    return job
+            job = RegenerationJob(id="", filename=filename, prompt=prompt, fresh=fresh,
+                                  candidates=candidates, created_at=time.time())
+            cursor = conn.execute(
+                "INSERT INTO regeneration_jobs (filename, status, owner_pid, job, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (filename, job.status, os.getpid(), "{}", job.created_at))
+            job.id = str(cursor.lastrowid)
+            self._save(conn, job)
+            self._prune(conn)
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self.state.transaction(write=False) as conn:
+            row = conn.execute("SELECT job FROM regeneration_jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, active_only: bool = False) -> List[Dict]:
+        with self.state.transaction(write=False) as conn:
+            if active_only:
+                rows = conn.execute("SELECT job FROM regeneration_jobs WHERE status IN (?, ?) ORDER BY id",
+                                    (QUEUED, RUNNING))
+            else:
+                rows = conn.execute("SELECT job FROM regeneration_jobs ORDER BY id")
+            return [json.loads(row[0]) for row in rows]
+
+    def active_snapshot(self) -> Tuple[List[Dict], int]:
+        """The jobs in progress, and the sequence number of the last job change they include."""
+        with self.state.transaction(write=False) as conn:
+            jobs = [json.loads(row[0]) for row in conn.execute(
+                "SELECT job FROM regeneration_jobs WHERE status IN (?, ?) ORDER BY id", (QUEUED, RUNNING))]
+            return jobs, self.state.last_event(conn, "job_events")
+
+    def _active_jobs(self, conn) -> List[RegenerationJob]:
+        """Jobs in progress. Those of processes that are gone are marked failed. Needs a write transaction."""
+        jobs = []
+        for owner_pid, data in conn.execute(
+                "SELECT owner_pid, job FROM regeneration_jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall():
+            job = RegenerationJob(**json.loads(data))
+            if process_exists(owner_pid):
+                jobs.append(job)
+            else:
+                job.status, job.error, job.finished_at = FAILED, "The server process running it exited", time.time()
+                self._save(conn, job)
+        return jobs
+
+    def _save(self, conn, job: RegenerationJob):
+        """Stores the job and records the change for subscribers. Needs a write transaction."""
+        data = asdict(job)
+        conn.execute("UPDATE regeneration_jobs SET status = ?, job = ?, updated_at = ? WHERE id = ?",
+                     (job.status, json.dumps(data), time.time(), job.id))
+        self.state.append_event(conn, "job_events", data)
+
+    def _prune(self, conn):
+        """Forgets the oldest finished jobs. Needs a write transaction."""
+        conn.execute("""
+            DELETE FROM regeneration_jobs WHERE status NOT IN (?, ?) AND id NOT IN (
+                SELECT id FROM regeneration_jobs WHERE status NOT IN (?, ?) ORDER BY id DESC LIMIT ?)
+        """, (QUEUED, RUNNING, QUEUED, RUNNING, KEEP_FINISHED_JOBS))
+
+    def _update(self, job: RegenerationJob, **changes):
+        for key, value in changes.items():
+            setattr(job, key, value)
+        with self.state.transaction() as conn:
+            self._save(conn, job)
+
+    def _run(self, job: RegenerationJob):
+        self._update(job, status=RUNNING, started_at=time.time())
+        results = []
+        try:
+            enhancer = self.get_enhancer()
+            image_path = self.source_dir / job.filename
+            if job.candidates > 1:
+                enhancer.logger.info(f"Generating {job.candidates} candidates for {job.filename}")
+                candidates = enhancer.enhance_candidates(image_path, job.prompt, job.candidates)
+                with enhancer.timer.stage("write", job.filename):
+                    results = save_candidates(job.filename, candidates)
+            else:
+                enhancer.logger.info(f"Regenerating: {job.filename}")
+                enhancer.save_enhanced(image_path, enhancer.enhance(image_path, job.prompt, reuse_cached=not job.fresh))
+        except Exception as e:
+            if self.enhancer:
+                self.enhancer.logger.error(f"Regeneration of {job.filename} failed: {e}")
+            self._update(job, status=FAILED, error=str(e) or type(e).__name__, finished_at=time.time())
+            REGENERATION_JOBS.inc(status=FAILED)
+            return
+        self._update(job, status=SUCCEEDED, results=results, finished_at=time.time())
+        REGENERATION_JOBS.inc(status=SUCCEEDED)
+
+    # --- Push notifications ---
+
+    def subscribe(self) -> asyncio.Queue:
+        """Returns a queue on the running event loop that receives (sequence, job) of every job change."""
+        return self.events.subscribe()
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.events.unsubscribe(queue)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        # Jobs that were still queued here won't run; don't let them block new requests
+        with self.state.transaction() as conn:
+            for owner_pid, data in conn.execute(
+                    "SELECT owner_pid, job FROM regeneration_jobs WHERE status = ?", (QUEUED,)).fetchall():
+                if owner_pid == os.getpid():
+                    job = RegenerationJob(**json.loads(data))
+                    job.status, job.error, job.finished_at = FAILED, "The server stopped", time.time()
+                    self._save(conn, job)
+
@@ -0,0 +1,228 @@
+"""
+The comparator's review queue: images whose original and enhanced versions
+differ, kept current while the server runs.
+
+The queue lives in the shared state database (see shared_state.py), so every
+worker process of the server sees the same queue. One process at a time, the
+one holding the watch lock, scans both directories at startup (cheap on an
+unchanged tree, see hash_index.py) and then follows them, rechecking only
+the file names that changed:
+
+    watchfiles  inotify and the like, through watchfiles (installed with
+                uvicorn[standard])
+    poll        a directory listing every COMPARATOR_POLL_SECONDS, comparing
+                size and mtime; used when watchfiles is missing or when
+                COMPARATOR_WATCH=poll (e.g. on network filesystems)
+
+If that process exits, another one takes over. Any process may recheck files
+it changed itself (refresh()).
+
+Every change to the queue bumps its version and is appended to the
+review_events table, from where each process pushes it to its subscribers:
+
+    {"version": 7, "added": ["a.jpg"], "removed": [], "changed": ["b.jpg"]}
+
+changed lists images that stay in the queue but whose files changed (e.g.
+regenerated), so clients can reload them. A client that misses a version
+refetches the whole queue.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from hash_index import HashIndex
+from shared_state import EventTail, SharedState, process_exists
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): every process follows the directories
+    fcntl = None
+
+WATCH_MODE = os.getenv("COMPARATOR_WATCH", "auto")
+POLL_SECONDS = float(os.getenv("COMPARATOR_POLL_SECONDS", "2"))
+# How often wait_scanned() checks whether another process has scanned
+SCANNED_POLL_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def _listing(directory: Path) -> Dict[str, Tuple[int, int]]:
+    """name -> (size, mtime_ns) of the visible files in directory."""
+    listing = {}
+    for entry in os.scandir(directory):
+        if entry.name.startswith("."):
+            # Temporary files of atomic writes, the hash index, ...
+            continue
+        try:
+            if entry.is_file():
+                st = entry.stat()
+                listing[entry.name] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            continue
+    return listing
+
+
+class ReviewQueue:
+    """Versioned set of differing images, shared by the server's processes."""
+
+    def __init__(self, shop_dir: Path, enhanced_dir: Path, hash_index: HashIndex, state: SharedState):
+        self.shop_dir = Path(shop_dir)
+        self.enhanced_dir = Path(enhanced_dir)
+        self.hash_index = hash_index
+        self.state = state
+        self.events = EventTail(state, "review_events")
+        # Held while comparing, so an older result of this process can't overwrite a newer one
+        self.check_lock = threading.Lock()
+        self.scanned = threading.Event()
+        self.stop_event = threading.Event()
+        self.watcher: Optional[threading.Thread] = None
+
+    def _compare(self, filenames: Iterable[str], shop: Dict[str, Tuple[int, int]],
+                 enhanced: Dict[str, Tuple[int, int]]) -> Set[str]:
+        """Which of filenames differ, given the listings of both directories."""
+        shop_dir, enhanced_dir = str(self.shop_dir), str(self.enhanced_dir)
+        common = [f for f in filenames if f in shop and f in enhanced]
+
+        # Files of different sizes differ; only same-size pairs need their digests
+        same_size = [f for f in common if shop[f][0] == enhanced[f][0]]
+        digests = self.hash_index.digests([os.path.join(shop_dir, f) for f in same_size] +
+                                          [os.path.join(enhanced_dir, f) for f in same_size])
+        differing = set()
+        for filename in common:
+            if shop[filename][0] != enhanced[filename][0]:
+                differing.add(filename)
+                continue
+            hash1 = digests.get(os.path.join(shop_dir, filename))
+            hash2 = digests.get(os.path.join(enhanced_dir, filename))
+            if hash1 is None or hash2 is None:
+                logger.warning(f"Could not process {filename}")
+            elif hash1 != hash2:
+                differing.add(filename)
+        return differing
+
+    def scan(self):
+        """Compares every image in both directories."""
+        logger.info("Scanning directories and comparing image hashes...")
+        started = time.perf_counter()
+        hashed_before = self.hash_index.stats["hashed"]
+        with self.check_lock:
+            shop, enhanced = _listing(self.shop_dir), _listing(self.enhanced_dir)
+            common = shop.keys() & enhanced.keys()
+            differing = self._compare(common, shop, enhanced)
+            self._apply(None, differing)
+        # Lets the other processes know the queue is current, see wait_scanned()
+        self.state.set_meta("scanned_by", str(os.getpid()))
+        self.scanned.set()
+        logger.info(f"Found {len(differing)} differing images out of {len(common)} common images "
+              f"in {time.perf_counter() - started:.3f}s "
+              f"({self.hash_index.stats['hashed'] - hashed_before} files hashed).")
+
+    def wait_scanned(self):
+        """Blocks until this process, or the live process watching the directories, has scanned them."""
+        while not self.scanned.wait(SCANNED_POLL_SECONDS):
+            # A mark left by a process that has exited is from an earlier run
+            scanned_by = self.state.get_meta("scanned_by")
+            if scanned_by and process_exists(int(scanned_by)):
+                return
+
+    def refresh(self, filenames: Iterable[str]):
+        """Rechecks the given file names only."""
+        filenames = {f for f in filenames if Path(f).name == f and not f.startswith(".")}
+        if not filenames:
+            return
+        with self.check_lock:
+            shop, enhanced = {}, {}
+            for listing, directory in ((shop, self.shop_dir), (enhanced, self.enhanced_dir)):
+                for filename in filenames:
+                    try:
+                        st = os.stat(directory / filename)
+                    except OSError:
+                        continue
+                    listing[filename] = (st.st_size, st.st_mtime_ns)
+            self._apply(filenames, self._compare(filenames, shop, enhanced), report_changed=True)
+
+    def _apply(self, checked: Optional[Iterable[str]], differing: Set[str], report_changed: bool = False):
+        """
+        Replaces the state of the checked file names (None: all of them) and
+        records what changed. With report_changed, checked names that stay in
+        the queue are reported as changed.
+        """
+        with self.state.transaction() as conn:
+            current = {row[0] for row in conn.execute("SELECT filename FROM review_images")}
+            checked = current | differing if checked is None else set(checked)
+            added = sorted(differing - current)
+            removed = sorted((current & checked) - differing)
+            changed = sorted(current & differing) if report_changed else []
+            if not added and not removed and not changed:
+                return
+            conn.executemany("INSERT INTO review_images (filename) VALUES (?)", [(f,) for f in added])
+            conn.executemany("DELETE FROM review_images WHERE filename = ?", [(f,) for f in removed])
+            self.state.append_event(conn, "review_events", {"added": added, "removed": removed, "changed": changed})
+
+    def snapshot(self) -> Dict:
+        with self.state.transaction(write=False) as conn:
+            images = [row[0] for row in conn.execute("SELECT filename FROM review_images ORDER BY filename")]
+            return {"version": self.state.last_event(conn, "review_events"), "images": images}
+
+    def subscribe(self) -> asyncio.Queue:
+        """Returns a queue on the running event loop that receives (version, change) of every change."""
+        return self.events.subscribe()
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.events.unsubscribe(queue)
+
+    # --- Watching ---
+
+    def start(self):
+        """Starts a daemon thread that scans and follows both directories once it holds the watch lock."""
+        self.watcher = threading.Thread(target=self._follow, name="review-queue-watcher", daemon=True)
+        self.watcher.start()
+
+    def _follow(self):
+        if fcntl:
+            # Held until this process exits; the other processes wait here to take over
+            lock_file = open(self.state.path.with_name(self.state.path.name + ".watch.lock"), "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.lock_file = lock_file
+        follow = self._poll
+        if WATCH_MODE != "poll":
+            try:
+                import watchfiles  # noqa: F401
+                follow = self._watch
+            except ImportError:
+                logger.warning("watchfiles is not installed; polling the image directories instead.")
+        follow()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _watch(self):
+        import watchfiles
+
+        self.scan()
+        for changes in watchfiles.watch(self.shop_dir, self.enhanced_dir, stop_event=self.stop_event,
+                                        recursive=False, raise_interrupt=False):
+            try:
+                self.refresh(os.path.basename(path) for _, path in changes)
+            except Exception as e:
+                logger.error(f"Could not update the review queue: {e}")
+
+    def _poll(self):
+        listings = (_listing(self.shop_dir), _listing(self.enhanced_dir))
+        self.scan()
+        while not self.stop_event.wait(POLL_SECONDS):
+            try:
+                current = (_listing(self.shop_dir), _listing(self.enhanced_dir))
+                changed = set()
+                for before, after in zip(listings, current):
+                    changed |= {f for f in before.keys() | after.keys() if before.get(f) != after.get(f)}
+                listings = current
+                self.refresh(changed)
+            except Exception as e:
+                logger.error(f"Could not update the review queue: {e}")
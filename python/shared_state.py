@@ -0,0 +1,257 @@
+"""
+SQLite state shared by the comparator's worker processes.
+
+With several uvicorn workers, each request may land in a different process.
+The review queue and the regeneration jobs therefore live in one SQLite
+database (WAL, so readers never wait for the writer), and every change is
+appended to an event table. Each process runs an EventTail per event table:
+a thread that reads the rows appended by any process and pushes them to the
+asyncio queues of its own subscribers, which the server turns into
+Server-Sent Events. Events reach subscribers within TAIL_POLL_SECONDS.
+
+Each process also stores the values of its metrics (see metrics.py), so the
+one answering a scrape can report the sum over all of them.
+
+The database is COMPARATOR_STATE_FILE (default python/comparator_state.sqlite).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from metrics import Registry
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+STATE_PATH = Path(os.getenv("COMPARATOR_STATE_FILE", PROJECT_ROOT / "python/comparator_state.sqlite"))
+TAIL_POLL_SECONDS = 0.25
+# While the database can't be read, polls back off up to this interval
+TAIL_MAX_BACKOFF_SECONDS = 10
+# Events kept per table; subscribers that fall further behind refetch instead
+KEEP_EVENTS = 1000
+# Seconds a process waits for another one's write transaction
+BUSY_TIMEOUT = 30
+
+SHARED_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_images (
+    filename TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS review_events (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS regeneration_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner_pid INTEGER NOT NULL,
+    job TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_regeneration_jobs_status ON regeneration_jobs(status);
+
+CREATE TABLE IF NOT EXISTS state_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+-- pid 0 holds the summed counters and histograms of processes that exited
+CREATE TABLE IF NOT EXISTS process_metrics (
+    pid INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    metrics TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Event table -> its sequence column
+EVENT_TABLES = {"review_events": "version", "job_events": "seq"}
+# Tells this process's metrics row from one left by an earlier process with the same pid
+PROCESS_STARTED = time.time()
+EXITED_PROCESSES = 0
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState:
+    """One connection per process to the shared database."""
+
+    def __init__(self, path: Path = STATE_PATH):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        # Transactions are managed explicitly, see transaction()
+        self.conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SHARED_STATE_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        A transaction on the shared connection. Write transactions take the
+        database write lock up front, so a read-modify-write can't interleave
+        with another process's; read transactions see one consistent snapshot.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM state_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO state_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def append_event(self, conn: sqlite3.Connection, table: str, event: dict) -> int:
+        """Appends an event inside a write transaction and returns its sequence number."""
+        cursor = conn.execute(f"INSERT INTO {table} (event, created_at) VALUES (?, ?)",
+                              (json.dumps(event), time.time()))
+        return cursor.lastrowid
+
+    def last_event(self, conn: sqlite3.Connection, table: str) -> int:
+        return conn.execute(f"SELECT COALESCE(MAX({EVENT_TABLES[table]}), 0) FROM {table}").fetchone()[0]
+
+    def events_after(self, table: str, after: int) -> List[Tuple[int, dict]]:
+        column = EVENT_TABLES[table]
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {column}, event FROM {table} WHERE {column} > ? ORDER BY {column}",
+                                     (after,)).fetchall()
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+    def prune_events(self, table: str):
+        column = EVENT_TABLES[table]
+        with self.transaction() as conn:
+            conn.execute(f"DELETE FROM {table} WHERE {column} <= (SELECT MAX({column}) FROM {table}) - ?",
+                         (KEEP_EVENTS,))
+
+    def exchange_metrics(self, registry: Registry) -> Registry:
+        """
+        Stores the values of this process's registry and returns a registry
+        holding the sum over all processes. The counters and histograms of
+        processes that exited are folded into one row, so totals never go
+        back; their gauges are dropped.
+        """
+        pid = os.getpid()
+        state = registry.state()
+        with self.transaction() as conn:
+            exited_total, exited, running = {}, [], []
+            for row_pid, started_at, metrics in conn.execute(
+                    "SELECT pid, started_at, metrics FROM process_metrics").fetchall():
+                if row_pid == EXITED_PROCESSES:
+                    exited_total = json.loads(metrics)
+                elif row_pid == pid and started_at == PROCESS_STARTED:
+                    continue
+                elif row_pid != pid and process_exists(row_pid):
+                    running.append(json.loads(metrics))
+                else:
+                    # Gone, or an earlier process that had this pid
+                    exited.append((row_pid, json.loads(metrics)))
+            if exited:
+                exited_total = registry.merged([exited_total] + [metrics for _, metrics in exited],
+                                               kinds=("counter", "histogram")).state()
+                conn.executemany("DELETE FROM process_metrics WHERE pid = ?", [(p,) for p, _ in exited])
+                conn.execute("INSERT OR REPLACE INTO process_metrics (pid, started_at, metrics, updated_at) "
+                             "VALUES (?, 0, ?, ?)", (EXITED_PROCESSES, json.dumps(exited_total), time.time()))
+            conn.execute("INSERT OR REPLACE INTO process_metrics (pid, started_at, metrics, updated_at) "
+                         "VALUES (?, ?, ?, ?)", (pid, PROCESS_STARTED, json.dumps(state), time.time()))
+        return registry.merged(running + [exited_total, state])
+
+
+class EventTail:
+    """
+    Follows one event table and pushes (sequence, event) to the asyncio
+    queues of this process's subscribers, whichever process wrote the event.
+    """
+
+    def __init__(self, state: SharedState, table: str):
+        self.state = state
+        self.table = table
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        with state.transaction(write=False) as conn:
+            self.last = state.last_event(conn, table)
+        self.thread = threading.Thread(target=self._run, name=f"tail-{table}", daemon=True)
+        self.thread.start()
+
+    def subscribe(self) -> asyncio.Queue:
+        """Returns a queue on the running event loop that receives every new event."""
+        queue = asyncio.Queue()
+        with self.lock:
+            self.subscribers.add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self.lock:
+            self.subscribers = {(loop, q) for loop, q in self.subscribers if q is not queue}
+
+    def _run(self):
+        polls = 0
+        delay = TAIL_POLL_SECONDS
+        while True:
+            time.sleep(delay)
+            try:
+                events = self.state.events_after(self.table, self.last)
+                polls += 1
+                if polls % 1000 == 0:
+                    self.state.prune_events(self.table)
+            except sqlite3.Error as e:
+                # Reported once per outage, not on every retry
+                if delay == TAIL_POLL_SECONDS:
+                    logger.error(f"Could not read {self.table}, retrying with backoff: {e}")
+                delay = min(delay * 2, TAIL_MAX_BACKOFF_SECONDS)
+                continue
+            if delay != TAIL_POLL_SECONDS:
+                logger.info(f"Reading {self.table} again")
+                delay = TAIL_POLL_SECONDS
+            if not events:
+                continue
+            self.last = events[-1][0]
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for loop, queue in subscribers:
+                for event in events:
+                    try:
+                        loop.call_soon_threadsafe(queue.put_nowait, event)
+                    except RuntimeError:
+                        # The loop is closed; the subscriber went away without unsubscribing
+                        self.unsubscribe(queue)
+                        break
+
+
+def process_exists(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,128 @@
+"""
+Per-stage timing for the enhancement pipeline.
+
+The enhancer wraps each stage of an image (load, analyze, prompt, generate,
+postprocess with its decode/resize/encode steps, write) and the whole image
+("enhance") in StageTimer.stage(name, image). Every stage
+
+  - is kept in memory per stage, so batch and benchmark runs can report
+    percentiles;
+  - is observed in the enhance_stage_seconds histogram, and counted in
+    enhance_stage_failures_total if it raised (see metrics.py);
+  - is appended as one JSON line to the span log, if there is one:
+
+    {"ts": 1760000000.123, "image": "a.jpg", "stage": "generate", "ms": 8123.4,
+     "ok": true, "error": null, "pid": 4242, "thread": "regenerate_0"}
+
+The span log is ENHANCE_SPANS_FILE (default python/enhancement_spans.jsonl,
+empty to disable). It is rotated to a .1 file when it passes SPANS_MAX_BYTES.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import STAGE_FAILURES, STAGE_SECONDS
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+SPANS_PATH = PROJECT_ROOT / "python/enhancement_spans.jsonl"
+SPANS_MAX_BYTES = 50 * 1024 * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of values; 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class SpanLog:
+    """Thread-safe JSON-lines writer for stage spans."""
+
+    def __init__(self, path: Path, max_bytes: int = SPANS_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, span: Dict):
+        line = json.dumps(span) + "\n"
+        with self.lock:
+            if self.file.tell() > self.max_bytes:
+                self.file.close()
+                os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def default_span_log() -> Optional[SpanLog]:
+    """The span log named by ENHANCE_SPANS_FILE, read when the enhancer is built."""
+    path = os.getenv("ENHANCE_SPANS_FILE", str(SPANS_PATH))
+    return SpanLog(Path(path)) if path else None
+
+
+class StageTimer:
+    """Thread-safe collection of stage durations, in seconds."""
+
+    def __init__(self, span_log: Optional[SpanLog] = None):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.span_log = span_log
+
+    def record(self, name: str, seconds: float, image: Optional[str] = None, error: Optional[str] = None,
+               started: Optional[float] = None):
+        with self.lock:
+            self.durations[name].append(seconds)
+        STAGE_SECONDS.observe(seconds, stage=name)
+        if error:
+            STAGE_FAILURES.inc(stage=name, error=error)
+        if self.span_log:
+            self.span_log.write({
+                "ts": round(started if started is not None else time.time() - seconds, 3),
+                "image": image,
+                "stage": name,
+                "ms": round(seconds * 1000, 1),
+                "ok": error is None,
+                "error": error,
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+            })
+
+    @contextmanager
+    def stage(self, name: str, image: Optional[str] = None):
+        started = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, image, error, started)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count, total, p50 and p95 per stage."""
+        with self.lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        return {
+            name: {
+                "count": len(values),
+                "total": sum(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+            }
+            for name, values in durations.items()
+        }
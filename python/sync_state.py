@@ -0,0 +1,151 @@
+"""
+Bookkeeping for incremental Airtable syncs.
+
+For every synced table the database keeps a high-water mark (the time the last
+successful fetch started) and a fingerprint of each record's content. Later
+runs fetch only records modified since the watermark and skip the SQL write for
+records whose fingerprint is unchanged. A periodic full reconcile refetches
+everything so deletions are still noticed.
+
+A record that could not be fully synced (e.g. an image download failed) is
+stored with the INCOMPLETE fingerprint instead of its own, so it counts as
+changed, and later incremental fetches ask for it by id until it succeeds.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+# How often a full fetch runs to catch deletions and re-derive display order
+FULL_RECONCILE_INTERVAL = timedelta(hours=24)
+
+# Records modified shortly before the watermark are refetched to tolerate
+# clock skew between this machine and Airtable. Their fingerprints are
+# unchanged, so the overlap costs no writes.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Fingerprint of records to retry; never equal to a real one
+INCOMPLETE = "incomplete"
+# Beyond this many records to retry, a full sync is cheaper than a long formula
+MAX_RETRY_RECORDS = 100
+
+SYNC_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    table_id TEXT PRIMARY KEY,
+    high_water_mark TEXT,
+    last_full_sync TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sync_records (
+    table_id TEXT NOT NULL,
+    airtable_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (table_id, airtable_id)
+);
+"""
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def format_timestamp(moment):
+    return moment.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def ensure_sync_tables(cursor):
+    """Creates the sync bookkeeping tables if they don't exist."""
+    cursor.executescript(SYNC_STATE_SCHEMA)
+
+
+def get_sync_state(cursor, table_id):
+    """Returns (high_water_mark, last_full_sync) for a table, either may be None."""
+    cursor.execute("SELECT high_water_mark, last_full_sync FROM sync_state WHERE table_id = ?", (table_id,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def needs_full_sync(cursor, table_ids, now=None):
+    """A full sync is due if any table has never synced or its last full sync is too old."""
+    now = now or utc_now()
+    for table_id in table_ids:
+        high_water_mark, last_full_sync = get_sync_state(cursor, table_id)
+        if not high_water_mark or not last_full_sync:
+            return True
+        if now - parse_timestamp(last_full_sync) > FULL_RECONCILE_INTERVAL:
+            return True
+        if len(incomplete_records(cursor, table_id)) > MAX_RETRY_RECORDS:
+            return True
+    return False
+
+
+def modified_since_formula(high_water_mark, retry_ids=()):
+    """
+    Builds an Airtable filterByFormula selecting records modified after the
+    watermark, and the records with the given ids.
+    """
+    since = format_timestamp(parse_timestamp(high_water_mark) - WATERMARK_OVERLAP)
+    formula = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{since}'))"
+    if retry_ids:
+        records = ", ".join(f"RECORD_ID() = '{airtable_id}'" for airtable_id in sorted(retry_ids))
+        formula = f"OR({formula}, {records})"
+    return formula
+
+
+def _stable_value(value):
+    # Attachment URLs are signed and change on every fetch, so only the
+    # identifying metadata of an attachment contributes to the fingerprint.
+    if isinstance(value, list):
+        return [_stable_value(v) for v in value]
+    if isinstance(value, dict) and 'url' in value and 'id' in value:
+        return {k: value.get(k) for k in ('id', 'filename', 'size')}
+    return value
+
+
+def record_fingerprint(record):
+    """Hashes the content of an Airtable record's fields."""
+    fields = {name: _stable_value(value) for name, value in record.get('fields', {}).items()}
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_fingerprints(cursor, table_id):
+    cursor.execute("SELECT airtable_id, fingerprint FROM sync_records WHERE table_id = ?", (table_id,))
+    return dict(cursor.fetchall())
+
+
+def save_fingerprints(cursor, table_id, fingerprints):
+    cursor.executemany("""
+        INSERT INTO sync_records (table_id, airtable_id, fingerprint) VALUES (?, ?, ?)
+        ON CONFLICT(table_id, airtable_id) DO UPDATE SET fingerprint = excluded.fingerprint
+    """, [(table_id, airtable_id, fp) for airtable_id, fp in fingerprints.items()])
+
+
+def incomplete_records(cursor, table_id):
+    """Ids of the records whose last sync was incomplete."""
+    cursor.execute("SELECT airtable_id FROM sync_records WHERE table_id = ? AND fingerprint = ?",
+                   (table_id, INCOMPLETE))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def prune_fingerprints(cursor, table_id, live_ids):
+    """Forgets fingerprints of records that no longer exist in Airtable."""
+    stale = set(load_fingerprints(cursor, table_id)) - set(live_ids)
+    cursor.executemany("DELETE FROM sync_records WHERE table_id = ? AND airtable_id = ?",
+                       [(table_id, airtable_id) for airtable_id in stale])
+
+
+def save_sync_state(cursor, table_id, high_water_mark, full_sync):
+    """Advances a table's watermark, and its last full sync time for full runs."""
+    cursor.execute("""
+        INSERT INTO sync_state (table_id, high_water_mark, last_full_sync) VALUES (?, ?, ?)
+        ON CONFLICT(table_id) DO UPDATE SET
+            high_water_mark = excluded.high_water_mark,
+            last_full_sync = COALESCE(excluded.last_full_sync, sync_state.last_full_sync)
+    """, (table_id, high_water_mark, high_water_mark if full_sync else None))
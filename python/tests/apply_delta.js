@@ -0,0 +1,22 @@
+// Applies a delta with applyDatabaseDelta from assets/js/db.js, for test_db_delta.py.
+// Usage: node apply_delta.js <db.js> <base> <delta> <output>
+// db.js is a browser script, so only the decoder's source is taken from it.
+const fs = require('fs');
+
+const [dbJs, basePath, deltaPath, outputPath] = process.argv.slice(2);
+const source = fs.readFileSync(dbJs, 'utf8');
+const match = source.match(/^function applyDatabaseDelta\(base, delta\) \{[\s\S]*?^\}$/m);
+if (!match) {
+    console.error('applyDatabaseDelta not found in ' + dbJs);
+    process.exit(2);
+}
+const applyDatabaseDelta = new Function(match[0] + '\nreturn applyDatabaseDelta;')();
+
+try {
+    const result = applyDatabaseDelta(new Uint8Array(fs.readFileSync(basePath)),
+                                      new Uint8Array(fs.readFileSync(deltaPath)));
+    fs.writeFileSync(outputPath, result);
+} catch (error) {
+    console.error(error.message);
+    process.exit(1);
+}
@@ -0,0 +1,82 @@
+"""
+A small threaded fake of the Airtable records API for tests.
+
+Serves GET /v0/<base>/<table> with offset pagination over in-memory records,
+and can be told to answer the next requests with an error status (e.g. 429
+with Retry-After) before serving normally again. Every request is logged with
+its path, query and arrival time.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeAirtable:
+    def __init__(self, page_size: int = 100, delay: float = 0.0):
+        self.page_size = page_size
+        # Seconds each response is held back, to make prefetching observable
+        self.delay = delay
+        self.tables: Dict[str, List[Dict]] = {}
+        self.failures: List[tuple] = []  # (status, headers) served before normal responses
+        self.requests: List[Dict] = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail_next(self, status: int, headers: Optional[Dict[str, str]] = None, times: int = 1):
+        with self.lock:
+            self.failures.extend([(status, headers or {})] * times)
+
+    def _respond(self, path: str, query: Dict[str, List[str]]):
+        with self.lock:
+            self.requests.append({"path": path, "query": query, "time": time.monotonic()})
+            if self.failures:
+                return self.failures.pop(0) + (None,)
+        table = path.rstrip("/").split("/")[-1]
+        if table not in self.tables:
+            return 404, {}, {"error": "NOT_FOUND"}
+        records = self.tables[table]
+        start = int(query.get("offset", ["0"])[0])
+        body = {"records": records[start:start + self.page_size]}
+        if start + self.page_size < len(records):
+            body["offset"] = str(start + self.page_size)
+        return 200, {}, body
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, headers, body = fake._respond(url.path, parse_qs(url.query))
+                if fake.delay:
+                    time.sleep(fake.delay)
+                data = json.dumps(body if body is not None else {"error": status}).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
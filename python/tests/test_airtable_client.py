@@ -0,0 +1,121 @@
+import time
+
+import pytest
+import requests
+
+import airtable_client
+from airtable_client import AirtableClient, TokenBucket
+from tests.fake_airtable import FakeAirtable
+
+TABLE = "tblTest"
+
+
+def make_records(count):
+    return [{"id": f"rec{i:04d}", "fields": {"Item Name": f"Item {i}"}} for i in range(count)]
+
+
+@pytest.fixture
+def fake():
+    with FakeAirtable(page_size=3) as server:
+        server.tables[TABLE] = make_records(10)
+        yield server
+
+
+@pytest.fixture
+def client(fake):
+    # Fast enough not to slow the tests down, slow enough to be measurable
+    with AirtableClient("pat", "appTest", api_url=fake.url, requests_per_second=50, max_retries=3) as c:
+        yield c
+
+
+def test_retries_429_after_retry_after(fake, client):
+    fake.fail_next(429, {"Retry-After": "0.3"})
+    start = time.monotonic()
+    data = client.get_json(f"v0/appTest/{TABLE}")
+    assert [r["id"] for r in data["records"]] == ["rec0000", "rec0001", "rec0002"]
+    assert time.monotonic() - start >= 0.3
+    assert fake.requests[1]["time"] - fake.requests[0]["time"] >= 0.3
+    assert client.stats["requests"] == 2
+    assert client.stats["retries"] == 1
+    assert client.stats["throttled"] == 1
+    assert client.stats["throttled_seconds"] >= 0.3
+
+
+def test_gives_up_after_max_retries(fake, client, monkeypatch):
+    monkeypatch.setattr(airtable_client, "BACKOFF_BASE", 0.01)
+    fake.fail_next(503, times=10)
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        client.get_json(f"v0/appTest/{TABLE}")
+    assert error.value.response.status_code == 503
+    assert len(fake.requests) == client.max_retries + 1
+    assert client.stats["retries"] == client.max_retries
+
+
+def test_client_errors_are_not_retried(fake, client):
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get_json("v0/appTest/tblMissing")
+    assert len(fake.requests) == 1
+
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(airtable_client.random, "uniform", lambda low, high: high)
+    client = AirtableClient("pat", "appTest", api_url="http://127.0.0.1:1")
+    try:
+        delays = [client._backoff(attempt, None) for attempt in range(8)]
+    finally:
+        client.close()
+    assert delays == [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0]
+
+
+def test_backoff_honours_retry_after_and_throttle_penalty():
+    client = AirtableClient("pat", "appTest", api_url="http://127.0.0.1:1")
+    try:
+        with_header = requests.Response()
+        with_header.status_code = 429
+        with_header.headers["Retry-After"] = "7"
+        assert client._backoff(0, with_header) == 7.0
+        without_header = requests.Response()
+        without_header.status_code = 429
+        assert client._backoff(0, without_header) == airtable_client.THROTTLE_PENALTY
+    finally:
+        client.close()
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=20, capacity=1)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # The first token is free, the next four take 1/20 s each
+    assert time.monotonic() - start >= 0.18
+
+
+def test_iter_pages_keeps_order_while_prefetching(fake, client):
+    fake.delay = 0.05
+    pages = []
+    received = []
+    for page in client.iter_pages(TABLE, view_name="Grid view"):
+        received.append(time.monotonic())
+        pages.append([r["id"] for r in page])
+        # Slower than the server, so the next page is already requested
+        time.sleep(0.15)
+
+    assert pages == [[r["id"] for r in make_records(10)[i:i + 3]] for i in range(0, 10, 3)]
+    assert [r["query"].get("offset", [None])[0] for r in fake.requests] == [None, "3", "6", "9"]
+    assert all(r["query"]["view"] == ["Grid view"] for r in fake.requests)
+    # Each following page was requested before the caller finished with the previous one
+    for request, page_received in zip(fake.requests[1:], received):
+        assert request["time"] < page_received + 0.15
+
+
+def test_iter_pages_retries_a_failed_page_from_its_offset(fake, client):
+    pages = client.iter_pages(TABLE)
+    first = next(pages)
+    # Once the second page has been requested, the third one fails once
+    while len(fake.requests) < 2:
+        time.sleep(0.01)
+    fake.fail_next(429, {"Retry-After": "0"})
+    rest = [record for page in pages for record in page]
+    assert [r["id"] for r in first + rest] == [r["id"] for r in make_records(10)]
+    offsets = [r["query"].get("offset", [None])[0] for r in fake.requests]
+    assert offsets == [None, "3", "6", "6", "9"]
@@ -0,0 +1,105 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import batch_jobs
+import enhance_with_gemini_2_5
+import enhancement_logic
+from batch_jobs import (
+    COLLECTED, FAILED, RUNNING, SUCCEEDED, BatchBackend, LocalBatchBackend, find_unfinished_job, iter_results,
+    read_manifest, request_line, wait_for_job,
+)
+from enhance_with_gemini_2_5 import collect_batch_job, submit_batch_job
+from enhancement_ledger import EnhancementLedger
+from enhancement_logic import Gemini25ClothingEnhancer
+from hash_index import HashIndex
+from model_backends import FAKE_OUTPUT_SIZE, FakeBackend
+
+MODEL = "fake-image-model"
+
+
+def jpeg(color):
+    buffer = BytesIO()
+    Image.new("RGB", (60, 80), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def write_job(path, images):
+    with open(path, "w", encoding="utf-8") as f:
+        for key, color in images.items():
+            f.write(request_line(key, jpeg(color), f"Enhance {key}") + "\n")
+    return path
+
+
+def test_batch_backend_is_abstract():
+    with pytest.raises(TypeError):
+        BatchBackend()
+
+
+def test_local_backend_runs_a_job(tmp_path):
+    job_file = write_job(tmp_path / "requests.jsonl", {"a.jpg": "red", "b.jpg": "green"})
+    backend = LocalBatchBackend(FakeBackend(latency=0.05), workers=2)
+    job_name = backend.submit(job_file, MODEL)
+    assert backend.status(job_name) == RUNNING
+    assert wait_for_job(backend, job_name, poll_interval=0.01) == SUCCEEDED
+
+    results = {key: (image, error) for key, image, error in iter_results(backend.fetch_results(job_name, tmp_path))}
+    assert set(results) == {"a.jpg", "b.jpg"}
+    for image, error in results.values():
+        assert error is None
+        with Image.open(BytesIO(image)) as generated:
+            assert generated.size == FAKE_OUTPUT_SIZE
+    assert backend.model_backend.stats["calls"] == 2
+
+
+def test_local_backend_reports_failed_requests(tmp_path):
+    job_file = write_job(tmp_path / "requests.jsonl", {"a.jpg": "red"})
+    backend = LocalBatchBackend(FakeBackend(latency=0, error_rate=1.0))
+    job_name = backend.submit(job_file, MODEL)
+    assert wait_for_job(backend, job_name, poll_interval=0.01) == SUCCEEDED
+    [(key, image, error)] = iter_results(backend.fetch_results(job_name, tmp_path))
+    assert key == "a.jpg" and image is None
+    assert "fake backend refusal" in error
+
+
+def test_local_job_of_a_process_that_is_gone_failed(tmp_path):
+    job_file = write_job(tmp_path / "requests.jsonl", {"a.jpg": "red"})
+    (tmp_path / "local-state").write_text(RUNNING)
+    assert LocalBatchBackend(FakeBackend(latency=0)).status(str(job_file)) == FAILED
+
+
+@pytest.fixture
+def enhancer(tmp_path, monkeypatch):
+    source_dir, output_dir = tmp_path / "shop", tmp_path / "shop_enhanced"
+    source_dir.mkdir()
+    monkeypatch.setattr(enhance_with_gemini_2_5, "SOURCE_DIR", source_dir)
+    monkeypatch.setattr(enhancement_logic, "OUTPUT_DIR", output_dir)
+    monkeypatch.setattr(enhancement_logic, "LOG_FILE", tmp_path / "enhancement.log")
+    monkeypatch.setattr(batch_jobs, "BATCH_JOBS_DIR", tmp_path / "batch_jobs")
+    monkeypatch.setenv("ENHANCE_SPANS_FILE", "")
+    for name, color in {"a.jpg": "red", "b.jpg": "green", "c.jpg": "blue"}.items():
+        (source_dir / name).write_bytes(jpeg(color))
+    return Gemini25ClothingEnhancer(backend=FakeBackend(latency=0))
+
+
+def test_batch_run_applies_the_results(tmp_path, enhancer):
+    ledger = EnhancementLedger(tmp_path / "ledger.sqlite")
+    images = sorted((tmp_path / "shop").iterdir())
+    backend = LocalBatchBackend(FakeBackend(latency=0.05), workers=2)
+
+    job_dir = submit_batch_job(enhancer, ledger, HashIndex(tmp_path / "index.sqlite"), images, backend, workers=2)
+    manifest = read_manifest(job_dir)
+    assert set(manifest["items"]) == {"a.jpg", "b.jpg", "c.jpg"}
+    assert find_unfinished_job("local") == job_dir
+
+    stats = collect_batch_job(enhancer, ledger, job_dir, backend, poll_interval=0.01, workers=2)
+    assert stats == {"total": 3, "successful": 3, "failed": 0}
+    assert sorted(p.name for p in (tmp_path / "shop_enhanced").glob("*.jpg")) == ["a.jpg", "b.jpg", "c.jpg"]
+    assert ledger.summary() == {"succeeded": 3}
+    assert read_manifest(job_dir)["state"] == COLLECTED
+    assert find_unfinished_job("local") is None
+    # The analyses were made interactively; only the generations went through the job
+    assert enhancer.backend.stats["calls"] == 3
+    assert backend.model_backend.stats["calls"] == 3
+    ledger.close()
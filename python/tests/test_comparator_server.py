@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import comparator_server
+import enhancement_candidates
+from enhancement_candidates import save_candidates
+from hash_index import HashIndex
+from preview_cache import PreviewCache
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    image_dirs = {kind: tmp_path / kind for kind in ("shop", "shop_enhanced")}
+    for directory in image_dirs.values():
+        directory.mkdir()
+    Image.new("RGB", (1200, 1600), "crimson").save(image_dirs["shop"] / "a.jpg")
+    monkeypatch.setattr(comparator_server, "IMAGE_DIRS", image_dirs)
+    monkeypatch.setattr(comparator_server, "preview_cache",
+                        PreviewCache(HashIndex(tmp_path / "index.sqlite"), tmp_path / "previews"))
+    # Without the context manager, so the startup hooks (watcher, scorer) don't run
+    return TestClient(comparator_server.app)
+
+
+def test_preview_revalidates_with_its_etag(client):
+    response = client.get("/preview/shop/a.jpg", params={"w": 300})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["cache-control"] == "no-cache"
+    etag = response.headers["etag"]
+
+    unchanged = client.get("/preview/shop/a.jpg", params={"w": 300}, headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["etag"] == etag
+    # Other widths are other representations
+    assert client.get("/preview/shop/a.jpg", params={"w": 900},
+                      headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_changed_image_gets_a_new_etag(client, tmp_path):
+    etag = client.get("/preview/shop/a.jpg").headers["etag"]
+    path = tmp_path / "shop" / "a.jpg"
+    Image.new("RGB", (1200, 1600), "navy").save(path)
+    mtime = path.stat().st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(mtime, mtime))
+
+    response = client.get("/preview/shop/a.jpg", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_versioned_preview_is_immutable(client):
+    version = client.get("/api/versions", params={"files": "a.jpg"}).json()["a.jpg"]
+    assert version["shop_enhanced"] is None
+    response = client.get("/preview/shop/a.jpg", params={"v": version["shop"]})
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/preview/shop/missing.jpg", 404),
+    ("/preview/shop/a.jpg?w=123", 400),
+])
+def test_preview_errors(client, path, status):
+    assert client.get(path).status_code == status
+
+
+@pytest.mark.parametrize("method", ["get", "delete"])
+def test_candidates_need_a_plain_filename(client, method):
+    assert getattr(client, method)("/api/candidates/%2E").status_code == 400
+    assert client.post("/api/candidates/promote", json={"filename": "../a.jpg", "candidate": 1}).status_code == 400
+
+
+def test_candidate_urls_change_with_their_content(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(comparator_server, "CANDIDATES_DIR", tmp_path / "candidates")
+    monkeypatch.setattr(enhancement_candidates, "CANDIDATES_DIR", tmp_path / "candidates")
+    save_candidates("a.jpg", [{".jpg": b"first"}, {".jpg": b"second"}])
+    first = client.get("/api/candidates/a.jpg").json()
+    assert [c["name"] for c in first] == ["a.jpg.1.jpg", "a.jpg.2.jpg"]
+    assert first == client.get("/api/candidates/a.jpg").json()
+
+    save_candidates("a.jpg", [{".jpg": b"regenerated"}])
+    [regenerated] = client.get("/api/candidates/a.jpg").json()
+    assert regenerated["name"] == "a.jpg.1.jpg"
+    assert regenerated["version"] != first[0]["version"]
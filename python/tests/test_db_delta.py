@@ -0,0 +1,153 @@
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from db_delta import HEADER, DeltaError, apply_delta, make_delta
+
+PAGE_SIZE = 1024
+DB_JS = Path(__file__).parent.parent.parent / "assets/js/db.js"
+APPLY_DELTA_JS = Path(__file__).parent / "apply_delta.js"
+
+
+def pages(*fills):
+    return b"".join(bytes([fill]) * PAGE_SIZE for fill in fills)
+
+
+def sqlite_snapshot(path, rows):
+    """A VACUUMed database with the publish page size, like publish.build_snapshot writes."""
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA page_size={PAGE_SIZE}")
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, title TEXT, price NUMERIC)")
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return Path(path).read_bytes()
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    """(base, new) published-style snapshots differing in one price and a few added rows."""
+    rows = [(i, f"Product {i} " + "x" * 100, i) for i in range(1, 300)]
+    base = sqlite_snapshot(tmp_path / "base.sqlite", rows)
+    rows[10] = (11, rows[10][1], 999)
+    new = sqlite_snapshot(tmp_path / "new.sqlite", rows + [(i, f"Product {i}", i) for i in range(300, 320)])
+    return base, new
+
+
+def test_identical_snapshots_give_an_empty_delta():
+    base = pages(1, 2, 3)
+    delta = make_delta(base, base, PAGE_SIZE)
+    assert len(delta) == HEADER.size
+    assert apply_delta(base, delta) == base
+
+
+def test_changed_pages_only():
+    base = pages(1, 2, 3, 4)
+    new = pages(1, 9, 3, 8)
+    delta = make_delta(base, new, PAGE_SIZE)
+    assert len(delta) == HEADER.size + 2 * (4 + PAGE_SIZE)
+    assert apply_delta(base, delta) == new
+
+
+def test_growth():
+    base = pages(1, 2)
+    new = pages(1, 2, 3, 0)
+    assert apply_delta(base, make_delta(base, new, PAGE_SIZE)) == new
+
+
+def test_shrinkage():
+    base = pages(1, 2, 3, 4)
+    new = pages(1, 5)
+    delta = make_delta(base, new, PAGE_SIZE)
+    assert len(delta) == HEADER.size + 4 + PAGE_SIZE
+    assert apply_delta(base, delta) == new
+
+
+def test_random_pages():
+    rng = random.Random(1)
+    base = rng.randbytes(PAGE_SIZE * 50)
+    new = bytearray(base[:PAGE_SIZE * 60] + rng.randbytes(PAGE_SIZE * 10))
+    for _ in range(5):
+        start = rng.randrange(len(new))
+        new[start] ^= 0xFF
+    assert apply_delta(base, make_delta(base, bytes(new), PAGE_SIZE)) == new
+
+
+def test_sqlite_snapshots(snapshots):
+    base, new = snapshots
+    delta = make_delta(base, new, PAGE_SIZE)
+    assert len(delta) < len(new) // 2
+    assert apply_delta(base, delta) == new
+
+
+@pytest.mark.parametrize("base, new", [
+    (pages(1) + b"x", pages(1)),
+    (pages(1), pages(1, 2)[:-1]),
+])
+def test_page_size_mismatch(base, new):
+    with pytest.raises(DeltaError):
+        make_delta(base, new, PAGE_SIZE)
+
+
+def test_corrupt_header():
+    base = pages(1, 2)
+    delta = make_delta(base, pages(1, 3), PAGE_SIZE)
+    with pytest.raises(DeltaError, match="Not a database delta"):
+        apply_delta(base, b"XXXX" + delta[4:])
+    with pytest.raises(DeltaError, match="Truncated"):
+        apply_delta(base, delta[:-1])
+    with pytest.raises(DeltaError, match="Truncated"):
+        apply_delta(base, delta[:HEADER.size - 1])
+    # A wrong page size no longer matches the delta's length
+    with pytest.raises(DeltaError, match="Truncated"):
+        apply_delta(base, HEADER.pack(b"WIFD", PAGE_SIZE * 2, 2, 1) + delta[HEADER.size:])
+
+
+def test_page_number_out_of_range():
+    base = pages(1, 2)
+    delta = bytearray(make_delta(base, pages(1, 3), PAGE_SIZE))
+    delta[HEADER.size:HEADER.size + 4] = (7).to_bytes(4, "big")
+    with pytest.raises(DeltaError, match="past the end"):
+        apply_delta(base, bytes(delta))
+
+
+def run_js_decoder(tmp_path, base, delta):
+    if not shutil.which("node"):
+        pytest.skip("node is not installed")
+    paths = {name: tmp_path / name for name in ("js.base", "js.delta", "js.out")}
+    paths["js.base"].write_bytes(base)
+    paths["js.delta"].write_bytes(delta)
+    result = subprocess.run(["node", str(APPLY_DELTA_JS), str(DB_JS), *(str(p) for p in paths.values())],
+                            capture_output=True, text=True)
+    return result, paths["js.out"]
+
+
+@pytest.mark.parametrize("shape", ["sqlite", "growth", "shrinkage", "identical"])
+def test_js_decoder_matches_python_encoder(tmp_path, snapshots, shape):
+    base, new = {
+        "sqlite": snapshots,
+        "growth": (pages(1, 2), pages(1, 4, 5)),
+        "shrinkage": (pages(1, 2, 3), pages(6)),
+        "identical": (pages(1, 2), pages(1, 2)),
+    }[shape]
+    result, output = run_js_decoder(tmp_path, base, make_delta(base, new, PAGE_SIZE))
+    assert result.returncode == 0, result.stderr
+    assert output.read_bytes() == new
+
+
+def test_js_decoder_rejects_corrupt_deltas(tmp_path):
+    base = pages(1, 2)
+    delta = make_delta(base, pages(1, 3), PAGE_SIZE)
+    for corrupt, message in [(b"XXXX" + delta[4:], "Not a database delta"),
+                             (delta[:-1], "Truncated"),
+                             (delta[:10], "Truncated")]:
+        result, output = run_js_decoder(tmp_path, base, corrupt)
+        assert result.returncode == 1
+        assert message in result.stderr
+        assert not os.path.exists(output)
@@ -0,0 +1,93 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import enhancement_cache
+from enhancement_cache import EnhancementCache
+
+MODEL = "image-model"
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # Every call is a tick later, so last_used orders the entries even within one test
+    ticks = itertools.count(1)
+    monkeypatch.setattr(enhancement_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = EnhancementCache(tmp_path / "cache.sqlite", max_bytes=250)
+    yield c
+    c.close()
+
+
+def stored_bytes(cache):
+    return cache._count_bytes()
+
+
+def test_put_and_get(cache):
+    assert cache.get_generation("src", MODEL, "prompt") is None
+    cache.put_generation("src", MODEL, "prompt", b"image")
+    cache.put_analysis("src", "text-model", "describe", {"analysis": "A saree", "item_type": "saree"})
+
+    assert cache.get_generation("src", MODEL, "prompt") == b"image"
+    assert cache.get_generation("src", MODEL, "other prompt") is None
+    assert cache.get_generation("other", MODEL, "prompt") is None
+    assert cache.get_analysis("src", "text-model", "describe") == {"analysis": "A saree", "item_type": "saree"}
+    assert cache.stats == {"hits": 2, "misses": 3, "evicted": 0}
+    assert cache.total_bytes == stored_bytes(cache) == len(b"image") + len("A saree")
+
+
+def test_replacing_an_entry_counts_its_new_size(cache):
+    cache.put_generation("src", MODEL, "prompt", b"x" * 100)
+    cache.put_generation("src", MODEL, "prompt", b"x" * 30)
+    assert cache.total_bytes == stored_bytes(cache) == 30
+
+
+def test_evicts_least_recently_used_to_the_budget(cache):
+    for name in ("a", "b", "c"):
+        cache.put_generation(name, MODEL, "prompt", b"x" * 100)
+    # c went over 250 bytes; a, the oldest, made room
+    assert cache.get_generation("a", MODEL, "prompt") is None
+    assert cache.stats["evicted"] == 1
+    assert cache.total_bytes == stored_bytes(cache) == 200
+
+    # Reading b makes c the least recently used
+    assert cache.get_generation("b", MODEL, "prompt")
+    cache.put_generation("d", MODEL, "prompt", b"x" * 100)
+    assert cache.get_generation("c", MODEL, "prompt") is None
+    assert cache.get_generation("b", MODEL, "prompt")
+    assert cache.total_bytes == stored_bytes(cache) == 200
+
+
+def test_an_entry_bigger_than_the_budget_empties_the_cache(cache):
+    cache.put_generation("a", MODEL, "prompt", b"x" * 100)
+    cache.put_generation("b", MODEL, "prompt", b"x" * 300)
+    assert cache.total_bytes == stored_bytes(cache) == 0
+
+
+def test_invalidate(cache):
+    cache.put_generation("a", MODEL, "prompt", b"x" * 100)
+    cache.put_generation("b", "old-model", "prompt", b"x" * 50)
+    cache.put_analysis("a", "text-model", "describe", {"analysis": "y" * 20, "item_type": "kurta"})
+
+    assert cache.invalidate("old-model") == 1
+    assert cache.total_bytes == stored_bytes(cache) == 120
+    assert cache.get_generation("a", MODEL, "prompt")
+    assert cache.invalidate() == 2
+    assert cache.total_bytes == stored_bytes(cache) == 0
+
+
+def test_recount_picks_up_other_writers(tmp_path, monkeypatch):
+    monkeypatch.setattr(enhancement_cache, "RECOUNT_EVERY", 2)
+    first = EnhancementCache(tmp_path / "cache.sqlite", max_bytes=1000)
+    second = EnhancementCache(tmp_path / "cache.sqlite", max_bytes=1000)
+    second.put_generation("a", MODEL, "prompt", b"x" * 100)
+    first.put_generation("b", MODEL, "prompt", b"x" * 10)
+    assert first.total_bytes == 10
+    first.put_generation("c", MODEL, "prompt", b"x" * 10)
+    assert first.total_bytes == stored_bytes(first) == 120
+    first.close()
+    second.close()
@@ -0,0 +1,49 @@
+import pytest
+from PIL import Image
+
+import enhancement_candidates
+import enhancement_logic
+from enhancement_candidates import discard_candidates, list_candidates, promote_candidate, save_candidates
+from enhancement_logic import Gemini25ClothingEnhancer
+from model_backends import FakeBackend
+
+
+@pytest.fixture(autouse=True)
+def directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(enhancement_candidates, "OUTPUT_DIR", tmp_path / "shop_enhanced")
+    monkeypatch.setattr(enhancement_candidates, "CANDIDATES_DIR", tmp_path / "candidates")
+    (tmp_path / "shop_enhanced").mkdir()
+
+
+@pytest.fixture
+def enhancer(tmp_path, monkeypatch):
+    monkeypatch.setattr(enhancement_logic, "LOG_FILE", tmp_path / "enhancement.log")
+    monkeypatch.setenv("ENHANCE_SPANS_FILE", "")
+    Image.new("RGB", (60, 80), "crimson").save(tmp_path / "a.jpg")
+    return Gemini25ClothingEnhancer(backend=FakeBackend(latency=0))
+
+
+def test_candidates_of_the_fake_backend_differ(tmp_path, enhancer):
+    candidates = enhancer.enhance_candidates(tmp_path / "a.jpg", count=3)
+    assert len({outputs[".jpg"] for outputs in candidates}) == 3
+    assert save_candidates("a.jpg", candidates) == ["a.jpg.1.jpg", "a.jpg.2.jpg", "a.jpg.3.jpg"]
+
+
+def test_promote_replaces_the_enhanced_image(tmp_path, enhancer):
+    candidates = enhancer.enhance_candidates(tmp_path / "a.jpg", count=2)
+    save_candidates("a.jpg", candidates)
+    assert promote_candidate("a.jpg", 2) == tmp_path / "shop_enhanced" / "a.jpg"
+    assert (tmp_path / "shop_enhanced" / "a.jpg").read_bytes() == candidates[1][".jpg"]
+    assert list_candidates("a.jpg") == []
+    with pytest.raises(KeyError):
+        promote_candidate("a.jpg", 1)
+
+
+def test_saving_replaces_the_previous_set():
+    save_candidates("a.jpg", [{".jpg": b"1"}, {".jpg": b"2"}, {".jpg": b"3"}])
+    save_candidates("a.png", [{".png": b"other"}])
+    save_candidates("a.jpg", [{".jpg": b"new"}])
+    assert list_candidates("a.jpg") == ["a.jpg.1.jpg"]
+    discard_candidates("a.jpg")
+    assert list_candidates("a.jpg") == []
+    assert list_candidates("a.png") == ["a.png.1.png"]
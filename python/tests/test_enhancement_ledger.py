@@ -0,0 +1,111 @@
+import pytest
+
+import enhance_with_gemini_2_5
+from enhance_with_gemini_2_5 import get_image_files_to_process
+from enhancement_ledger import FAILED, PENDING, RUNNING, SUCCEEDED, EnhancementLedger
+from hash_index import HashIndex
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return tmp_path / "ledger.sqlite"
+
+
+def status(ledger, filename):
+    return ledger.jobs()[filename]["status"]
+
+
+def test_attempt_transitions(ledger_path):
+    ledger = EnhancementLedger(ledger_path)
+    ledger.enqueue("a.jpg", "hash-a")
+    assert status(ledger, "a.jpg") == PENDING
+    ledger.start("a.jpg", "hash-a")
+    assert status(ledger, "a.jpg") == RUNNING
+    ledger.finish("a.jpg", error="429 RESOURCE_EXHAUSTED")
+    job = ledger.jobs()["a.jpg"]
+    assert (job["status"], job["attempts"], job["error"]) == (FAILED, 1, "429 RESOURCE_EXHAUSTED")
+    assert job["duration"] >= 0
+    assert ledger.failures() == [("a.jpg", 1, "429 RESOURCE_EXHAUSTED")]
+
+    ledger.start("a.jpg", "hash-a")
+    ledger.finish("a.jpg")
+    job = ledger.jobs()["a.jpg"]
+    assert (job["status"], job["attempts"], job["error"]) == (SUCCEEDED, 2, None)
+    assert ledger.summary() == {SUCCEEDED: 1}
+    ledger.close()
+
+
+def test_resumable(ledger_path):
+    ledger = EnhancementLedger(ledger_path)
+    for name in ("failed.jpg", "exhausted.jpg", "running.jpg", "pending.jpg", "done.jpg"):
+        ledger.enqueue(name, "hash")
+    for _ in range(3):
+        ledger.start("exhausted.jpg", "hash")
+        ledger.finish("exhausted.jpg", error="refused")
+    ledger.start("failed.jpg", "hash")
+    ledger.finish("failed.jpg", error="refused")
+    ledger.start("running.jpg", "hash")
+    ledger.start("done.jpg", "hash")
+    ledger.finish("done.jpg")
+
+    # Work in progress belongs to this run, so only the failure with attempts left is resumable
+    assert ledger.resumable(max_attempts=3) == ["failed.jpg"]
+    ledger.close()
+
+    # Whatever an earlier run left pending or running was interrupted
+    ledger = EnhancementLedger(ledger_path)
+    assert ledger.resumable(max_attempts=3) == ["failed.jpg", "pending.jpg", "running.jpg"]
+    assert ledger.resumable(max_attempts=4) == ["exhausted.jpg", "failed.jpg", "pending.jpg", "running.jpg"]
+    ledger.close()
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    source_dir, output_dir = tmp_path / "shop", tmp_path / "shop_enhanced"
+    source_dir.mkdir()
+    output_dir.mkdir()
+    monkeypatch.setattr(enhance_with_gemini_2_5, "SOURCE_DIR", source_dir)
+    monkeypatch.setattr(enhance_with_gemini_2_5, "OUTPUT_DIR", output_dir)
+    return source_dir, output_dir
+
+
+def names(paths):
+    return [p.name for p in paths]
+
+
+def test_source_changes_are_detected(tmp_path, ledger_path, dirs):
+    source_dir, output_dir = dirs
+    for name in ("new.jpg", "old.jpg", "broken.jpg"):
+        (source_dir / name).write_bytes(name.encode())
+    # Enhanced before the ledger existed
+    (output_dir / "old.jpg").write_bytes(b"enhanced")
+    ledger = EnhancementLedger(ledger_path)
+    index = HashIndex(tmp_path / "index.sqlite")
+
+    assert names(get_image_files_to_process(ledger, index)) == ["broken.jpg", "new.jpg"]
+    assert status(ledger, "old.jpg") == SUCCEEDED
+    for name in ("broken.jpg", "new.jpg"):
+        ledger.start(name, ledger.jobs()[name]["source_hash"])
+    ledger.finish("new.jpg")
+    (output_dir / "new.jpg").write_bytes(b"enhanced")
+    ledger.finish("broken.jpg", error="refused")
+
+    # Done, adopted and failed images are left alone while their sources don't change
+    assert get_image_files_to_process(ledger, index) == []
+
+    # Unchanged sources were not read again
+    assert index.stats == {"cached": 3, "hashed": 3}
+
+    (source_dir / "new.jpg").write_bytes(b"retouched")
+    (source_dir / "broken.jpg").write_bytes(b"replaced")
+    previous_hash = ledger.jobs()["new.jpg"]["source_hash"]
+    assert names(get_image_files_to_process(ledger, index)) == ["broken.jpg", "new.jpg"]
+    job = ledger.jobs()["new.jpg"]
+    assert job["status"] == PENDING and job["source_hash"] != previous_hash
+    assert ledger.jobs()["broken.jpg"]["attempts"] == 0
+
+    # A missing output is made again, even for an unchanged source
+    (output_dir / "old.jpg").unlink()
+    assert "old.jpg" in names(get_image_files_to_process(ledger, index))
+    ledger.close()
+    index.close()
@@ -0,0 +1,64 @@
+import hashlib
+import os
+
+import pytest
+
+from hash_index import HashIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    i = HashIndex(tmp_path / "index.sqlite", workers=2)
+    yield i
+    i.close()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_unchanged_files_are_not_read_again(tmp_path, index):
+    paths = [tmp_path / name for name in ("a.jpg", "b.jpg")]
+    for path in paths:
+        path.write_bytes(path.name.encode())
+    assert index.digests(paths) == {str(p): sha256(p.name.encode()) for p in paths}
+    assert index.stats == {"cached": 0, "hashed": 2}
+
+    reopened = HashIndex(index.path)
+    assert reopened.digests(paths) == index.digests(paths)
+    assert reopened.stats == {"cached": 2, "hashed": 0}
+    reopened.close()
+
+
+def test_same_size_change_with_new_mtime_is_rehashed(tmp_path, index):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"before")
+    index.digests([path])
+    mtime_ns = path.stat().st_mtime_ns
+
+    path.write_bytes(b"after!")
+    os.utime(path, ns=(mtime_ns + 1_000_000_000, mtime_ns + 1_000_000_000))
+    assert index.digests([path]) == {str(path): sha256(b"after!")}
+    assert index.stats["hashed"] == 2
+
+
+def test_missing_files_are_left_out(tmp_path, index):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"a")
+    assert index.digests([path, tmp_path / "missing.jpg"]) == {str(path): sha256(b"a")}
+
+
+def test_large_lookups_read_the_whole_table(tmp_path, index, monkeypatch):
+    monkeypatch.setattr("hash_index.LOOKUP_BATCH", 2)
+    paths = [tmp_path / f"{i}.jpg" for i in range(5)]
+    for i, path in enumerate(paths):
+        path.write_bytes(bytes([i]))
+    index.digests(paths)
+    assert index.digests(paths) == {str(p): sha256(bytes([i])) for i, p in enumerate(paths)}
+    assert index.stats == {"cached": 5, "hashed": 5}
+
+
+def test_pair_scores_are_kept_per_version(index):
+    index.put_pair_scores({("a", "b"): {"score": 0.5}}, version=1)
+    assert index.pair_scores([("a", "b"), ("a", "c")], version=1) == {("a", "b"): {"score": 0.5}}
+    assert index.pair_scores([("a", "b")], version=2) == {}
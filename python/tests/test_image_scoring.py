@@ -0,0 +1,76 @@
+import pytest
+from PIL import Image, ImageDraw
+
+import image_scoring
+from hash_index import HashIndex
+from image_scoring import ReviewScorer, score_pair
+
+
+def product_photo(path, size=(300, 400), background="white", garment="crimson"):
+    image = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.rectangle([width // 4, height // 5, width * 3 // 4, height * 4 // 5], fill=garment)
+    draw.ellipse([width // 3, height // 10, width * 2 // 3, height // 4], fill="navy")
+    image.save(path, quality=90)
+    return path
+
+
+def test_identical_images_score_near_zero(tmp_path):
+    original = product_photo(tmp_path / "original.jpg")
+    scores = score_pair(original, original)
+    assert scores["score"] < 0.01
+    assert scores["ssim"] > 0.99
+    assert scores["histogram"] < 0.01
+    assert scores["edges"] < 0.01
+    assert scores["aspect"] == 0
+
+
+def test_bigger_changes_score_higher(tmp_path):
+    original = product_photo(tmp_path / "original.jpg")
+    studio = product_photo(tmp_path / "studio.jpg", background="lightgrey")
+    broken = product_photo(tmp_path / "broken.jpg", size=(400, 300), background="black", garment="green")
+    background_change = score_pair(original, studio)["score"]
+    assert 0.01 < background_change < score_pair(original, broken)["score"]
+
+
+@pytest.fixture
+def scorer(tmp_path):
+    shop_dir, enhanced_dir = tmp_path / "shop", tmp_path / "shop_enhanced"
+    shop_dir.mkdir()
+    enhanced_dir.mkdir()
+    for name in ("a.jpg", "b.jpg"):
+        product_photo(shop_dir / name)
+        product_photo(enhanced_dir / name, background="lightgrey")
+    return ReviewScorer(shop_dir, enhanced_dir, HashIndex(tmp_path / "index.sqlite"), workers=1)
+
+
+def test_scores_are_cached_until_a_file_changes(scorer, monkeypatch):
+    scored = []
+    score_pairs = image_scoring.score_pairs
+
+    def counting_score_pairs(pairs, workers):
+        scored.extend(pairs)
+        return score_pairs(pairs, workers)
+
+    monkeypatch.setattr(image_scoring, "score_pairs", counting_score_pairs)
+
+    first = scorer.scores(["a.jpg", "b.jpg", "missing.jpg"])
+    assert sorted(first) == ["a.jpg", "b.jpg"]
+    assert len(scored) == 2
+    assert scorer.scores(["a.jpg", "b.jpg"]) == first
+    assert len(scored) == 2
+
+    product_photo(scorer.enhanced_dir / "b.jpg", background="black")
+    second = scorer.scores(["a.jpg", "b.jpg"])
+    assert [pair[1] for pair in scored[2:]] == [str(scorer.enhanced_dir / "b.jpg")]
+    assert second["a.jpg"] == first["a.jpg"]
+    assert second["b.jpg"]["score"] > first["b.jpg"]["score"]
+
+
+def test_unreadable_pairs_are_logged_and_skipped(tmp_path, caplog):
+    original = product_photo(tmp_path / "original.jpg")
+    (tmp_path / "broken.jpg").write_bytes(b"not an image")
+    assert image_scoring.score_pairs([(original, original), (tmp_path / "broken.jpg", original)], workers=1)[1] is None
+    assert [r.levelname for r in caplog.records] == ["WARNING"]
+    assert "Could not score broken.jpg" in caplog.text
@@ -0,0 +1,106 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import shared_state
+from metrics import Counter, Gauge, Histogram, Registry
+from shared_state import EXITED_PROCESSES, SharedState
+
+
+def make_registry():
+    registry = Registry()
+    registry.register(Counter("jobs_total", "Jobs.", ("status",)))
+    registry.register(Gauge("in_flight", "In flight."))
+    registry.register(Histogram("seconds", "Seconds.", buckets=(1, 10)))
+    return registry
+
+
+def record(registry, jobs=0, in_flight=0, seconds=()):
+    jobs_total, gauge, histogram = registry.metrics
+    if jobs:
+        jobs_total.inc(jobs, status="ok")
+    gauge.set(in_flight)
+    for value in seconds:
+        histogram.observe(value)
+
+
+def samples(registry):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in registry.render().splitlines() if not line.startswith("#")}
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_merged_sums_every_kind():
+    first, second = make_registry(), make_registry()
+    record(first, jobs=2, in_flight=1, seconds=[0.5])
+    record(second, jobs=3, in_flight=2, seconds=[5, 50])
+    merged = samples(make_registry().merged([first.state(), second.state()]))
+    assert merged['jobs_total{status="ok"}'] == 5
+    assert merged["in_flight"] == 3
+    assert merged['seconds_bucket{le="1"}'] == 1
+    assert merged['seconds_bucket{le="10"}'] == 2
+    assert merged['seconds_bucket{le="+Inf"}'] == 3
+    assert merged["seconds_sum"] == 55.5
+
+
+def test_merged_ignores_unknown_metrics_and_other_buckets():
+    state = make_registry().state()
+    state["removed_total"] = [[[], 4]]
+    state["seconds"] = [[[], [1, 1, 1], 1.0, 1]]
+    assert samples(make_registry().merged([state])) == {}
+
+
+@pytest.fixture
+def state(tmp_path):
+    s = SharedState(tmp_path / "state.sqlite")
+    yield s
+    s.close()
+
+
+def insert_metrics(state, pid, registry, started_at=1.0):
+    with state.transaction() as conn:
+        conn.execute("INSERT INTO process_metrics (pid, started_at, metrics, updated_at) VALUES (?, ?, ?, 0)",
+                     (pid, started_at, json.dumps(registry.state())))
+
+
+def test_exchange_sums_all_workers(state):
+    other, own = make_registry(), make_registry()
+    record(other, jobs=2, in_flight=1)
+    record(own, jobs=1, in_flight=1, seconds=[2])
+    # The parent (pytest's runner) stands in for another live worker
+    insert_metrics(state, os.getppid(), other)
+    merged = samples(state.exchange_metrics(own))
+    assert merged['jobs_total{status="ok"}'] == 3
+    assert merged["in_flight"] == 2
+    assert merged["seconds_count"] == 1
+    # Exchanging again replaces this process's row instead of adding to it
+    assert samples(state.exchange_metrics(own))['jobs_total{status="ok"}'] == 3
+
+
+def test_exited_workers_keep_their_counters(state):
+    gone, own = make_registry(), make_registry()
+    record(gone, jobs=4, in_flight=3, seconds=[0.5])
+    insert_metrics(state, dead_pid(), gone)
+    # A row left by an earlier process that had this process's pid
+    insert_metrics(state, os.getpid(), gone, started_at=shared_state.PROCESS_STARTED - 100)
+    record(own, in_flight=1)
+
+    merged = samples(state.exchange_metrics(own))
+    assert merged['jobs_total{status="ok"}'] == 8
+    assert merged["seconds_count"] == 2
+    assert merged["in_flight"] == 1
+    with state.transaction(write=False) as conn:
+        pids = sorted(pid for (pid,) in conn.execute("SELECT pid FROM process_metrics"))
+    assert pids == sorted([EXITED_PROCESSES, os.getpid()])
+
+    # Folded once: later exchanges neither lose nor double the exited totals
+    record(own, jobs=1)
+    assert samples(state.exchange_metrics(own))['jobs_total{status="ok"}'] == 9
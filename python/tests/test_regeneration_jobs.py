@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+
+import pytest
+
+from regeneration_jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, RegenerationJob, RegenerationJobs
+from shared_state import SharedState
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(tmp_path / "state.sqlite")
+
+
+@pytest.fixture
+def jobs(tmp_path, state):
+    j = RegenerationJobs(tmp_path, state, workers=1)
+    yield j
+    j.executor.shutdown(wait=True)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def insert_job(state, owner_pid, filename="a.jpg", status=RUNNING, **fields):
+    """A job as another server process would have stored it."""
+    job = RegenerationJob(id="", filename=filename, prompt="", fresh=True, status=status,
+                          created_at=time.time(), **fields)
+    with state.transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO regeneration_jobs (filename, status, owner_pid, job, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (filename, status, owner_pid, "{}", job.created_at))
+        job.id = str(cursor.lastrowid)
+        conn.execute("UPDATE regeneration_jobs SET job = ? WHERE id = ?", (json.dumps(asdict(job)), job.id))
+    return job
+
+
+class FakeEnhancer:
+    def __init__(self):
+        self.calls = []
+        self.logger = logging.getLogger(__name__)
+
+    def enhance(self, image_path, prompt, reuse_cached):
+        self.calls.append((image_path.name, prompt, reuse_cached))
+        return {".jpg": b"enhanced"}
+
+    def save_enhanced(self, image_path, outputs):
+        pass
+
+
+def test_jobs_of_a_dead_process_are_marked_failed(jobs, state):
+    job = insert_job(state, dead_pid())
+    with state.transaction() as conn:
+        assert jobs._active_jobs(conn) == []
+    stored = jobs.get(job.id)
+    assert stored["status"] == FAILED
+    assert stored["error"] == "The server process running it exited"
+    assert stored["finished_at"] is not None
+    # Subscribers in every process hear about it
+    assert state.events_after("job_events", 0)[-1][1]["status"] == FAILED
+
+
+def test_identical_request_of_another_process_is_reused(jobs, state):
+    # The parent (pytest's runner) stands in for another live server process
+    job = insert_job(state, os.getppid(), status=QUEUED)
+    assert jobs.submit("a.jpg", "", fresh=True).id == job.id
+    assert jobs.get(job.id)["status"] == QUEUED
+    assert len(jobs.list()) == 1
+
+
+def test_submit_runs_the_job(jobs, state):
+    jobs.enhancer = FakeEnhancer()
+    insert_job(state, dead_pid())
+    job = jobs.submit("a.jpg", "brighter", fresh=True)
+    jobs.executor.shutdown(wait=True)
+    assert jobs.get(job.id)["status"] == SUCCEEDED
+    assert jobs.enhancer.calls == [("a.jpg", "brighter", False)]
+    assert [j["status"] for j in jobs.list()] == [FAILED, SUCCEEDED]
@@ -0,0 +1,66 @@
+import pytest
+
+from hash_index import HashIndex
+from review_queue import ReviewQueue
+from shared_state import SharedState
+
+
+@pytest.fixture
+def queue(tmp_path):
+    shop_dir, enhanced_dir = tmp_path / "shop", tmp_path / "shop_enhanced"
+    shop_dir.mkdir()
+    enhanced_dir.mkdir()
+    return ReviewQueue(shop_dir, enhanced_dir, HashIndex(tmp_path / "index.sqlite"),
+                       SharedState(tmp_path / "state.sqlite"))
+
+
+def events(queue, after=0):
+    return queue.state.events_after("review_events", after)
+
+
+def write_pair(queue, filename, original, enhanced):
+    (queue.shop_dir / filename).write_bytes(original)
+    (queue.enhanced_dir / filename).write_bytes(enhanced)
+
+
+def test_apply_records_added_removed_and_changed(queue):
+    queue._apply(None, {"a.jpg", "b.jpg"})
+    assert events(queue) == [(1, {"added": ["a.jpg", "b.jpg"], "removed": [], "changed": []})]
+
+    # Only the checked names are replaced; b.jpg stays in the queue
+    queue._apply(["a.jpg", "c.jpg"], {"c.jpg"})
+    assert events(queue, 1) == [(2, {"added": ["c.jpg"], "removed": ["a.jpg"], "changed": []})]
+
+    queue._apply(["b.jpg", "c.jpg"], {"b.jpg", "c.jpg"}, report_changed=True)
+    assert events(queue, 2) == [(3, {"added": [], "removed": [], "changed": ["b.jpg", "c.jpg"]})]
+    assert queue.snapshot() == {"version": 3, "images": ["b.jpg", "c.jpg"]}
+
+
+def test_apply_without_changes_records_nothing(queue):
+    queue._apply(None, {"a.jpg"})
+    queue._apply(None, {"a.jpg"})
+    queue._apply(["b.jpg"], set())
+    assert queue.snapshot() == {"version": 1, "images": ["a.jpg"]}
+
+
+def test_scan_and_refresh(queue):
+    write_pair(queue, "same.jpg", b"same", b"same")
+    write_pair(queue, "resized.jpg", b"small", b"much larger")
+    write_pair(queue, "retouched.jpg", b"before", b"after!")
+    (queue.shop_dir / "original-only.jpg").write_bytes(b"x")
+    queue.scan()
+    assert queue.snapshot()["images"] == ["resized.jpg", "retouched.jpg"]
+
+    # Copying the enhanced version over the original makes them equal
+    (queue.shop_dir / "retouched.jpg").write_bytes(b"after!")
+    write_pair(queue, "same.jpg", b"same", b"edited")
+    queue.refresh(["retouched.jpg", "same.jpg", "resized.jpg", "../escape.jpg"])
+    assert events(queue)[-1][1] == {"added": ["same.jpg"], "removed": ["retouched.jpg"], "changed": ["resized.jpg"]}
+    assert queue.snapshot()["images"] == ["resized.jpg", "same.jpg"]
+
+
+def test_queue_is_shared_between_processes(tmp_path, queue):
+    queue._apply(None, {"a.jpg"})
+    other = ReviewQueue(queue.shop_dir, queue.enhanced_dir, HashIndex(tmp_path / "index.sqlite"),
+                        SharedState(tmp_path / "state.sqlite"))
+    assert other.snapshot() == queue.snapshot()
@@ -1,9 +1,7 @@
 cd data
 
 sqlite3 data.db "PRAGMA wal_checkpoint"
-sqlite3 data.db "VACUUM"
-sqlite3 data.db "PRAGMA wal_checkpoint"
-sqlite3 data.db "PRAGMA optimize"
 
-rm ../../wif.db.sqlite
-cp data.db ../../wif.db.sqlite
\ No newline at end of file
+# Build a vacuumed, content-addressed snapshot next to the served database and
+# swap it in atomically, so a browser never fetches a half-copied file.
+python3 ../python/publish.py data.db ../..